@@ -1,11 +1,18 @@
 import configparser
+import csv
+import gzip
+import json
 import os
 import base64
 import logging
+import sqlite3
+import tempfile
+import threading
 import warnings
 from pathlib import Path
-from datetime import datetime
-from flask import Flask, render_template, request, send_file
+from datetime import date, datetime
+from flask import Flask, abort, render_template, request, send_file
+from max_min_store import COLUMNS, MaxMinStore
 
 """A small Flask web application that provides a settings web page. Settings 
 for various MetOffice WoW parameters (site ID, passcode enable/disable) along
@@ -33,6 +40,20 @@ config_location = '/data/config.ini'
 calibration_date = ' '
 recalibrate = 'false'
 
+# Saves of the config file are made one at a time (waitress serves requests
+# from several threads) so that each gets the next version number.
+config_lock = threading.Lock()
+
+# History of the max/min reports sent to WoW (recorded by the WoW service)
+max_min_store_location = (os.getenv('MAXMIN_STORE') or
+                          '/data/max-min-temp.db')
+max_min_store = None
+# Exports of the max/min history, kept until the history changes
+export_directory = os.path.join(tempfile.gettempdir(), 'max-min-exports')
+EXPORTS_KEPT = 20
+# Reports shown per page of the max/min history page
+HISTORY_PAGE_SIZE = 31
+
 app = Flask(__name__)
 
 app.config.from_object(__name__)
@@ -80,19 +101,17 @@ def get_settings():
         # Ascertain if the instrument is out of calibration
         recalibrate = check_recalibration(calibration_date)
 
-        # Get the configparser object
-        config_object = configparser.ConfigParser()
-
         # We need 2 sections in the config file, let's call them WOW
         # and CALIBRATION. "auth_code" though not a password, is slightly
         # sensitive so is converted to a bse64 string to avoid storing this
         # in plain text in the config.ini file.
-        config_object["WOW"] = {
+        sections = {}
+        sections["WOW"] = {
             "site_id": site_id,
             "auth_code": encode64(auth_code),
             "wow_enable": wow_enable,
         }
-        config_object["CALIBRATION"] = {
+        sections["CALIBRATION"] = {
             "serial_no": serial_no,
             "calibration_date": calibration_date,
             "corr_M30": corr_M30,
@@ -108,9 +127,9 @@ def get_settings():
         message = '** Configuration applied ** '
 
         try:
-            with open(config_location, 'w') as conf:
-                config_object.write(conf)
-        except FileNotFoundError:
+            version = save_config(sections)
+            logging.info('Config file saved (version ' + str(version) + ')')
+        except OSError:
             warnings.warn('Configuration web page - '
                           'unable to write config file')
 
@@ -202,6 +221,72 @@ def internal_error(error):
                            sensor_name=sensor_name, error=error), 500
 
 
+# Copy of write_config in hmt333/config_handler.py (the services are built
+# separately) - make any change to both.
+def write_config(config_object, config_location, replace=True):
+    """Write a config file atomically: the config is written to a temporary
+    file in the same directory, flushed to disk and then renamed over (or,
+    if replace is False, linked to) the config file, so readers see either
+    the old or the new file complete, never a partly written one.
+    :param config_object: The ConfigParser to write.
+    :param config_location: Location of the config file.
+    :param replace: False to leave an existing config file alone.
+    :return: True if the file was written."""
+    directory = os.path.dirname(config_location) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix='.config-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as conf:
+            config_object.write(conf)
+            conf.flush()
+            os.fsync(conf.fileno())
+        os.chmod(temp_path, 0o644)
+        if replace:
+            os.replace(temp_path, config_location)
+        else:
+            try:
+                os.link(temp_path, config_location)
+            except FileExistsError:
+                return False
+            finally:
+                os.unlink(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return True
+
+
+def save_config(sections):
+    """
+    Save settings to the config file. The file is never rewritten in place:
+    the new file is written to a temporary file, flushed to disk and renamed
+    over the old one, so the other services (which read the file from the
+    shared volume) see either the old or the new settings complete, never
+    a partly written file. Sections not set here (e.g. the calibration of
+    other sensors) are kept, and the version number in the META section is
+    incremented so readers can tell which settings they have.
+    param sections: Dictionary of section names and their settings.
+    :return: The new version number.
+    """
+    with config_lock:
+        config_object = configparser.ConfigParser()
+        config_object.read(config_location)
+        version = config_object.getint('META', 'version', fallback=0) + 1
+        for name, values in sections.items():
+            config_object[name] = values
+        config_object['META'] = {'version': str(version)}
+
+        write_config(config_object, config_location)
+    return version
+
+
 def check_recalibration(calib_date):
     """
     Checks if today's date after the instrument calibration due date (the
@@ -253,10 +338,166 @@ def decode64(base64_message):
     return message
 
 
+def get_max_min_store():
+    """
+    Get the max/min report history, opening it on first use.
+    :return: The MaxMinStore, or None if it can't be opened.
+    """
+    global max_min_store
+    if max_min_store is None:
+        try:
+            max_min_store = MaxMinStore(max_min_store_location)
+        except sqlite3.Error as error:
+            warnings.warn('Unable to open max/min history: ' + str(error))
+    return max_min_store
+
+
+def date_range():
+    """
+    Get the date range (start and end, YYYY-MM-DD) of a request for max/min
+    reports. A request with an invalid date is rejected (400 error).
+    :return: The start and end dates, None if not given.
+    """
+    dates = []
+    for name in ('start', 'end'):
+        value = request.args.get(name) or None
+        if value is not None:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                abort(400)
+        dates.append(value)
+    return dates
+
+
 @app.route('/download')
 def download_file():
-    path = '/data/max-min-temp.csv'  # Set the path to your file here
-    return send_file(path, as_attachment=True)
+    """
+    Download the max/min report history as CSV (the default) or JSON
+    (format=json), optionally for a range of dates (start and/or end,
+    YYYY-MM-DD) e.g. /download?start=2023-03-01&end=2023-03-31&format=json
+    The export is written to a file a report at a time (so in constant
+    memory, however long the history) and the file is kept until the
+    history changes, so repeated downloads are cheap and resumed (range) and
+    conditional (If-None-Match/If-Modified-Since) requests are answered
+    from it. The file is sent gzip compressed if the client accepts that.
+    :return: The export file.
+    """
+    start, end = date_range()
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'json'):
+        abort(400)
+    store = get_max_min_store()
+    if store is None:
+        abort(404)
+    version, modified = store.version()
+    compress = 'gzip' in request.accept_encodings
+
+    name = '-'.join(['max-min', str(version), start or 'first',
+                     end or 'last']) + '.' + export_format
+    if compress:
+        name += '.gz'
+    path = os.path.join(export_directory, name)
+    if not os.path.isfile(path):
+        write_export(path, store.rows(start, end), export_format, compress)
+
+    download_name = 'max-min-temp'
+    if start or end:
+        download_name += '-' + (start or '') + '-' + (end or '')
+    response = send_file(
+        path, mimetype='text/csv' if export_format == 'csv'
+        else 'application/json', as_attachment=True,
+        download_name=download_name + '.' + export_format, conditional=True,
+        etag=name, last_modified=modified or None, max_age=0)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def write_export(path, rows, export_format, compress):
+    """
+    Write an export of max/min reports to a file (via a temporary file, so
+    a partly written export is never sent). Older exports are removed.
+    param path: Location of the export file.
+    param rows: Iterator of the reports.
+    param export_format: 'csv' or 'json'.
+    param compress: True to gzip the file.
+    """
+    os.makedirs(export_directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=export_directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        if compress:
+            file = gzip.open(temp_path, 'wt', newline='')
+        else:
+            file = open(temp_path, 'w', newline='')
+        with file:
+            if export_format == 'csv':
+                writer = csv.writer(file)
+                writer.writerow(COLUMNS)
+                writer.writerows(rows)
+            else:
+                file.write('{"fields": ' + json.dumps(COLUMNS) +
+                           ', "rows": [')
+                separator = '\n'
+                for row in rows:
+                    file.write(separator + json.dumps(row))
+                    separator = ',\n'
+                file.write('\n]}\n')
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    version = os.path.basename(path).split('-')[2]
+    exports = sorted((entry for entry in os.scandir(export_directory)
+                      if entry.name.startswith('max-min-')),
+                     key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for number, entry in enumerate(exports):
+        if number >= EXPORTS_KEPT or entry.name.split('-')[2] != version:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+@app.route('/history')
+def max_min_history():
+    """
+    Return a page of the max/min report history, newest first, optionally
+    for a range of dates (start and/or end, YYYY-MM-DD). Pages are found
+    from the report time at the edge of the current page ('before' for
+    older reports, 'after' for newer ones) so each page is read with an
+    index search rather than by counting through the earlier pages.
+    :return: The max/min history web page.
+    """
+    start, end = date_range()
+    before = request.args.get('before')
+    after = request.args.get('after')
+    store = get_max_min_store()
+    rows, older, newer = [], None, None
+    if store is not None:
+        if after:
+            rows = list(store.rows(start, end, after=after,
+                                   limit=HISTORY_PAGE_SIZE + 1))
+            more = len(rows) > HISTORY_PAGE_SIZE
+            rows = rows[:HISTORY_PAGE_SIZE][::-1]
+            if rows:
+                older = rows[-1][0]
+                newer = rows[0][0] if more else None
+        else:
+            rows = list(store.rows(start, end, before=before,
+                                   limit=HISTORY_PAGE_SIZE + 1,
+                                   descending=True))
+            more = len(rows) > HISTORY_PAGE_SIZE
+            rows = rows[:HISTORY_PAGE_SIZE]
+            if rows:
+                older = rows[-1][0] if more else None
+                newer = rows[0][0] if before else None
+    return render_template('history.html', rows=rows, columns=COLUMNS,
+                           start=start or '', end=end or '', older=older,
+                           newer=newer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""Frame decoder benchmark: decodes a large corpus of sensor output frames
+and reports the number of frames decoded per second, for the bytes frame
+decoder and for the string based decoding it replaced.
+
+The corpus is either a capture of real sensor output (one frame per line,
+e.g. recorded with 'cat /dev/ttyUSB0 > capture.txt') given with --capture,
+or is generated: well formed frames in the formats the sensor can be set to
+output, mixed with the kinds of corrupted frames seen over the radio link
+(truncated lines, flipped bits, inserted noise), command echoes, replies and
+errors.
+
+Usage: python benchmarks/bench_frame_decoder.py [--frames N]
+       [--capture FILE] [--repeat N]"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_decoder import decode_frame  # noqa: E402
+
+FORMATS = [
+    b"T= %5.1f 'C\r\n",
+    b"T=%6.1f 'C\r\n",
+    b"T= %5.2f 'C\r\n",
+    b"T= %5.1f 'C RH= 45.6 %%RH Td=  3.2 'C\r\n",
+]
+OTHER_FRAMES = [b'send\r\n', b'ECHO : OFF\r\n', b'Unknown command\r\n',
+                b'\r\n', b'']
+
+
+def corrupt(frame, rng):
+    """Corrupt a frame in one of the ways seen over the radio link."""
+    choice = rng.randrange(3)
+    if choice == 0:
+        return frame[:rng.randrange(len(frame))]
+    frame = bytearray(frame)
+    if choice == 1:
+        position = rng.randrange(len(frame))
+        frame[position] ^= 1 << rng.randrange(8)
+    else:
+        position = rng.randrange(len(frame))
+        frame[position:position] = bytes(
+            rng.randrange(256) for _ in range(rng.randint(1, 4)))
+    return bytes(frame)
+
+
+def generate_corpus(number, seed=333, corrupt_fraction=0.1,
+                    other_fraction=0.02):
+    """Generate a corpus of frames (see module docstring).
+    :return: A list of frames (bytes)."""
+    rng = random.Random(seed)
+    frames = []
+    temperature = 10.0
+    for _ in range(number):
+        temperature = min(max(temperature + rng.gauss(0, 0.2), -30), 45)
+        chance = rng.random()
+        if chance < other_fraction:
+            frames.append(rng.choice(OTHER_FRAMES))
+            continue
+        frame = rng.choice(FORMATS) % temperature
+        if chance < other_fraction + corrupt_fraction:
+            frame = corrupt(frame, rng)
+        frames.append(frame)
+    return frames
+
+
+def load_capture(path):
+    """:return: The frames (lines) of a capture file."""
+    with open(path, 'rb') as capture:
+        return capture.read().splitlines(keepends=True)
+
+
+def legacy_decode(data_bytes):
+    """The string based decoding the frame decoder replaced, for
+    comparison."""
+    data_line = str(data_bytes)
+    if len(data_line) > 3:
+        if "send" in data_line:
+            return 'command echo', None
+        elif "Echo" in data_line:
+            return 'reply', None
+        elif "T=" and "C" and "." in data_line:
+            data_search_exp = '[-+]? (?: (?: \\d* \\. \\d+ ) | ' \
+                              '(?: \\d+ \\.? ) )(?:[Ee] [+-]? \\d+ ) ?'
+            data = re.compile(data_search_exp, re.VERBOSE).findall(data_line)
+            if len(data) == 1:
+                return 'data', round(float(data[0]), 1)
+        return 'invalid', None
+    return 'empty', None
+
+
+def measure(decoder, frames, repeat):
+    """Decode the corpus repeat times.
+    :return: The best rate (frames per second) and the number of frames of
+    each class."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            decoder(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    counts = {}
+    for frame in frames:
+        kind = decoder(frame)[0]
+        counts[kind] = counts.get(kind, 0) + 1
+    return len(frames) / best, counts
+
+
+def run(frames, repeat=3):
+    """Run the benchmark.
+    :return: A dictionary of results by decoder."""
+    results = {}
+    for name, decoder in (('frame_decoder', decode_frame),
+                          ('legacy', legacy_decode)):
+        rate, counts = measure(decoder, frames, repeat)
+        results[name] = {'frames_per_second': round(rate), 'classes': counts}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=200000,
+                        help='number of frames to generate')
+    parser.add_argument('--capture', help='capture file to use instead')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = load_capture(args.capture) if args.capture \
+        else generate_corpus(args.frames)
+    results = run(frames, args.repeat)
+    print('Frames: ' + str(len(frames)))
+    for name, result in results.items():
+        print(name + ': ' + format(result['frames_per_second'], ',') +
+              ' frames/s ' + str(result['classes']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+"""Benchmark suite for the hot paths from serial frame to WoW message:
+frame decoding, calibration, max/min tracking at 1k, 100k and 1M stored
+readings, building and serialising the latest reading, HTTP requests to
+the hmt333 service from concurrent clients, building the WoW message and
+the service's start-up (time to its first HTTP response and to its first
+reading when its process is started, as after a container restart).
+
+Each benchmark reports its throughput (operations per second), p50 and p99
+latency and the peak memory allocated (measured with tracemalloc in a
+separate run, so it doesn't slow the timings). Results are written as JSON
+and compared against a stored baseline (benchmarks/baseline.json); any
+benchmark whose throughput or p99 latency is worse than the baseline by
+more than the threshold is reported as a regression.
+
+Usage: python benchmarks/run_benchmarks.py [--quick] [--output FILE]
+       [--baseline FILE] [--save-baseline] [--threshold 0.25]
+       [--only NAME ...]
+The sensor used by the service benchmarks is simulated (see
+hmt_simulator.py)."""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(
+    BENCHMARK_DIR)), 'metoffice-wow-prod'))
+
+# Keep the service modules' files out of the way and stop hmt_service
+# starting its server when imported.
+WORK_DIR = tempfile.mkdtemp(prefix='hmt-bench-')
+os.environ.update(
+    HMT333_ENABLE='false',
+    TEMPS_JOURNAL=os.path.join(WORK_DIR, 'temps.journal'),
+    HISTORY_PATH=os.path.join(WORK_DIR, 'history.journal'),
+    SERIES_PATH=os.path.join(WORK_DIR, 'series'))
+
+import logging  # noqa: E402
+import warnings  # noqa: E402
+
+from bench_frame_decoder import generate_corpus  # noqa: E402
+from config_handler import ConfigHandler  # noqa: E402
+from frame_decoder import decode_frame  # noqa: E402
+from hmt_ascii import HmtAscii  # noqa: E402
+from max_min_temp import MaxMinTemp  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+
+def summarise(samples, elapsed, peak_memory=None):
+    """Summarise the timings of a benchmark.
+    :param samples: Latency of each operation (seconds).
+    :param elapsed: Total time taken (seconds).
+    :param peak_memory: Peak memory allocated (bytes).
+    :return: Dictionary of results."""
+    samples = sorted(samples)
+    return {
+        'operations': len(samples),
+        'ops_per_second': round(len(samples) / elapsed, 1),
+        'p50_us': round(samples[len(samples) // 2] * 1e6, 3),
+        'p99_us': round(samples[min(len(samples) - 1,
+                                    int(len(samples) * 0.99))] * 1e6, 3),
+        'mean_us': round(statistics.fmean(samples) * 1e6, 3),
+        'peak_memory_kib': None if peak_memory is None
+        else round(peak_memory / 1024, 1)
+    }
+
+
+def time_operations(operation, arguments):
+    """Time an operation once for each of the arguments.
+    :return: The latency of each operation and the total time (seconds)."""
+    clock = time.perf_counter
+    samples = []
+    append = samples.append
+    start = clock()
+    for argument in arguments:
+        operation_start = clock()
+        operation(argument)
+        append(clock() - operation_start)
+    return samples, clock() - start
+
+
+def peak_memory(setup, operation, arguments):
+    """Measure the peak memory allocated setting up and running a
+    benchmark (bytes)."""
+    tracemalloc.start()
+    try:
+        state = setup()
+        for argument in arguments:
+            operation(state, argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(setup, operation, arguments, memory_arguments=None):
+    """Run a benchmark: time the operation for each argument, then measure
+    the peak memory in a separate run.
+    :param setup: Function returning the state passed to the operation.
+    :param operation: Function taking the state and an argument.
+    :param arguments: The arguments to time the operation with.
+    :param memory_arguments: The (fewer) arguments to use for the memory
+    measurement, default all of them.
+    :return: Dictionary of results."""
+    state = setup()
+    samples, elapsed = time_operations(
+        lambda argument: operation(state, argument), arguments)
+    memory = peak_memory(
+        setup, operation,
+        arguments if memory_arguments is None else memory_arguments)
+    return summarise(samples, elapsed, memory)
+
+
+def frames(number):
+    """A corpus of frames of the given size (see bench_frame_decoder)."""
+    corpus = generate_corpus(min(number, 100000))
+    return (corpus * (number // len(corpus) + 1))[:number]
+
+
+def bench_decoding(scale):
+    number = int(200000 * scale)
+    corpus = frames(number)
+    text = [str(frame) for frame in corpus]
+    return {
+        'decode_frame': run_benchmark(
+            lambda: None, lambda state, frame: decode_frame(frame), corpus),
+        'data_decoder': run_benchmark(
+            lambda: None, lambda state, frame: HmtAscii.data_decoder(frame),
+            corpus),
+        'find_numeric_data': run_benchmark(
+            lambda: None,
+            lambda state, line: HmtAscii.find_numeric_data(line), text),
+    }
+
+
+def bench_calibration(scale):
+    config_location = os.path.join(WORK_DIR, 'config.ini')
+    ConfigHandler.create_config(config_location)
+    count = int(200000 * scale)
+    temperatures = [-30 + (i % 8000) / 100 for i in range(count)]
+
+    def setup():
+        handler = ConfigHandler(config_location)
+        handler.set_calibration_coefficients()
+        return handler
+    return {'apply_calibration': run_benchmark(
+        setup, lambda handler, temperature: handler.apply_calibration(
+            temperature), temperatures)}
+
+
+def bench_max_min(scale):
+    results = {}
+    calls = [10 + (i % 200) / 10 for i in range(int(20000 * scale))]
+    for points in (1000, 100000, 1000000):
+        def setup(points=points):
+            path = os.path.join(WORK_DIR, 'maxmin-' + str(points) +
+                                '.journal')
+            if os.path.exists(path):
+                os.remove(path)
+            handler = MaxMinTemp(path)
+            handler.scheduler.shutdown(wait=False)
+            # Readings accumulated over the last day
+            now = time.time()
+            step = 86000.0 / points
+            update = handler.extremes.update
+            for i in range(points):
+                update(10 + (i % 200) / 10, now - 86000 + i * step)
+            return handler
+        results['max_temp_calc_' + str(points)] = run_benchmark(
+            setup, lambda handler, temperature: handler.max_temp_calc(
+                temperature), calls, calls[:1000])
+    return results
+
+
+class ServiceFixture:
+    """An hmt333 service reading a simulated sensor, with its HTTP server
+    running on an ephemeral port."""
+
+    def __init__(self):
+        from hmt_simulator import HmtSimulator, constant
+        import hmt_service
+
+        self.simulator = HmtSimulator(profile=constant(12.3))
+        os.environ['HMT333_PORT'] = self.simulator.port
+        os.environ['DATA_POLL_INTERVAL'] = '1'
+        self.service = hmt_service.HMTservice()
+        self.service.initialise_sensors()
+        # The request handler uses the module's service instance (as when
+        # hmt_service is run)
+        hmt_service.HMTservice = self.service
+        deadline = time.monotonic() + 10
+        while self.service.sensor.sequence < 1:
+            if time.monotonic() > deadline:
+                raise RuntimeError('No reading from the simulated sensor')
+            time.sleep(0.05)
+        self.server = hmt_service.HMT333server(('127.0.0.1', 0),
+                                               hmt_service.HMT333http)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        for sensor in self.service.sensors.values():
+            sensor.stop()
+        self.simulator.close()
+
+
+def bench_service(scale, fixture):
+    service = fixture.service
+    number = int(50000 * scale)
+    return {
+        'get_data_json': run_benchmark(
+            lambda: service, lambda service, i: json.dumps(
+                service.get_data()), range(number)),
+        'get_response': run_benchmark(
+            lambda: service, lambda service, i: service.get_response('/'),
+            range(number)),
+    }
+
+
+def http_client(port, requests, samples, barrier):
+    """Make requests over one keep-alive connection, recording the latency
+    of each."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    clock = time.perf_counter
+    barrier.wait()
+    for _ in range(requests):
+        start = clock()
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        response.read()
+        samples.append(clock() - start)
+    connection.close()
+
+
+def bench_http(scale, fixture):
+    results = {}
+    for clients in (1, 8, 32):
+        requests = max(10, int(2000 * scale / clients))
+        samples = []
+        barrier = threading.Barrier(clients + 1)
+        threads = [threading.Thread(
+            target=http_client,
+            args=(fixture.port, requests, samples, barrier))
+            for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        results['http_get_' + str(clients) + '_clients'] = summarise(
+            samples, time.perf_counter() - start)
+    return results
+
+
+def bench_wow(scale):
+    try:
+        from wow_client import Observation, build_wow_message
+    except ImportError as error:
+        return {'wow_message': {'skipped': str(error)}}
+    observation = Observation(12.3, 15.1, 4.2, 3.0, 1440)
+    return {'wow_message': run_benchmark(
+        lambda: observation, lambda observation, i: json.dumps(
+            build_wow_message('1234', '123456', observation, max_temp=True,
+                              min_temp=True)), range(int(50000 * scale)))}
+
+
+def wait_for_health(port, start, ready, timeout=30):
+    """Poll the service's /health until it answers (or, if ready is True,
+    until it answers 200 i.e. the service has its first reading).
+    :param start: When the service was started (perf_counter seconds).
+    :return: The time taken since the start (seconds)."""
+    while time.perf_counter() - start < timeout:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=5)
+            connection.request('GET', '/health')
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if not ready or response.status == 200:
+                return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.002)
+    raise RuntimeError('The service did not start in ' + str(timeout) +
+                       ' s')
+
+
+def bench_startup(scale):
+    from hmt_simulator import HmtSimulator, constant
+
+    simulator = HmtSimulator(profile=constant(12.3))
+    first_byte, first_reading = [], []
+    try:
+        for _ in range(max(3, int(10 * scale))):
+            directory = tempfile.mkdtemp(dir=WORK_DIR)
+            with socket.socket() as probe:
+                probe.bind(('127.0.0.1', 0))
+                port = probe.getsockname()[1]
+            env = dict(
+                os.environ, HMT333_ENABLE='true',
+                HMT333_PORT=simulator.port, HMT333_HTTP_PORT=str(port),
+                DATA_POLL_INTERVAL='1',
+                TEMPS_JOURNAL=os.path.join(directory, 'temps.journal'),
+                HISTORY_PATH=os.path.join(directory, 'history.journal'),
+                SERIES_PATH=os.path.join(directory, 'series'))
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, os.path.join(os.path.dirname(
+                    BENCHMARK_DIR), 'hmt_service.py')],
+                env=env, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+            try:
+                first_byte.append(wait_for_health(port, start, False))
+                first_reading.append(wait_for_health(port, start, True))
+            finally:
+                process.terminate()
+                process.wait(10)
+    finally:
+        simulator.close()
+    return {
+        'startup_first_byte': summarise(first_byte, sum(first_byte)),
+        'startup_first_reading': summarise(first_reading,
+                                           sum(first_reading)),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline.
+    :return: A list of regressions (descriptions)."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if not base or 'ops_per_second' not in base or \
+                'ops_per_second' not in result:
+            continue
+        if result['ops_per_second'] < base['ops_per_second'] * (
+                1 - threshold):
+            regressions.append(name + ': throughput ' + str(
+                result['ops_per_second']) + '/s vs baseline ' + str(
+                base['ops_per_second']) + '/s')
+        if result['p99_us'] > base['p99_us'] * (1 + threshold):
+            regressions.append(name + ': p99 ' + str(result['p99_us']) +
+                               ' us vs baseline ' + str(base['p99_us']) +
+                               ' us')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='run fewer operations (less accurate)')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fractional change reported as a regression')
+    parser.add_argument('--only', nargs='*',
+                        help='benchmark groups to run: decoding, '
+                             'calibration, max_min, service, http, wow, '
+                             'startup')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    warnings.simplefilter('ignore')
+    scale = 0.1 if args.quick else 1.0
+    groups = args.only or ['decoding', 'calibration', 'max_min', 'service',
+                           'http', 'wow', 'startup']
+
+    benchmarks = {}
+    fixture = None
+    # Keep the service's own output out of the results on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            for group in groups:
+                print('Running ' + group + '...', file=sys.stderr)
+                if group in ('service', 'http'):
+                    if fixture is None:
+                        fixture = ServiceFixture()
+                    logging.getLogger().setLevel(logging.ERROR)
+                    benchmarks.update(globals()['bench_' + group](
+                        scale, fixture))
+                else:
+                    benchmarks.update(globals()['bench_' + group](scale))
+        finally:
+            if fixture is not None:
+                fixture.close()
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'quick': args.quick,
+        'benchmarks': benchmarks,
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            file.write(output + '\n')
+        return 0
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(benchmarks, json.load(file),
+                                  args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
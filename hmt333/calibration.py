@@ -0,0 +1,106 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Temperatures (deg C) of the calibration certificate points
+CALIBRATION_POINTS = (-30, -20, -10, 0, 10, 20, 30, 40, 50)
+
+# Lookup table resolution (deg C)
+RESOLUTION = 0.1
+
+STEP = 'step'
+LINEAR = 'linear'
+
+
+class CalibrationTable:
+    """Precomputed calibration correction lookup table. Corrections are
+    tabulated at 0.1 deg C intervals between the first and last calibration
+    certificate points (-30 to 50 deg C) when the table is built, so that
+    applying calibration to a reading is an O(1) table lookup. Outside this
+    range the correction of the nearest end point is used.
+
+    Two interpolation modes are supported:
+    * step - the correction of the nearest certificate point is applied
+      (the certificate points are 10 deg C apart so each correction applies
+      from 5 deg C below to 5 deg C above its point).
+    * linear - the correction is interpolated linearly between the two
+      certificate points either side of the reading."""
+
+    def __init__(self, coefficients, mode=STEP):
+        """:param coefficients: The nine calibration corrections (deg C) for
+        the certificate points -30/-20/-10/0/10/20/30/40/50 deg C.
+        :param mode: The interpolation mode, 'step' or 'linear'."""
+        if mode not in (STEP, LINEAR):
+            raise ValueError('Unknown calibration mode: ' + str(mode))
+        self.mode = mode
+        self.coefficients = tuple(coefficients)
+        self.lower = CALIBRATION_POINTS[0]
+        self.size = int(round(
+            (CALIBRATION_POINTS[-1] - self.lower) / RESOLUTION)) + 1
+        self.table = [self.correction(self.lower + i * RESOLUTION)
+                      for i in range(self.size)]
+        self.last = self.size - 1
+        if np is not None:
+            self.array = np.array(self.table)
+
+    def correction(self, temp):
+        """Calculate the correction for a temperature directly from the
+        certificate points (used when building the lookup table).
+        :param temp: Temperature in deg C.
+        :return: The calibration correction in deg C."""
+        # Round away floating point error in the table grid temperatures
+        temp = round(temp, 6)
+        points = CALIBRATION_POINTS
+        if self.mode == STEP:
+            for point, corr in zip(points[1:], self.coefficients):
+                if temp < point - 5:
+                    return corr
+            return self.coefficients[-1]
+
+        if temp <= points[0]:
+            return self.coefficients[0]
+        for i in range(1, len(points)):
+            if temp <= points[i]:
+                fraction = (temp - points[i - 1]) / (points[i] - points[i - 1])
+                return self.coefficients[i - 1] + fraction * (
+                    self.coefficients[i] - self.coefficients[i - 1])
+        return self.coefficients[-1]
+
+    def apply(self, temp):
+        """Apply the calibration correction to a single reading.
+        :param temp: The 'as read' temperature in deg C.
+        :return: The calibrated temperature in deg C."""
+        position = (temp - self.lower) / RESOLUTION
+        if position <= 0:
+            return temp + self.table[0]
+        if position >= self.last:
+            return temp + self.table[self.last]
+        index = math.floor(position)
+        if self.mode == STEP:
+            return temp + self.table[index]
+        lower = self.table[index]
+        return temp + lower + (position - index) * (
+            self.table[index + 1] - lower)
+
+    def apply_batch(self, temps):
+        """Apply the calibration correction to an array of readings. If
+        NumPy is available the corrections are looked up for the whole
+        array at once.
+        :param temps: A sequence or array of 'as read' temperatures (deg C).
+        :return: The calibrated temperatures (a NumPy array if NumPy is
+        available, otherwise a list)."""
+        if np is None:
+            return [self.apply(temp) for temp in temps]
+
+        temps = np.asarray(temps, dtype=float)
+        position = np.clip((temps - self.lower) / RESOLUTION, 0, self.last)
+        index = np.floor(position).astype(np.intp)
+        if self.mode == STEP:
+            return temps + self.array[index]
+        index = np.minimum(index, self.last - 1)
+        lower = self.array[index]
+        return temps + lower + (position - index) * (
+            self.array[index + 1] - lower)
@@ -1,5 +1,17 @@
 import configparser
 import logging
+import os
+import tempfile
+import time
+import warnings
+from collections import namedtuple
+from calibration import CalibrationTable
+
+# Instrument calibration coefficients (deg C) for temperatures of
+# -30/-20/-10/0/10/20/30/40/50 deg C
+Coefficients = namedtuple('Coefficients', [
+    'corr_M30', 'corr_M20', 'corr_M10', 'corr_0', 'corr_10', 'corr_20',
+    'corr_30', 'corr_40', 'corr_50'])
 
 
 class ConfigHandler:
@@ -8,61 +20,102 @@ class ConfigHandler:
     coefficients for applying to raw temperature readings. The configuration
     file is /data/config.ini on an operational device running Balena OS and
     can be accessed by other container services. For easier testing, provision
-    is made for also storing the file in the top level project directory"""
+    is made for also storing the file in the top level project directory.
+    The calibration coefficients are cached in memory and the file is only
+    parsed again when it has changed. A CalibrationTable (lookup table) is
+    built from the coefficients each time they are loaded.
+
+    The config file is only ever replaced whole (written to a temporary
+    file, flushed to disk and renamed over the old file, see write_config)
+    so a reader never sees a partly written file, and each save gets a new
+    inode, making the file's stat a cheap change notification. Each save
+    also increments the version number in the file's META section."""
 
-    def __init__(self, config_location):
+    def __init__(self, config_location, section='CALIBRATION'):
         # Set up logging
         logging.basicConfig(level=logging.INFO)
         logging.captureWarnings(True)
 
         self.config_location = config_location
 
+        # Config file section holding the calibration for this sensor
+        self.section = section
+
         # Initialise HMT sensor calibration coefficients
-        self.corr_M30 = 0.0
-        self.corr_M20 = 0.0
-        self.corr_M10 = 0.0
-        self.corr_0 = 0.0
-        self.corr_10 = 0.0
-        self.corr_20 = 0.0
-        self.corr_30 = 0.0
-        self.corr_40 = 0.0
-        self.corr_50 = 0.0
+        self.coefficients = Coefficients(*[0.0] * len(Coefficients._fields))
+
+        # Interpolation between calibration points, 'step' or 'linear'
+        self.calibration_mode = os.getenv('CALIBRATION_MODE') or 'step'
+        self.table = CalibrationTable(
+            self.coefficients, self.calibration_mode)
+
+        # Identity (modification time, size and inode) of the config file
+        # the cached coefficients were loaded from.
+        self.config_stamp = None
+        # Version (META section) of the config file last loaded
+        self.version = None
+
+        # How often (seconds) to check whether the config file has changed
+        self.check_interval = float(os.getenv('CONFIG_CHECK_INTERVAL') or 5)
+        self.next_check = 0.0
 
     def set_calibration_coefficients(self):
         """
         Use the Python 'configparser' to read in instrument calibration
         coefficients for temperatures -30/-20/-10/0/10/20/30/40/50
         deg C from the config.ini file (if available). If the config file
-        is not available then fallback values of 0.0 are use.
+        is not available then a default file (all coefficients 0.0) is
+        created. The file is only parsed if it has changed since the
+        coefficients were last loaded. If the file cannot be parsed or is
+        missing any coefficients (e.g. it is part way through being saved)
+        the last good coefficients are kept.
         """
+        try:
+            stat = os.stat(self.config_location)
+        except FileNotFoundError:
+            logging.info('Config file not found - creating a default '
+                         'config file')
+            self.create_config(self.config_location)
+            try:
+                stat = os.stat(self.config_location)
+            except FileNotFoundError:
+                return
+
+        config_stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if config_stamp == self.config_stamp:
+            return
+        self.config_stamp = config_stamp
+
         try:
             config_object = configparser.ConfigParser()
             config_object.read(self.config_location)
-            calibration = config_object['CALIBRATION']
-
-            self.corr_M30 = calibration.getfloat('corr_M30', fallback=0.0)
-            self.corr_M20 = calibration.getfloat('corr_M20', fallback=0.0)
-            self.corr_M10 = calibration.getfloat('corr_M10', fallback=0.0)
-            self.corr_0 = calibration.getfloat('corr_0', fallback=0.0)
-            self.corr_10 = calibration.getfloat('corr_10', fallback=0.0)
-            self.corr_20 = calibration.getfloat('corr_20', fallback=0.0)
-            self.corr_30 = calibration.getfloat('corr_30', fallback=0.0)
-            self.corr_40 = calibration.getfloat('corr_40', fallback=0.0)
-            self.corr_50 = calibration.getfloat('corr_50', fallback=0.0)
-            logging.info('Calibration loaded from config file....')
-
-        except (IOError, KeyError, ValueError):
-            # new config file.
-            logging.info('IOError, KeyError or ValueError trying to open '
-                         'and parse config file '
-                         '- creating a default config file')
-            self.create_config(self.config_location)
+            calibration = config_object[self.section]
+            values = [calibration.getfloat(name)
+                      for name in Coefficients._fields]
+            if None in values:
+                raise ValueError('missing calibration coefficient')
+            coefficients = Coefficients(*values)
+            table = CalibrationTable(coefficients, self.calibration_mode)
+        except (IOError, KeyError, ValueError,
+                configparser.Error) as error:
+            warnings.warn('Unable to parse config file - keeping previous '
+                          'calibration: ' + str(error), Warning)
+            return
 
-        # except FileNotFoundError:
-        #     # Try loading a config file from the top level directory, rather
-        #     # than the specified location.
-        #     self.config_location = '../config.ini'
-        #     self.set_calibration_coefficients()
+        # Swap in the complete new calibration in one step
+        self.table = table
+        self.coefficients = coefficients
+        self.version = config_object.getint('META', 'version', fallback=0)
+        logging.info('Calibration loaded from config file (version ' +
+                     str(self.version) + ')....')
+
+    def check_for_changes(self):
+        """Reload the calibration coefficients if the config file has
+        changed, checking no more often than the check interval."""
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.check_interval
+            self.set_calibration_coefficients()
 
     def apply_calibration(self, temp):
         """
@@ -72,29 +125,23 @@ class ConfigHandler:
         /10/20/30/40/50 deg C.
         :param temp: The 'as read' temperature in degrees C from the HMT333
         :return: The 'as read' temperature plus the most appropriate
-        instrument calibration coefficient (degrees C).
+        instrument calibration coefficient (degrees C), or the interpolated
+        coefficient if CALIBRATION_MODE is 'linear'.
         """
-        self.set_calibration_coefficients()
-
-        if temp >= 45:
-            temp = temp + self.corr_50
-        elif temp >= 35:
-            temp = temp + self.corr_40
-        elif temp >= 25:
-            temp = temp + self.corr_30
-        elif temp >= 15:
-            temp = temp + self.corr_20
-        elif temp >= 5:
-            temp = temp + self.corr_10
-        elif temp >= -5:
-            temp = temp + self.corr_0
-        elif temp >= -15:
-            temp = temp + self.corr_M10
-        elif temp >= -25:
-            temp = temp + self.corr_M20
-        else:
-            temp = temp + self.corr_M30
-        return temp
+        self.check_for_changes()
+        return self.table.apply(temp)
+
+    def apply_calibration_batch(self, temps):
+        """
+        Apply the instrument calibration adjustment to an array of as read
+        temperatures e.g. high rate samples or historical data that is to be
+        recalibrated.
+        :param temps: A sequence or array of 'as read' temperatures (deg C)
+        :return: The calibrated temperatures (a NumPy array if NumPy is
+        available, otherwise a list).
+        """
+        self.check_for_changes()
+        return self.table.apply_batch(temps)
 
     @staticmethod
     def create_config(config_location):
@@ -124,10 +171,54 @@ class ConfigHandler:
             "corr_50": '0.0',
         }
 
-        # Write the above sections to config.ini file
+        config_object["META"] = {"version": '1'}
+
+        # Write the above sections to config.ini file, unless the file has
+        # been created by another service in the meantime.
         try:
-            with open(config_location, 'w') as conf:
-                config_object.write(conf)
-            logging.info('Calibration config file created....')
-        except FileNotFoundError:
+            if write_config(config_object, config_location, replace=False):
+                logging.info('Calibration config file created....')
+        except OSError:
             logging.info('Unable to create config file in specified location')
+
+
+# Copied to configuration/configuration.py (the services are built
+# separately) - make any change to both.
+def write_config(config_object, config_location, replace=True):
+    """Write a config file atomically: the config is written to a temporary
+    file in the same directory, flushed to disk and then renamed over (or,
+    if replace is False, linked to) the config file, so readers see either
+    the old or the new file complete, never a partly written one.
+    :param config_object: The ConfigParser to write.
+    :param config_location: Location of the config file.
+    :param replace: False to leave an existing config file alone.
+    :return: True if the file was written."""
+    directory = os.path.dirname(config_location) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix='.config-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as conf:
+            config_object.write(conf)
+            conf.flush()
+            os.fsync(conf.fileno())
+        os.chmod(temp_path, 0o644)
+        if replace:
+            os.replace(temp_path, config_location)
+        else:
+            try:
+                os.link(temp_path, config_location)
+            except FileExistsError:
+                return False
+            finally:
+                os.unlink(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return True
@@ -0,0 +1,111 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+
+class EventStream:
+    """Recent events (new observations and QC events) for the Server-Sent
+    Events /stream endpoint. Each event is formatted once, when published,
+    and the same bytes are written to every subscriber, so a subscriber
+    costs little more than the write. Subscribers wait for events on a
+    condition (one thread per subscriber) or, in async mode, on a future
+    (one coroutine per subscriber).
+
+    Events are numbered in order, and their ids include the service start
+    time so that an id from before a restart isn't taken for one of the
+    current events. The last 'capacity' events are kept so that a client
+    reconnecting with the id of the last event it received (Last-Event-ID)
+    is sent the events it missed."""
+
+    def __init__(self, capacity=1000):
+        """:param capacity: Number of recent events kept for reconnecting
+        clients."""
+        # (number, message) of the recent events
+        self.events = deque(maxlen=capacity)
+        self.number = 0
+        self.prefix = format(int(time.time()), 'x') + '-'
+        # The latest message by key (e.g. each sensor's latest
+        # observation), sent to new subscribers
+        self.latest = {}
+        self.condition = threading.Condition()
+        # Futures of the subscribers waiting in async mode
+        self.waiters = set()
+
+    def publish(self, event, data, key=None):
+        """Add an event and wake the subscribers.
+        :param event: The event type e.g. 'observation'.
+        :param data: The event data (serialised as JSON).
+        :param key: Optional key under which the event is kept as the latest
+        of its kind for new subscribers e.g. the sensor id."""
+        payload = json.dumps(data)
+        with self.condition:
+            self.number += 1
+            message = ('id: ' + self.prefix + str(self.number) +
+                       '\nevent: ' + event + '\ndata: ' + payload +
+                       '\n\n').encode('UTF-8')
+            self.events.append((self.number, message))
+            if key is not None:
+                self.latest[key] = message
+            self.condition.notify_all()
+            waiters, self.waiters = self.waiters, set()
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(self.wake, future)
+
+    @staticmethod
+    def wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def subscribe(self, last_event_id=None):
+        """Start a subscription. A new client is sent the latest events
+        kept by key (e.g. the latest observation of each sensor). A client
+        reconnecting is sent the events after the last one it received that
+        are still kept (all of them if its last event was from before a
+        restart).
+        :param last_event_id: The client's Last-Event-ID header (if any).
+        :return: The messages to send and the number of the last event
+        sent (to pass to wait)."""
+        with self.condition:
+            if not last_event_id:
+                return list(self.latest.values()), self.number
+            prefix, _, number = last_event_id.rpartition('-')
+            if prefix + '-' == self.prefix and number.isdigit():
+                return self.collect(min(int(number), self.number))
+            return self.collect(0)
+
+    def collect(self, number):
+        """:return: The messages of the events after the numbered event and
+        the number of the last of them (called with the lock held)."""
+        if not self.events or self.events[-1][0] <= number:
+            return [], number
+        start = max(0, number + 1 - self.events[0][0])
+        return [message for _, message in itertools.islice(
+            self.events, start, None)], self.events[-1][0]
+
+    def wait(self, number, timeout):
+        """Wait for events after the numbered event.
+        :param number: Number of the last event sent to the subscriber.
+        :param timeout: Maximum time to wait (seconds).
+        :return: The messages (none if the wait timed out) and the number
+        of the last of them."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.number > number, timeout)
+            return self.collect(number)
+
+    async def wait_async(self, number, timeout):
+        """asyncio version of wait."""
+        with self.condition:
+            if self.number > number:
+                return self.collect(number)
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self.condition:
+            self.waiters.discard(future)
+            return self.collect(number)
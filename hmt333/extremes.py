@@ -0,0 +1,108 @@
+import time
+from collections import deque
+
+
+class ExtremesEngine:
+    """Incremental maximum/minimum temperature engine. Two sets of extremes
+    are maintained as readings arrive:
+
+    * A running max/min for the current climatological day (0900-0900 UTC),
+      cleared by the daily reset. Updating and querying are O(1).
+    * A rolling max/min over the last 24 hours (or the configured window),
+      held in a pair of monotonic deques. Each reading is pushed and popped
+      at most once so updates and queries are amortised O(1).
+
+    Readings are never scanned as a list, so the cost per reading does not
+    grow with the number of readings received through the day."""
+
+    def __init__(self, rolling_window=86400):
+        # Length of the rolling window in seconds (default 24 hours)
+        self.rolling_window = rolling_window
+
+        # Running extremes for the current 0900-0900 period
+        self.window_max = None
+        self.window_min = None
+        self.window_count = 0
+
+        # Monotonic deques of (timestamp, temperature) pairs. Temperatures
+        # in max_deque are decreasing, in min_deque increasing, so the front
+        # of each deque is the current rolling extreme.
+        self.max_deque = deque()
+        self.min_deque = deque()
+
+    def update(self, temperature, timestamp=None):
+        """Add a temperature reading to both the running and rolling
+        extremes.
+        :param temperature: Temperature value in degrees C.
+        :param timestamp: Time of the reading (seconds since the epoch),
+        defaults to the current time."""
+        if timestamp is None:
+            timestamp = time.time()
+
+        if self.window_count == 0:
+            self.window_max = temperature
+            self.window_min = temperature
+        elif temperature > self.window_max:
+            self.window_max = temperature
+        elif temperature < self.window_min:
+            self.window_min = temperature
+        self.window_count += 1
+
+        # Any earlier value that can no longer be the rolling extreme is
+        # discarded before the new value is added to the back of each deque.
+        while self.max_deque and self.max_deque[-1][1] <= temperature:
+            self.max_deque.pop()
+        self.max_deque.append((timestamp, temperature))
+        while self.min_deque and self.min_deque[-1][1] >= temperature:
+            self.min_deque.pop()
+        self.min_deque.append((timestamp, temperature))
+
+        self.expire(timestamp)
+
+    def expire(self, now=None):
+        """Drop values that have fallen out of the rolling window.
+        :param now: Current time (seconds since the epoch)."""
+        if now is None:
+            now = time.time()
+        cutoff = now - self.rolling_window
+        while self.max_deque and self.max_deque[0][0] <= cutoff:
+            self.max_deque.popleft()
+        while self.min_deque and self.min_deque[0][0] <= cutoff:
+            self.min_deque.popleft()
+
+    def rolling_max(self, now=None):
+        """:return: The maximum temperature over the rolling window or None
+        if no readings fall within the window."""
+        self.expire(now)
+        return self.max_deque[0][1] if self.max_deque else None
+
+    def rolling_min(self, now=None):
+        """:return: The minimum temperature over the rolling window or None
+        if no readings fall within the window."""
+        self.expire(now)
+        return self.min_deque[0][1] if self.min_deque else None
+
+    def reset_window(self):
+        """Start a new climatological day. The running extremes are cleared
+        but the rolling window is left intact."""
+        self.window_max = None
+        self.window_min = None
+        self.window_count = 0
+
+    def clear(self):
+        """Clear both the running and rolling extremes."""
+        self.reset_window()
+        self.max_deque.clear()
+        self.min_deque.clear()
+
+    @staticmethod
+    def window_start(now=None, hour=9, minute=1):
+        """Determine the start of the current climatological day, i.e. the
+        most recent daily reset time (UTC).
+        :param now: Current time (seconds since the epoch).
+        :return: Time of the most recent reset (seconds since the epoch)."""
+        if now is None:
+            now = time.time()
+        offset = hour * 3600 + minute * 60
+        start = (now - offset) // 86400 * 86400 + offset
+        return start
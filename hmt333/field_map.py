@@ -0,0 +1,72 @@
+import warnings
+
+# Plausible limits for the quantities the HMT330 series can output, in the
+# units the sensor is normally set up for (deg C, %RH, g/m3, g/kg).
+# Quantities without limits are not range checked.
+QC_LIMITS = {
+    'T': (-60.0, 60.0),
+    'RH': (0.0, 105.0),
+    'Td': (-80.0, 60.0),
+    'Tdf': (-80.0, 60.0),
+    'Tw': (-60.0, 60.0),
+    'a': (0.0, 700.0),
+    'x': (0.0, 1000.0),
+}
+
+# Fields already served for each reading, which can't be mapped to
+RESERVED_FIELDS = {'timestamp', 'obs_age', 'temperature', 'temperature_10min',
+                   'max_temp_calc', 'min_temp_calc', 'data_points'}
+
+
+class FieldMap:
+    """Maps the quantities in a multi-field data frame from the sensor (as
+    set up with its FORM command) to the fields served for each reading,
+    e.g. 'RH=humidity,Td=dew_point' serves the RH and Td values of a frame
+    like T= 12.3 'C RH= 45.6 %RH Td=  1.2 'C as 'humidity' and
+    'dew_point'. The temperature (T) is always served as 'temperature' and
+    goes through calibration and the temperature checks; the other
+    quantities are checked against QC_LIMITS individually, so one bad
+    value doesn't lose the whole reading. A frame cut off part way through
+    a field is rejected whole by decode_frame, as the limits can't catch a
+    truncated value (e.g. RH= 4 for RH= 45.6 %RH)."""
+
+    def __init__(self, text=''):
+        """:param text: Comma separated list of quantity=field pairs."""
+        self.fields = {}
+        for pair in text.split(','):
+            if not pair.strip():
+                continue
+            quantity, _, field = pair.partition('=')
+            quantity, field = quantity.strip(), field.strip()
+            if not quantity or not field or quantity == 'T' or \
+                    field in RESERVED_FIELDS:
+                warnings.warn('Ignoring frame field mapping: ' + pair,
+                              Warning)
+                continue
+            self.fields[quantity] = field
+
+    def extract(self, quantities):
+        """Get the mapped fields from a decoded data frame.
+        :param quantities: The quantities in the frame by name, e.g.
+        {'T': 12.3, 'RH': 45.6} (see decode_frame).
+        :return: A dictionary of field values, with None for any quantity
+        missing from the frame or failing its QC check."""
+        values = {}
+        for quantity, field in self.fields.items():
+            value = quantities.get(quantity)
+            if value is None:
+                warnings.warn(quantity + ' missing from data frame',
+                              Warning)
+            elif not self.check(quantity, value):
+                warnings.warn(quantity + ' value fails sanity checks: ' +
+                              str(value), Warning)
+                value = None
+            values[field] = value
+        return values
+
+    @staticmethod
+    def check(quantity, value):
+        """:return: True if the value is within the limits for the
+        quantity (or it has no limits)."""
+        limits = QC_LIMITS.get(quantity)
+        return limits is None or limits[0] <= value <= limits[1]
@@ -0,0 +1,65 @@
+import re
+
+# Frame classes
+EMPTY = 'empty'
+DATA = 'data'
+# The sensor is echoing our commands (echo needs switching off)
+COMMAND_ECHO = 'command echo'
+# The sensor's reply to a command e.g. 'ECHO : OFF' or
+# 'Output intrv. : 1 s'
+REPLY = 'reply'
+ERROR = 'error'
+INVALID = 'invalid'
+
+# One quantity in a data frame: name, '=', value and unit e.g. T= 12.3 'C
+# or RH= 45.6 %RH. The unit is required, so a frame cut off part way
+# through a field (e.g. T=  1) isn't taken for data.
+_FIELD = rb"[A-Za-z][A-Za-z0-9]*[ \t]*=[ \t]*[-+]?\d+(?:\.\d+)?[ \t]*" \
+    rb"(?:'C|'F|%RH|%|g/m3|g/kg|hPa)"
+
+# Classifies a whole frame in one match. The alternatives are tried in
+# order, so a line is only an echo, reply or error if it isn't data. Only
+# the invalid alternative spans line ends, so frames run together (e.g. a
+# partial line followed by the next reading) are classed invalid.
+FRAME = re.compile(
+    rb"\s*(?:"
+    rb"(?P<data>" + _FIELD + rb"(?:[ \t]+" + _FIELD + rb")*)"
+    rb"|(?P<echo>.*send.*)"
+    rb"|(?P<error>.*(?:[Ee][Rr][Rr][Oo][Rr]|[Uu]nknown|[Nn]ot allowed).*)"
+    rb"|(?P<reply>.*(?:[Ee][Cc][Hh][Oo]|\s:\s).*)"
+    rb"|(?P<invalid>(?s:.+?))"
+    rb")?\s*\Z")
+
+# The usual frame (temperature only), decoded without the general match
+TEMPERATURE_FRAME = re.compile(
+    rb"\s*T=[ \t]*([-+]?\d+(?:\.\d+)?)[ \t]*'C\s*\Z")
+
+# Name and value of each quantity in a data frame
+FIELD = re.compile(rb"([A-Za-z][A-Za-z0-9]*)\s*=\s*([-+]?\d+(?:\.\d+)?)")
+
+
+def decode_frame(frame):
+    """Classify and decode a line of output from the sensor, working
+    directly on the bytes read from the serial port.
+    :param frame: The line (bytes, bytearray or memoryview, with or without
+    the line end).
+    :return: The frame class (DATA, COMMAND_ECHO, REPLY, ERROR, INVALID or
+    EMPTY) and, for a data frame, a dictionary of the quantities it
+    contains by name e.g. {'T': 12.3} (otherwise None)."""
+    match = TEMPERATURE_FRAME.match(frame)
+    if match is not None:
+        return DATA, {'T': float(match.group(1))}
+    match = FRAME.match(frame)
+    if match is None or match.lastgroup is None:
+        return EMPTY, None
+    kind = match.lastgroup
+    if kind == 'data':
+        return DATA, {name.decode(): float(value) for name, value in
+                      FIELD.findall(match.group('data'))}
+    if kind == 'echo':
+        return COMMAND_ECHO, None
+    if kind == 'error':
+        return ERROR, None
+    if kind == 'reply':
+        return REPLY, None
+    return INVALID, None
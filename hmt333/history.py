@@ -0,0 +1,94 @@
+import logging
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+from temp_journal import TempJournal
+
+# Each history record is a timestamp (seconds since the epoch, float64)
+# followed by the calibrated, max and min temperatures (float32, NaN if not
+# available) - 20 bytes per observation.
+HISTORY_RECORD = struct.Struct('<dfff')
+
+HISTORY_FIELDS = ['timestamp', 'temperature', 'max_temp_calc',
+                  'min_temp_calc']
+
+
+class ObservationHistory:
+    """History of the calibrated observations, so that consumers (Telegraf,
+    the WoW service etc.) that have been unavailable for a while can catch
+    up on the readings they missed. Observations are journaled to disk (see
+    TempJournal) and the most recent are also kept in memory. Observations
+    older than the retention period are removed when the journal is
+    compacted (once a day)."""
+
+    def __init__(self, path, retention=7 * 86400, memory_span=6 * 3600):
+        """:param path: Location of the history journal file.
+        :param retention: How long to keep observations (seconds).
+        :param memory_span: How long to keep observations in memory
+        (seconds)."""
+        self.journal = TempJournal(path, HISTORY_RECORD)
+        self.retention = retention
+        self.memory_span = memory_span
+        self.recent = deque()
+        self.lock = threading.Lock()
+        self.last_compaction = time.time()
+
+        try:
+            self.recent.extend(self.journal.load_since(
+                time.time() - memory_span))
+        except OSError as error:
+            logging.info('Unable to load observation history: ' +
+                         str(error))
+
+    def add(self, timestamp, temperature, max_temp, min_temp):
+        """Record an observation.
+        :param timestamp: Observation time (seconds since the epoch).
+        :param temperature: Calibrated temperature (deg C).
+        :param max_temp: Current maximum temperature (deg C) or None.
+        :param min_temp: Current minimum temperature (deg C) or None."""
+        # Times are kept to the millisecond so that a time returned by
+        # since() can be passed back to it exactly.
+        timestamp = round(timestamp, 3)
+        record = (timestamp, temperature,
+                  math.nan if max_temp is None else max_temp,
+                  math.nan if min_temp is None else min_temp)
+        with self.lock:
+            self.recent.append(record)
+            while self.recent[0][0] < timestamp - self.memory_span:
+                self.recent.popleft()
+        try:
+            self.journal.append(*record)
+            if timestamp - self.last_compaction > 86400:
+                self.last_compaction = timestamp
+                self.journal.compact(timestamp - self.retention)
+        except OSError as error:
+            logging.info('Unable to save observation history: ' +
+                         str(error))
+
+    def since(self, timestamp, limit):
+        """Get the observations made after a given time, oldest first.
+        Recent observations are served from memory, older ones from the
+        journal on disk.
+        :param timestamp: Time after which observations are wanted (seconds
+        since the epoch).
+        :param limit: Maximum number of observations to return.
+        :return: A list of observations, each [timestamp, temperature,
+        max_temp, min_temp] with None for any missing max/min value."""
+        with self.lock:
+            if self.recent and timestamp >= self.recent[0][0]:
+                start = len(self.recent)
+                while start > 0 and self.recent[start - 1][0] > timestamp:
+                    start -= 1
+                records = [self.recent[i] for i in range(
+                    start, min(start + limit, len(self.recent)))]
+            else:
+                records = None
+        if records is None:
+            records = self.journal.load_since(timestamp, limit)
+
+        return [[record[0]] + [
+            None if math.isnan(value) else round(value, 2)
+            for value in record[1:]] for record in records]
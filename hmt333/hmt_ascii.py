@@ -1,13 +1,48 @@
+import math
 import os
+import time
 import warnings
 import logging
 import re
 import serial
 from config_handler import ConfigHandler
+from field_map import FieldMap
+from frame_decoder import decode_frame, COMMAND_ECHO, DATA, EMPTY, ERROR, \
+    REPLY
+from history import ObservationHistory
+from line_framer import LineFramer
 from max_min_temp import MaxMinTemp
-from threading import Timer
+from metrics import Counter, Histogram
+from sample_buffer import SampleBuffer
+from serial_link import get_link
+from threading import Event, Lock, Thread
 from datetime import datetime
 
+# Any number or decimal number e.g. 1, 12.3, 2345, 0.34, -3.5
+NUMERIC_DATA = re.compile(
+    r'[-+]? (?: (?: \d* \. \d+ ) | (?: \d+ \.? ) )(?: [Ee] [+-]? \d+ ) ?',
+    re.VERBOSE)
+
+# Acquisition metrics (served at /metrics by hmt_service.py)
+SERIAL_RTT = Histogram(
+    'hmt333_serial_rtt_seconds',
+    'Time from sending a command to the sensor to receiving its response',
+    (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    labels=('sensor',), unit='seconds')
+DECODE_TIME = Histogram(
+    'hmt333_decode_seconds', 'Time taken to decode a frame from the sensor',
+    (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3),
+    labels=('sensor',), unit='seconds')
+FRAMES = Counter(
+    'hmt333_frames', 'Frames received from the sensor by class (data '
+    'frames failing the temperature checks are counted as qc_rejected)',
+    labels=('sensor', 'class'))
+SERIAL_ERRORS = Counter('hmt333_serial_errors', 'Serial port errors',
+                        labels=('sensor',))
+MISSED_SLOTS = Counter(
+    'hmt333_missed_poll_slots',
+    'Poll slots skipped because a poll cycle overran', labels=('sensor',))
+
 
 class HmtAscii:
     """Vaisala HMT333 sensor ascii data retrieval and extraction class.
@@ -16,33 +51,90 @@ class HmtAscii:
     system serial port. Instrument calibration coefficients are read in from
     a configuration file and then applied to the as read (raw) value. The
     instrument must be set to output temperature in units of degrees C when
-    it receives a request ('SEND' command) """
+    it receives a request ('SEND' command). A single acquisition thread
+    polls the sensor at fixed intervals measured on a monotonic clock, or
+    optionally puts the sensor in its continuous output (RUN) mode and reads
+    the stream of readings, falling back to polling if the stream stops.
+    Several sensors may share a serial port (RS-485 addressed units on one
+    radio link), in which case each is given its address."""
 
     def __init__(self, serial_port, serial_baud, poll_interval,
-                 config_location):
+                 config_location, sensor_id='HMT333', address=None,
+                 calibration_section='CALIBRATION', journal_path=None,
+                 history_path=None, start=True):
 
         # Set up logging
         logging.basicConfig(level=logging.INFO)
         logging.captureWarnings(True)
-        logging.info('Setting up HMT sensor data collection....')
+        logging.info('Setting up HMT sensor data collection....' + sensor_id)
+
+        self.sensor_id = sensor_id
+        self.address = address
 
         # How often the sensor should be polled for data
         self.poll_interval = poll_interval
 
         self.config_location = config_location
-        self.config = ConfigHandler(self.config_location)
+        self.config = ConfigHandler(self.config_location, calibration_section)
 
-        self.max_temp_handler = MaxMinTemp()
+        self.max_temp_handler = MaxMinTemp(journal_path)
         self.max_temp_diff = float(os.getenv('MAX_TEMP_DIFF', 7))
 
-        # Set up the serial port to which the HMT sensors will be connected
-        # Note the sensor is most likely connected via an RF422 radio unit
-        # So the serial port settings here will be for that radio unit.
-        self.serial_port = serial.Serial(
-            serial_port, serial_baud, timeout=10.0)
-        logging.info('Serial port: ' + str(self.serial_port))
-        self.serial_port.write('echo off\r\n'.encode())
-        print('echo switched off')
+        # Other quantities (e.g. RH, dew point) in the sensor's data frames
+        # to be served with the temperature, mapped to field names by
+        # FRAME_FIELDS e.g. 'RH=humidity,Td=dew_point'. If HMT333_FORM is
+        # set the sensor's output format is set to it (FORM command) when
+        # the serial port is opened.
+        self.field_map = FieldMap(os.getenv('FRAME_FIELDS', ''))
+        self.form = os.getenv('HMT333_FORM', '')
+
+        # History of the published observations (for /history requests)
+        if history_path is None:
+            history_path = (os.getenv('HISTORY_PATH') or
+                            '/usr/src/app/history.journal')
+        self.history = ObservationHistory(
+            history_path,
+            retention=float(os.getenv('HISTORY_RETENTION') or 168) * 3600)
+
+        # High rate sampling mode. If SAMPLE_INTERVAL is set the sensor is
+        # polled at this interval (seconds) instead of the poll interval and
+        # the samples are held in a ring buffer. 1 minute and 10 minute
+        # averages are published and the 1 minute averages are used for the
+        # max/min temperatures, as per WMO guidance. The averages are
+        # published once a minute (and for the first sample), so the samples
+        # themselves are only kept in memory, not journaled or streamed.
+        self.sample_interval = float(os.getenv('SAMPLE_INTERVAL') or 0)
+        self.samples = None
+        self.sample_minute = None
+        if self.sample_interval > 0:
+            self.poll_interval = self.sample_interval
+            self.samples = SampleBuffer(
+                int(math.ceil(660 / self.sample_interval)))
+
+        # Serial port to which the HMT sensors will be connected. Note the
+        # sensor is most likely connected via an RF422 radio unit so the
+        # serial port settings here will be for that radio unit. A read must
+        # not be allowed to run on past the next poll.
+        self.serial_port_name = serial_port
+        self.serial_baud = serial_baud
+        self.read_timeout = min(10.0, self.poll_interval)
+        self.link = None
+
+        # Streaming mode. If STREAM_MODE is true the sensor is put in RUN
+        # mode, so it sends a reading every poll interval without being
+        # asked (saving a radio round trip per reading). If no reading
+        # arrives for STREAM_TIMEOUT seconds the sensor is taken out of RUN
+        # mode and polled instead, and streaming is tried again after
+        # STREAM_RETRY seconds. Sensors sharing a port are always polled.
+        self.stream_mode = os.getenv('STREAM_MODE', 'false') == 'true'
+        if self.stream_mode and address is not None:
+            warnings.warn('Streaming mode is not available for addressed '
+                          'sensors - polling ' + sensor_id, Warning)
+            self.stream_mode = False
+        self.stream_timeout = float(os.getenv('STREAM_TIMEOUT') or
+                                    3 * self.poll_interval)
+        self.stream_retry = float(os.getenv('STREAM_RETRY') or 600)
+        self.framer = LineFramer()
 
         # Initialise startup values for temperature data
         self.timestamp = None
@@ -51,125 +143,349 @@ class HmtAscii:
         self.max_temp = None
         self.min_temp = None
         self.data_points = None
+        self.temperature_10min = None
+        self.quantities = {}
+        # Last temperature that passed the sanity checks (used for the
+        # consistency check of the next temperature).
+        self.previous_temp = None
+        # Observation sequence number (incremented for each new reading) and
+        # the monotonic clock time of the reading, used to tell whether a
+        # reading has changed and how old it is without parsing timestamps.
+        self.sequence = 0
+        self.obs_monotonic = None
+        self.obs_time = None
+        self.lock = Lock()
+
+        # Functions called with each new observation (see publish) and
+        # with each line from the sensor that isn't a valid reading (see
+        # handle_response)
+        self.observers = []
+        self.qc_observers = []
+
+        # Acquisition loop timing: duration of the last poll cycle (seconds)
+        # and the number of poll slots skipped because a cycle overran.
+        self.cycle_time = None
+        self.missed_slots = 0
+        self.stop_event = Event()
+        self.acquisition_thread = None
 
-        # Get calibration values and start collecting readings from the HMT
+        # Get calibration values and start collecting readings from the HMT.
+        # With start=False the caller calls setup() itself, e.g. once it has
+        # added its observers so that they see the first observation.
         self.config.set_calibration_coefficients()
-        self.get_hmt_data()
+        if start:
+            self.setup()
+
+    def setup(self):
+        """Open the serial port and start polling the sensor."""
+        self.open_serial()
+        self.start()
+
+    def open_serial(self):
+        """Open the serial port and switch off the sensor command echo."""
+        self.link = get_link(
+            self.serial_port_name, self.serial_baud, self.read_timeout)
+        self.link.open()
+        self.write_command('echo off')
+        logging.info('echo switched off')
+        if self.form:
+            self.write_command('form ' + self.form)
+
+    def write_command(self, command):
+        """Send a command to the sensor.
+        :param command: The command text e.g. 'send'."""
+        self.link.write_command(command)
+
+    def send_command(self):
+        """:return: The command that requests a reading from this sensor,
+        including its address if it shares the serial port."""
+        if self.address is None:
+            return 'send'
+        return 'send ' + self.address
+
+    def start(self):
+        """Start the acquisition thread that polls the sensor."""
+        self.stop_event.clear()
+        self.acquisition_thread = Thread(
+            target=self.acquisition_loop,
+            name='hmt-acquisition-' + self.sensor_id, daemon=True)
+        self.acquisition_thread.start()
+
+    def stop(self):
+        """Stop the acquisition thread after the current poll cycle."""
+        self.stop_event.set()
+
+    def acquisition_loop(self):
+        """Poll the sensor at fixed deadlines (multiples of the poll interval
+        from the start time) on the monotonic clock so that the schedule
+        does not drift. If a poll cycle overruns (e.g. the serial read stalls)
+        the missed poll slots are skipped and counted rather than being run
+        late or overlapping. In streaming mode the readings are streamed
+        instead, with polling only while the stream has stopped. An
+        unexpected error in a cycle (e.g. in an observer) is logged and the
+        loop carries on with the next poll, so one bad reading can't stop
+        the acquisition."""
+        next_poll = time.monotonic()
+        stream_start = next_poll
+        while not self.stop_event.is_set():
+            if self.stream_mode and time.monotonic() >= stream_start:
+                try:
+                    self.stream_readings()
+                except Exception:
+                    logging.exception('Streaming failed - ' + self.sensor_id)
+                next_poll = time.monotonic()
+                stream_start = next_poll + self.stream_retry
+                continue
+            cycle_start = time.monotonic()
+            try:
+                self.get_hmt_data()
+            except Exception:
+                logging.exception('Poll cycle failed - ' + self.sensor_id)
+            next_poll = self.schedule_next_poll(
+                next_poll, cycle_start, time.monotonic())
+            self.stop_event.wait(next_poll - time.monotonic())
+
+    def schedule_next_poll(self, next_poll, cycle_start, cycle_end):
+        """Record the timing of a completed poll cycle and work out when the
+        next poll is due, skipping any poll slots that have already passed.
+        :param next_poll: The deadline of the poll cycle just completed
+        (monotonic clock).
+        :param cycle_start: Start time of the poll cycle (monotonic clock).
+        :param cycle_end: End time of the poll cycle (monotonic clock).
+        :return: The deadline of the next poll (monotonic clock)."""
+        self.cycle_time = cycle_end - cycle_start
+        logging.info('Poll cycle time: ' +
+                     str(round(self.cycle_time, 3)) + ' s')
+
+        next_poll += self.poll_interval
+        if cycle_end > next_poll:
+            missed = int((cycle_end - next_poll) // self.poll_interval) + 1
+            next_poll += missed * self.poll_interval
+            self.missed_slots += missed
+            MISSED_SLOTS.inc(self.sensor_id, amount=missed)
+            warnings.warn('Poll cycle overran - skipped ' + str(missed)
+                          + ' poll slot(s), ' + str(self.missed_slots)
+                          + ' in total', Warning)
+        return next_poll
+
+    def stream_readings(self):
+        """Put the sensor in RUN mode (outputting a reading every poll
+        interval) and process the readings it streams until the stream goes
+        silent for the stream timeout or the acquisition is stopped, then
+        take the sensor out of RUN mode."""
+        logging.info('Starting RUN mode streaming...')
+        try:
+            self.write_command(
+                'intv ' + str(max(1, round(self.poll_interval))) + ' s')
+            self.write_command('r')
+            # The stream may start part way through a line
+            self.framer.resync()
+            last_reading = time.monotonic()
+            while not self.stop_event.is_set():
+                data = self.link.read_available()
+                if data:
+                    for line in self.framer.feed(data):
+                        if self.handle_response(line):
+                            last_reading = time.monotonic()
+                else:
+                    # A line cut short by a dropout won't be completed
+                    self.framer.pause()
+                if time.monotonic() - last_reading > self.stream_timeout:
+                    warnings.warn('No readings streamed for ' +
+                                  str(self.stream_timeout) +
+                                  ' s - switching to polled mode', Warning)
+                    break
+            self.write_command('s')
+            self.link.discard_input()
+        except serial.SerialException as error:
+            SERIAL_ERRORS.inc(self.sensor_id)
+            warnings.warn("Serial port error: " + str(error), Warning)
 
     def get_hmt_data(self):
-        """Read a line of incoming data from the assigned serial port,
-        then pass the data onto a processor for extraction of the
-        temperature value from this ascii data string (format: T= 12.3 'C).
-        Python's 'Threading-> Timer' is used to asynchronously schedule this
-        method so that it keeps attempting to read any incoming data on the
-        serial line. """
+        """Request a reading from the sensor and read a line of incoming data
+        from the assigned serial port, then pass the data onto a processor
+        for extraction of the temperature value from this ascii data string
+        (format: T= 12.3 'C). Called once per poll cycle by the acquisition
+        loop."""
         try:
-            # self.serial_port.flushInput()
-            self.serial_port.write('send\r\n'.encode())
             logging.info('sent SEND command to HMT requesting reading...')
-            # Asynchronously schedule this function to run again after
-            # the data poll interval.
-            Timer(self.poll_interval, self.get_hmt_data).start()
-            data_bytes = self.serial_port.readline()
-            data_line = str(data_bytes)
-            logging.info('RAW data: ' + data_line)
-            # data_line format = "T= 12.3 'C"
-            # Only process output if we have actual data in the line
-            if len(data_line) > 3:
-                if "send" in data_line:
-                    # If 'send' appears in the data line it means that
-                    # the HMT sensor has been set to echo commands. This
-                    # must be switched off by the 'echo off' command.
-                    logging.info('send in data line - switching ECHO off')
-                    self.serial_port.write('echo off\r\n'.encode())
-                elif "Echo" in data_line:
-                    # 'Echo' will appear in the response data line if we have
-                    # just sent the 'echo off' command (the sensor is just
-                    # responding by confirming echo is now off).
-                    logging.info('echo in data line - skipping')
-                # Complete and legitimate data will be of the form T= 12.3 'C,
-                # so we check that the data line contains T= and C before
-                # processing it.
-                elif "T=" and "C" and "." in data_line:
-                    hmt_data = self.process_hmt_data(
-                        self.data_decoder(data_line))
-                    # Do a basic checks that the temperature is a sensible
-                    # value before further processing.
-                    if self.temperature_check(
-                            hmt_data['temperature']) and \
-                            self.temp_consistency_check(
-                                self.temperature, hmt_data['temperature'],
-                                self.max_temp_diff):
-                        self.time_obs = datetime.utcnow()
-                        self.temperature = hmt_data['temperature']
-                        self.timestamp = hmt_data['timestamp']
-                        self.max_temp = hmt_data['max_temp']
-                        self.min_temp = hmt_data['min_temp']
-                        self.data_points = hmt_data['data_points']
-                        logging.info(
-                            'Calibrated temp/Max temp/Min temp/'
-                            'data points/time: '
-                            + str(self.temperature) + '/'
-                            + str(self.max_temp) + '/'
-                            + str(self.min_temp) + '/'
-                            + str(self.data_points) + '/'
-                            + str(self.timestamp))
-                    else:
-                        warnings.warn('Temperature value fails sanity checks: '
-                                      + str(hmt_data['temperature']), Warning)
-                else:
-                    warnings.warn('Data does not contain "T=...C" element',
-                                  Warning)
-            else:
-                warnings.warn('No response to "send" command', Warning)
+            start = time.perf_counter()
+            data_bytes = self.link.transaction(self.send_command())
+            SERIAL_RTT.observe(time.perf_counter() - start, self.sensor_id)
+            self.handle_response(data_bytes)
         except serial.SerialException as error:
+            SERIAL_ERRORS.inc(self.sensor_id)
             warnings.warn("Serial port error: " + str(error), Warning)
 
-    def data_decoder(self, data_line):
+    def handle_response(self, data_bytes):
+        """Process a line of data received from the sensor in response to a
+        'send' command (or streamed in RUN mode).
+        :param data_bytes: The line of data as read from the serial port.
+        :return: True if the line was a valid reading."""
+        logging.info('RAW data: %r', data_bytes)
+        start = time.perf_counter()
+        kind, fields = decode_frame(data_bytes)
+        DECODE_TIME.observe(time.perf_counter() - start, self.sensor_id)
+        if kind == DATA:
+            # Complete and legitimate data will be of the form T= 12.3 'C
+            temperature = None
+            if 'T' in fields:
+                # Apply any calibrations to the HMT temperature reading
+                temperature = self.config.apply_calibration(
+                    round(fields['T'], 1))
+            # Do a basic checks that the temperature is a sensible
+            # value before further processing.
+            if temperature is not None and \
+                    self.temperature_check(temperature) and \
+                    self.temp_consistency_check(
+                        self.previous_temp, temperature,
+                        self.max_temp_diff):
+                self.previous_temp = temperature
+                if self.samples is not None:
+                    hmt_data = self.process_sample(temperature)
+                else:
+                    hmt_data = self.process_hmt_data(temperature)
+                if hmt_data is not None:
+                    hmt_data['quantities'] = self.field_map.extract(fields)
+                    self.publish(hmt_data)
+                FRAMES.inc(self.sensor_id, DATA)
+                return True
+            kind = 'qc_rejected'
+            warnings.warn('Temperature value fails sanity checks: '
+                          + str(temperature), Warning)
+        elif kind == COMMAND_ECHO:
+            # If 'send' appears in the data line it means that
+            # the HMT sensor has been set to echo commands. This
+            # must be switched off by the 'echo off' command.
+            logging.info('send in data line - switching ECHO off')
+            self.write_command('echo off')
+        elif kind == REPLY:
+            # 'Echo' will appear in the response data line if we have
+            # just sent the 'echo off' command (the sensor is just
+            # responding by confirming echo is now off).
+            logging.info('echo in data line - skipping')
+        elif kind == ERROR:
+            warnings.warn('Sensor error: ' + repr(bytes(data_bytes)),
+                          Warning)
+        elif kind == EMPTY:
+            warnings.warn('No response to "send" command', Warning)
+        else:
+            warnings.warn('Data does not contain "T=...C" element',
+                          Warning)
+        kind = kind.replace(' ', '_')
+        FRAMES.inc(self.sensor_id, kind)
+        if kind != REPLY:
+            for observer in self.qc_observers:
+                observer(self, kind, data_bytes)
+        return False
+
+    @staticmethod
+    def data_decoder(data_line):
         """Extract the temperature data from the sensor ascii data
         line. The sensor must be setup to output its data in the required
         format i.e. T= 21.1 'C.
-        :param data_line: Sensors ascii output string e.g T= 21.3 'C."""
+        :param data_line: Sensors ascii output (bytes) e.g b"T= 21.3 'C".
+        :return: The temperature or None if the line isn't a valid data
+        line."""
         raw_temperature = None
-        data = self.find_numeric_data(data_line)
-        # Check we have data available (data length should be 1 which is the
-        # temperature reading) and then extract numeric values from this data.
-        if len(data) == 1:
-            raw_temperature = round(float(data[0]), 1)
+        kind, fields = decode_frame(data_line)
+        if kind == DATA and 'T' in fields:
+            raw_temperature = round(fields['T'], 1)
             logging.info('Decoded Temp: ' + str(raw_temperature))
         return raw_temperature
 
-    def process_hmt_data(self, raw_temperature):
-        """Apply calibration values to the raw temperature reading, get
-        a timestamp, process the current temperature max/min values.
+    def process_hmt_data(self, temperature):
+        """Get a timestamp for a calibrated temperature reading and process
+        the current temperature max/min values.
+        :param temperature: The calibrated temperature (degrees C).
         :return: calibrated temperature, timestamp, current max and min
         temperature and the number of temperature data points stored"""
-        hmt_data = dict(temperature=None, timestamp=None, max_temp=None,
-                        min_temp=None, data_points=None)
-        # Apply any calibrations to the HMT temperature reading
-        if raw_temperature is not None:
-            temperature = self.config.apply_calibration(raw_temperature)
-            timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
-            self.max_temp_handler.max_temp_calc(temperature)
-            max_temp = self.max_temp_handler.maxmin_temp_data['max']
-            min_temp = self.max_temp_handler.maxmin_temp_data['min']
-            data_points = self.max_temp_handler.maxmin_temp_data['data_points']
-            hmt_data.update(dict(
-                temperature=temperature, timestamp=timestamp,
-                max_temp=max_temp,
-                min_temp=min_temp, data_points=data_points))
-            return hmt_data
-        else:
+        timestamp = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        maxmin_temp_data = self.max_temp_handler.max_temp_calc(temperature)
+        return dict(temperature=temperature, temperature_10min=None,
+                    timestamp=timestamp, max_temp=maxmin_temp_data['max'],
+                    min_temp=maxmin_temp_data['min'],
+                    data_points=maxmin_temp_data['data_points'])
+
+    def process_sample(self, temperature):
+        """Add a calibrated high rate sample to the sample buffer. When a
+        (clock) minute is complete its average is used to update the
+        max/min values and a reading is published. The published
+        temperature is the average of the samples over the last minute.
+        :param temperature: The calibrated temperature (degrees C).
+        :return: 1 minute and 10 minute average temperatures, timestamp,
+        current max and min temperature and the number of (1 minute) data
+        points stored, or None if no reading is to be published for the
+        sample."""
+        now = time.time()
+        minute = int(now // 60)
+        new_minute = minute != self.sample_minute
+        if self.sample_minute is not None and new_minute:
+            minute_mean, number = self.samples.mean(
+                self.sample_minute * 60, self.sample_minute * 60 + 60)
+            if minute_mean is not None:
+                self.max_temp_handler.max_temp_calc(round(minute_mean, 1))
+        self.sample_minute = minute
+        self.samples.add(now, temperature)
+        if not new_minute:
             return None
 
+        mean_1min, number = self.samples.mean(now - 60)
+        mean_10min, number = self.samples.mean(now - 600)
+        maxmin_temp_data = self.max_temp_handler.maxmin_temp_data
+        return dict(temperature=round(mean_1min, 1),
+                    temperature_10min=round(mean_10min, 1),
+                    timestamp=datetime.utcnow().strftime(
+                        '%Y-%m-%dT%H:%M:%SZ'),
+                    max_temp=maxmin_temp_data['max'],
+                    min_temp=maxmin_temp_data['min'],
+                    data_points=maxmin_temp_data['data_points'])
+
+    def publish(self, hmt_data):
+        """Make a processed reading the latest reading, record it in the
+        history and pass it on to any observers.
+        :param hmt_data: The processed reading (see process_hmt_data)."""
+        with self.lock:
+            self.sequence += 1
+            self.obs_monotonic = time.monotonic()
+            self.obs_time = time.time()
+            self.time_obs = datetime.utcfromtimestamp(self.obs_time)
+            self.temperature = hmt_data['temperature']
+            self.temperature_10min = hmt_data['temperature_10min']
+            self.timestamp = hmt_data['timestamp']
+            self.max_temp = hmt_data['max_temp']
+            self.min_temp = hmt_data['min_temp']
+            self.data_points = hmt_data['data_points']
+            self.quantities = hmt_data.get('quantities', {})
+        self.history.add(self.obs_time, hmt_data['temperature'],
+                         hmt_data['max_temp'], hmt_data['min_temp'])
+        data = self.latest_data()
+        for observer in self.observers:
+            observer(self, data)
+        logging.info(
+            self.sensor_id + ' Calibrated temp/Max temp/Min temp/'
+            'data points/time: '
+            + str(self.temperature) + '/'
+            + str(self.max_temp) + '/'
+            + str(self.min_temp) + '/'
+            + str(self.data_points) + '/'
+            + str(self.timestamp))
+
     def latest_data(self):
         """Returns a dictionary of the latest data :return: calibrated
-        temperature, timestamp, current max and min temperature and the
-        number of temperature data points stored. Provides an easy method
+        temperature, timestamp, current max and min temperature, the
+        number of temperature data points stored and any other quantities
+        read from the sensor (see FieldMap). Provides an easy method
         for the web server script hmt_service.py to get this data"""
-        data = dict(temperature=self.temperature, timestamp=self.timestamp,
-                    max_temp=self.max_temp, min_temp=self.min_temp,
-                    data_points=self.data_points, time_obs=self.time_obs)
+        with self.lock:
+            data = dict(temperature=self.temperature,
+                        temperature_10min=self.temperature_10min,
+                        timestamp=self.timestamp, max_temp=self.max_temp,
+                        min_temp=self.min_temp, data_points=self.data_points,
+                        quantities=self.quantities,
+                        time_obs=self.time_obs, sequence=self.sequence,
+                        obs_monotonic=self.obs_monotonic,
+                        obs_time=self.obs_time)
         return data
 
     @staticmethod
@@ -180,13 +496,7 @@ class HmtAscii:
         param data_line: The data line from which digit groups are to be
         extracted
         :return: A list containing the extracted digit groups."""
-        data_search_exp = '[-+]? (?: (?: \d* \. \d+ ) | (?: \d+ \.? ' \
-                          ') )(?:' \
-                          '[Ee] [+-]? \d+ ) ?'
-
-        find_data_exp = re.compile(data_search_exp, re.VERBOSE)
-        data = find_data_exp.findall(data_line)
-        return data
+        return NUMERIC_DATA.findall(data_line)
 
     @staticmethod
     def temperature_check(temp):
@@ -221,5 +531,7 @@ class HmtAscii:
 
 
 if __name__ == '__main__':
-    HmtAscii(serial_port='/dev/tty.usbserial-AI02FCVO', serial_baud=115200,
-             poll_interval=60, config_location='../config.ini')
+    hmt = HmtAscii(serial_port='/dev/tty.usbserial-AI02FCVO',
+                   serial_baud=115200, poll_interval=60,
+                   config_location='../config.ini')
+    hmt.acquisition_thread.join()
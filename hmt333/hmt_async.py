@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+import warnings
+
+import serial
+from hmt_ascii import HmtAscii, SERIAL_ERRORS, SERIAL_RTT
+from serial_link import AsyncSerialLink, get_link
+
+
+class AsyncHmtAscii(HmtAscii):
+    """asyncio version of the HMT333 ASCII data retrieval class. The serial
+    port is opened without blocking the event loop and is then read through
+    the event loop's file descriptor monitoring (see AsyncSerialLink), so a
+    sensor transaction (write the 'send' command then wait for the response
+    line) does not tie up a thread while waiting for the radio round trip.
+    Each transaction has its own deadline and can be cancelled. Polling runs
+    as a coroutine alongside the other tasks (e.g. the HTTP server) in a
+    single event loop. The response is processed in a worker thread, as
+    publishing a reading appends to the journals (and now and then
+    compacts them) and runs the observers, which would otherwise hold up
+    the event loop."""
+
+    def setup(self):
+        """The serial port is opened and polling started by run()."""
+
+    async def open_serial_async(self):
+        """Open the serial port and switch off the sensor command echo."""
+        self.link = get_link(self.serial_port_name, self.serial_baud,
+                             self.read_timeout, AsyncSerialLink)
+        await self.link.open_async()
+        try:
+            self.write_command('echo off')
+            logging.info('echo switched off')
+            if self.form:
+                self.write_command('form ' + self.form)
+        except BaseException:
+            self.link.release()
+            raise
+
+    async def get_hmt_data_async(self):
+        """Request a reading from the sensor and process the response."""
+        try:
+            logging.info('sent SEND command to HMT requesting reading...')
+            start = time.perf_counter()
+            data_bytes = await self.link.transaction_async(
+                self.send_command(), self.read_timeout)
+            SERIAL_RTT.observe(time.perf_counter() - start, self.sensor_id)
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.handle_response, data_bytes)
+        except serial.SerialException as error:
+            SERIAL_ERRORS.inc(self.sensor_id)
+            warnings.warn("Serial port error: " + str(error), Warning)
+
+    async def run(self):
+        """Open the serial port and poll the sensor at fixed deadlines on
+        the event loop's monotonic clock until cancelled. An unexpected
+        error in a poll cycle is logged and polling carries on. The serial
+        port is shared with any other sensors on it, so is only closed once
+        they have all stopped."""
+        await self.open_serial_async()
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        try:
+            while True:
+                cycle_start = loop.time()
+                try:
+                    await self.get_hmt_data_async()
+                except Exception:
+                    logging.exception('Poll cycle failed - ' +
+                                      self.sensor_id)
+                next_poll = self.schedule_next_poll(
+                    next_poll, cycle_start, loop.time())
+                await asyncio.sleep(next_poll - loop.time())
+        finally:
+            self.link.release()
@@ -1,9 +1,50 @@
+import asyncio
 import json
 import logging
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from hmt_ascii import HmtAscii
-from datetime import datetime
+import threading
+import time
+import urllib.parse
+import warnings
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from event_stream import EventStream
+from history import HISTORY_FIELDS
+from influx import InfluxPusher, format_line
+from metrics import CONTENT_TYPE, REGISTRY, Gauge, Histogram
+from timeseries import SERIES_FIELDS, TieredStore
+
+# Readings served before the first valid observation
+EMPTY_FIELDS = dict(timestamp='', obs_age='', temperature='',
+                    max_temp_calc='', min_temp_calc='', data_points='')
+
+# Serving metrics (see also the acquisition metrics in hmt_ascii.py)
+HTTP_LATENCY = Histogram(
+    'hmt333_http_request_duration_seconds',
+    'Time taken to build and send the response to an HTTP request',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    labels=('path',), unit='seconds')
+MAXMIN_BUFFER = Gauge(
+    'hmt333_maxmin_buffer_readings',
+    'Readings held in the rolling max and min deques (see ExtremesEngine)',
+    labels=('sensor', 'deque'))
+STREAM_CLIENTS = Gauge('hmt333_stream_clients',
+                       'Clients subscribed to the /stream events')
+# Paths by which HTTP request latencies are labelled
+METRIC_PATHS = ('', '/sensors', '/history', '/series', '/metrics',
+                '/metrics.lp', '/health', '/stream')
+
+HTTP_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+                404: 'Not Found', 501: 'Not Implemented',
+                503: 'Service Unavailable'}
+
+# Headers of a /stream (Server-Sent Events) response. The events are sent
+# until the client disconnects, so the connection is not kept alive
+# afterwards. X-Accel-Buffering stops a proxy (e.g. nginx) holding events
+# back.
+STREAM_HEADERS = {'Content-Type': 'text/event-stream',
+                  'Cache-Control': 'no-cache', 'Connection': 'close',
+                  'X-Accel-Buffering': 'no'}
 
 
 class HMTservice:
@@ -14,72 +55,804 @@ class HMTservice:
         config_location = '/data/config.ini'
         # config_location = '../config.ini'
 
-        serial_port = os.getenv('HMT333_PORT', '/dev/tty.usbserial-AI02FCVO')
         serial_baud = int(os.getenv('HMT333_BAUD', 115200))
         data_poll_interval = int(os.getenv('DATA_POLL_INTERVAL', 60))
-        self.sensor = HmtAscii(
-            serial_port, serial_baud, data_poll_interval, config_location)
+        self.http_port = int(os.getenv('HMT333_HTTP_PORT', 7575))
+        self.config_location = config_location
+        self.serial_baud = serial_baud
+        self.data_poll_interval = data_poll_interval
+
+        # In async mode sensor polling and the HTTP server run as tasks in a
+        # single asyncio event loop rather than in separate threads.
+        self.async_mode = os.getenv('ASYNC_MODE', 'false') == 'true'
+
+        # The sensors are set up in the background once the HTTP server is
+        # listening (see initialise_sensors), as opening the serial port and
+        # loading the journals can take a while (or, with the radio
+        # missing, fail), so until then there are no sensors. The first
+        # sensor is the 'primary' sensor whose reading is served at '/' (as
+        # used by Telegraf and the WoW service). A sensor whose serial port
+        # can't be opened is retried every SENSOR_RETRY seconds.
+        self.sensors = {}
+        self.sensor = None
+        self.sensor_retry = float(os.getenv('SENSOR_RETRY') or 30)
+
+        # Start-up progress, served at /health: the service state
+        # ('starting', 'ready' once the primary sensor has a reading, or
+        # 'failed' if the sensors couldn't be set up), the state of each
+        # sensor and the time taken to reach each stage of start-up.
+        self.started = time.monotonic()
+        self.state = 'starting'
+        self.error = None
+        self.sensor_states = {}
+        self.sensor_errors = {}
+        self.startup_times = {}
+
+        # Serialised JSON for the latest reading of each sensor, rebuilt only
+        # when a sensor has a new observation. Each entry is (sequence,
+        # head, tail, obs_monotonic); the observation age is inserted between
+        # head and tail when a response is sent. ETags include the service
+        # start time so they are not reused after a restart.
+        self.serialised = {}
+        self.etag_prefix = 'W/"' + format(int(time.time()), 'x') + '-'
+
+        # InfluxDB line protocol for the latest readings (see
+        # get_line_protocol), rebuilt when any sensor has a new observation.
+        self.measurement = os.getenv('INFLUX_MEASUREMENT') or 'HMT333-data'
+        self.line_protocol = (None, b'')
+
+        # Optionally write each new observation straight to InfluxDB
+        push_url = os.getenv('INFLUX_PUSH_URL', '')
+        self.pusher = None
+        if push_url:
+            self.pusher = InfluxPusher(
+                push_url,
+                os.getenv('INFLUX_SPOOL') or '/usr/src/app/influx-spool.lp',
+                flush_interval=float(os.getenv('INFLUX_PUSH_INTERVAL') or 10))
+
+        # Tiered store of each sensor's temperatures (raw readings, 1 minute
+        # and hourly aggregates) for range queries (see get_series)
+        self.series = {}
+
+        # Server-Sent Events stream of the observations and QC events (see
+        # open_stream), so clients are sent each observation as it is made
+        # rather than polling for it. The last SSE_BUFFER events are kept
+        # for clients that reconnect. There may be up to SSE_MAX_CLIENTS
+        # subscribers (each holds a thread in threaded mode). A comment is
+        # sent to each subscriber after SSE_KEEPALIVE seconds without events
+        # so idle connections aren't dropped by proxies and clients that
+        # have gone away are noticed.
+        self.events = EventStream(int(os.getenv('SSE_BUFFER') or 1000))
+        self.stream_keepalive = float(os.getenv('SSE_KEEPALIVE') or 15)
+        self.stream_max_clients = int(os.getenv('SSE_MAX_CLIENTS') or 100)
+        self.stream_clients = 0
+        self.stream_lock = threading.Lock()
+
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def create_sensors(self):
+        """Create the sensors (without starting them) and their time series
+        stores, and add the observers of their observations. As the sensors
+        aren't polled until they are started, the observers see every
+        observation including the first. The sensor classes are imported
+        here as importing them (and APScheduler, numpy etc.) takes most of
+        the service's start-up time.
+        :return: True if the sensors were created (if not the service state
+        is 'failed')."""
+        if self.async_mode:
+            from hmt_async import AsyncHmtAscii as sensor_class
+        else:
+            from hmt_ascii import HmtAscii as sensor_class
 
-    def get_data(self):
+        sensors, series = {}, {}
+        try:
+            for sensor_id, serial_port, address in self.sensor_settings():
+                self.sensor_states[sensor_id] = 'initialising'
+                if not sensors:
+                    calibration_section = 'CALIBRATION'
+                    journal_path = None
+                    history_path = None
+                    series_path = os.getenv('SERIES_PATH') or '/data/series'
+                else:
+                    calibration_section = 'CALIBRATION_' + sensor_id
+                    journal_path = self.sensor_path(
+                        'TEMPS_JOURNAL', '/usr/src/app/temps.journal',
+                        sensor_id)
+                    history_path = self.sensor_path(
+                        'HISTORY_PATH', '/usr/src/app/history.journal',
+                        sensor_id)
+                    series_path = self.sensor_path(
+                        'SERIES_PATH', '/data/series', sensor_id)
+                sensor = sensor_class(
+                    serial_port, self.serial_baud, self.data_poll_interval,
+                    self.config_location, sensor_id=sensor_id,
+                    address=address, calibration_section=calibration_section,
+                    journal_path=journal_path, history_path=history_path,
+                    start=False)
+                series[sensor_id] = TieredStore(
+                    series_path,
+                    raw_retention=float(os.getenv(
+                        'SERIES_RAW_RETENTION') or 48) * 3600,
+                    minute_retention=float(os.getenv(
+                        'SERIES_MINUTE_RETENTION') or 90) * 86400,
+                    hour_retention=float(os.getenv(
+                        'SERIES_HOUR_RETENTION') or 3650) * 86400)
+                sensor.observers.append(self.record_series)
+                if self.pusher is not None:
+                    sensor.observers.append(self.push_observation)
+                sensor.observers.append(self.record_first_reading)
+                sensor.observers.append(self.publish_observation)
+                sensor.qc_observers.append(self.publish_qc_event)
+                sensors[sensor_id] = sensor
+        except Exception as error:
+            self.state = 'failed'
+            self.error = str(error)
+            warnings.warn('Unable to set up the sensors: ' + str(error),
+                          Warning)
+            return False
+
+        # The primary sensor is set last, as the sensors are served once it
+        # is set
+        self.series = series
+        self.sensors = sensors
+        self.sensor = next(iter(sensors.values()))
+        self.record_startup('sensors')
+        return True
+
+    def initialise_sensors(self):
+        """Create the sensors and start polling them (run in the background
+        once the HTTP server is listening). A sensor whose serial port can't
+        be opened (e.g. the radio is missing) is retried every SENSOR_RETRY
+        seconds, without holding up the other sensors."""
+        if not self.create_sensors():
+            return
+        waiting = list(self.sensors.values())
+        while True:
+            for sensor in list(waiting):
+                self.sensor_states[sensor.sensor_id] = 'connecting'
+                try:
+                    sensor.setup()
+                    waiting.remove(sensor)
+                except OSError as error:
+                    self.sensor_failed(sensor, error)
+            if not waiting:
+                break
+            time.sleep(self.sensor_retry)
+
+    def sensor_failed(self, sensor, error):
+        """Record that a sensor's serial port couldn't be opened."""
+        self.sensor_states[sensor.sensor_id] = 'failed'
+        self.sensor_errors[sensor.sensor_id] = str(error)
+        warnings.warn('Unable to open serial port for ' + sensor.sensor_id +
+                      ' (retrying in ' + str(self.sensor_retry) + ' s): ' +
+                      str(error), Warning)
+
+    def record_first_reading(self, sensor, data):
+        """Mark a sensor (and, for the primary sensor, the service) ready
+        when its first observation is made."""
+        if self.sensor_states.get(sensor.sensor_id) == 'ready':
+            return
+        self.sensor_states[sensor.sensor_id] = 'ready'
+        self.sensor_errors.pop(sensor.sensor_id, None)
+        if sensor is self.sensor:
+            self.state = 'ready'
+            self.record_startup('first_reading')
+
+    def record_startup(self, stage):
+        """Record (and log) the time taken to reach a stage of start-up
+        e.g. 'http' when the HTTP server is listening."""
+        elapsed = round(time.monotonic() - self.started, 3)
+        self.startup_times[stage] = elapsed
+        logging.info('Start-up: ' + stage + ' after ' + str(elapsed) + ' s')
+
+    def get_health(self):
+        """Build the response to a health request (e.g. a readiness check
+        made by a container orchestrator or the other services): the
+        service state, how long it has been running, the start-up times and
+        the state, any error and the observation age of each sensor. The
+        status is 200 once the service is ready, otherwise 503.
+        :return: HTTP status code, response headers and response body."""
+        sensors = {}
+        for sensor_id, state in list(self.sensor_states.items()):
+            sensor = {'state': state}
+            if sensor_id in self.sensor_errors:
+                sensor['error'] = self.sensor_errors[sensor_id]
+            if sensor_id in self.sensors:
+                sensor['obs_age'] = self.obs_age(
+                    self.sensors[sensor_id].latest_data())
+            sensors[sensor_id] = sensor
+        health = {'status': self.state,
+                  'uptime': round(time.monotonic() - self.started, 3),
+                  'startup': dict(self.startup_times), 'sensors': sensors}
+        if self.error is not None:
+            health['error'] = self.error
+        return 200 if self.state == 'ready' else 503, \
+            {'Content-Type': 'application/json',
+             'Cache-Control': 'no-cache'}, json.dumps(health).encode('UTF-8')
+
+    def get_starting_response(self, path):
+        """Build the response to a request made before the sensors have
+        been set up. The latest readings are served empty (as before the
+        first observation); other requests are answered 503.
+        :return: HTTP status code, response headers and response body."""
+        if path == '':
+            return 200, {'Content-Type': 'application/json',
+                         'Cache-Control': 'no-cache'}, \
+                json.dumps(EMPTY_FIELDS).encode('UTF-8')
+        if path == '/sensors':
+            return 200, {'Content-Type': 'application/json',
+                         'Cache-Control': 'no-cache'}, b'{}'
+        if path == '/metrics.lp':
+            return 200, {'Content-Type': 'text/plain; charset=utf-8',
+                         'Cache-Control': 'no-cache'}, b''
+        return 503, {'Content-Type': 'application/json',
+                     'Retry-After': '5'}, \
+            json.dumps({'error': 'Starting',
+                        'status': self.state}).encode('UTF-8')
+
+    @staticmethod
+    def sensor_settings():
+        """Get the sensor identifiers, serial ports and (optional) addresses
+        of the sensors to be polled. HMT333_SENSORS is a comma separated list
+        of sensors in the form id=port or id=port@address (for RS-485
+        addressed units sharing a port) e.g.
+        HMT333_SENSORS=screen1=/dev/ttyUSB0,screen2=/dev/ttyUSB1@2
+        If HMT333_SENSORS is not set a single sensor 'HMT333' on HMT333_PORT
+        is used. The calibration for the first sensor is read from the
+        CALIBRATION section of the config file, for any others from a
+        CALIBRATION_<id> section.
+        :return: A list of (sensor id, serial port, address) tuples."""
+        sensors = os.getenv('HMT333_SENSORS', '')
+        if not sensors:
+            return [('HMT333', os.getenv(
+                'HMT333_PORT', '/dev/tty.usbserial-AI02FCVO'), None)]
+
+        settings = []
+        for sensor in sensors.split(','):
+            sensor_id, port = sensor.strip().split('=', 1)
+            address = None
+            if '@' in port:
+                port, address = port.split('@', 1)
+            settings.append((sensor_id, port, address))
+        return settings
+
+    @staticmethod
+    def sensor_path(variable, default, sensor_id):
+        """Get the location of a file for a sensor other than the primary
+        sensor, e.g. /usr/src/app/temps-screen2.journal for the max/min
+        journal of sensor 'screen2'.
+        :param variable: Environment variable holding the location of the
+        primary sensor's file.
+        :param default: Default location of the primary sensor's file.
+        :param sensor_id: The sensor identifier.
+        :return: The location of the file for the sensor."""
+        directory, name = os.path.split(os.getenv(variable) or default)
+        stem, extension = os.path.splitext(name)
+        return os.path.join(directory, stem + '-' + sensor_id + extension)
+
+    def get_data(self, sensor_id=None):
         """Return the latest recorded values from the instrument as
         captured by the data reception and decoding functions in this
         class. A timestamp and age of the reading are also provided.
+        :param sensor_id: The sensor identifier, defaults to the primary
+        sensor.
         :return: JSON formatted temperature reading (degrees C),
         timestamp and age of the reading in seconds."""
-        data = self.sensor.latest_data()
-        if data['temperature'] is not None:
-            obs_age = (datetime.utcnow() - data['time_obs']).seconds
-            # logging.info(data)
-            return [
-                {
-                    'measurement': 'HMT333',
-                    'fields': {
-                        'timestamp': data['timestamp'],
-                        'obs_age': obs_age,
-                        'temperature': data['temperature'],
-                        'max_temp_calc': data['max_temp'],
-                        'min_temp_calc': data['min_temp'],
-                        'data_points': data['data_points']
-
-                    }
-                }
-            ]
+        if sensor_id is None:
+            sensor = self.sensor
+        else:
+            sensor = self.sensors[sensor_id]
+        data = sensor.latest_data()
+        return [
+            {
+                'measurement': sensor.sensor_id,
+                'fields': self.fields(data, self.obs_age(data))
+            }
+        ]
+
+    @staticmethod
+    def fields(data, obs_age):
+        """Build the fields served for a reading.
+        :param data: The latest reading from the sensor (see latest_data).
+        :param obs_age: The age of the reading in seconds.
+        :return: A dictionary of the fields served."""
+        if data['temperature'] is None:
+            return dict(EMPTY_FIELDS)
+        fields = {
+            'timestamp': data['timestamp'],
+            'obs_age': obs_age,
+            'temperature': data['temperature'],
+            'max_temp_calc': data['max_temp'],
+            'min_temp_calc': data['min_temp'],
+            'data_points': data['data_points']
+        }
+        # 10 minute average temperature (high rate sampling mode only)
+        if data['temperature_10min'] is not None:
+            fields['temperature_10min'] = data['temperature_10min']
+        # Other quantities read from the sensor (see FieldMap)
+        fields.update(data['quantities'])
+        return fields
+
+    @staticmethod
+    def obs_age(data):
+        """:return: The age of a reading in whole seconds (or '' if there
+        is no reading yet)."""
+        if data['obs_monotonic'] is None:
+            return ''
+        return int(time.monotonic() - data['obs_monotonic'])
+
+    def sensor_json(self, sensor):
+        """Get the JSON for the latest reading from a sensor. The reading is
+        only serialised once per observation; after that just the
+        observation age is filled in for each request.
+        :return: The JSON as bytes and the observation sequence number."""
+        cached = self.serialised.get(sensor.sensor_id)
+        if cached is None or cached[0] != sensor.sequence:
+            data = sensor.latest_data()
+            fields = self.fields(data, '')
+            if data['temperature'] is None:
+                head, tail = json.dumps(fields).encode('UTF-8'), b''
+            else:
+                timestamp = json.dumps({'timestamp': fields.pop('timestamp')})
+                fields.pop('obs_age')
+                head = (timestamp[:-1] + ', "obs_age": ').encode('UTF-8')
+                tail = (', ' + json.dumps(fields)[1:]).encode('UTF-8')
+            cached = (data['sequence'], head, tail, data['obs_monotonic'])
+            self.serialised[sensor.sensor_id] = cached
+        sequence, head, tail, obs_monotonic = cached
+        if obs_monotonic is None:
+            return head, sequence
+        age = int(time.monotonic() - obs_monotonic)
+        return head + str(age).encode() + tail, sequence
 
+    def observation_line(self, sensor, data):
+        """:return: An observation as an InfluxDB line protocol line, timed
+        to the nanosecond at which the observation was made. All values are
+        written as floats (as Telegraf's JSON parser did)."""
+        fields = self.fields(data, '')
+        fields.pop('timestamp')
+        fields.pop('obs_age')
+        return format_line(self.measurement, {'sensor': sensor.sensor_id},
+                           fields, int(data['obs_time'] * 1e9))
+
+    def push_observation(self, sensor, data):
+        """Queue a new observation to be written to InfluxDB."""
+        self.pusher.add(self.observation_line(sensor, data))
+
+    def get_line_protocol(self):
+        """Get the latest readings of all the sensors in InfluxDB line
+        protocol, for Telegraf's http input (data_format = "influx"). As
+        each reading keeps its observation time, repeated requests for the
+        same reading update the same point rather than adding new ones.
+        :return: The line protocol as bytes and the observation sequence
+        numbers."""
+        sequences = tuple(sensor.sequence for sensor in self.sensors.values())
+        if self.line_protocol[0] != sequences:
+            lines = []
+            for sensor in self.sensors.values():
+                data = sensor.latest_data()
+                if data['temperature'] is not None:
+                    lines.append(self.observation_line(sensor, data) + '\n')
+            self.line_protocol = (sequences, ''.join(lines).encode('UTF-8'))
+        return self.line_protocol[1], sequences
+
+    def publish_observation(self, sensor, data):
+        """Send a new observation to the /stream subscribers."""
+        event = {'sensor': sensor.sensor_id}
+        event.update(self.fields(data, 0))
+        self.events.publish('observation', event, key=sensor.sensor_id)
+
+    def publish_qc_event(self, sensor, kind, data_bytes):
+        """Send a line from a sensor that wasn't a valid reading (see
+        HmtAscii.handle_response) to the /stream subscribers."""
+        self.events.publish('qc', {
+            'sensor': sensor.sensor_id, 'kind': kind,
+            'timestamp': datetime.now(timezone.utc).strftime(
+                '%Y-%m-%dT%H:%M:%SZ'),
+            'line': bytes(data_bytes).decode('latin-1').strip()})
+
+    def open_stream(self, last_event_id=None):
+        """Start a /stream subscription, unless there are already
+        SSE_MAX_CLIENTS subscribers. A new subscriber is sent the latest
+        observation of each sensor; a reconnecting subscriber the events it
+        missed (see EventStream.subscribe).
+        :param last_event_id: The request Last-Event-ID header (if any).
+        :return: The messages to send first and the number of the last
+        event sent (see EventStream.wait), or None if the subscription is
+        refused."""
+        with self.stream_lock:
+            if self.stream_clients >= self.stream_max_clients:
+                return None
+            self.stream_clients += 1
+        messages, number = self.events.subscribe(last_event_id)
+        # Ask clients to reconnect promptly if the connection is lost
+        return [b'retry: 3000\n\n'] + messages, number
+
+    def close_stream(self):
+        """End a /stream subscription."""
+        with self.stream_lock:
+            self.stream_clients -= 1
+
+    @staticmethod
+    def stream_refused():
+        """:return: HTTP status code, response headers and response body
+        refusing a /stream subscription."""
+        return 503, {'Content-Type': 'application/json',
+                     'Retry-After': '30'}, \
+            b'{"error": "Too many stream clients"}'
+
+    def record_series(self, sensor, data):
+        """Add a new observation to the sensor's time series store."""
+        self.series[sensor.sensor_id].add(data['obs_time'],
+                                          data['temperature'])
+
+    def collect_metrics(self):
+        """Bring the max/min buffer size and stream client gauges up to
+        date (called when the metrics are requested)."""
+        STREAM_CLIENTS.set(self.stream_clients)
+        for sensor in self.sensors.values():
+            extremes = sensor.max_temp_handler.extremes
+            MAXMIN_BUFFER.set(len(extremes.max_deque), sensor.sensor_id,
+                              'max')
+            MAXMIN_BUFFER.set(len(extremes.min_deque), sensor.sensor_id,
+                              'min')
+
+    @staticmethod
+    def metric_path(path):
+        """:return: The path by which a request's latency is labelled
+        (one per kind of request, so sensor ids and queries aren't
+        labels)."""
+        path = path.partition('?')[0].rstrip('/')
+        if path.startswith('/sensors/'):
+            return '/sensors/<id>'
+        if path in METRIC_PATHS:
+            return path or '/'
+        return 'other'
+
+    def get_response(self, path, if_none_match=None):
+        """Build the response to an HTTP GET request.
+        '/' - the latest reading from the primary sensor.
+        '/sensors' - the latest readings from all sensors keyed by sensor id.
+        '/sensors/<id>' - the latest reading from one sensor.
+        '/history' - earlier readings (see get_history).
+        '/series' - readings over a time range (see get_series).
+        '/metrics.lp' - the latest readings in InfluxDB line protocol.
+        '/metrics' - the service's metrics (OpenMetrics text format).
+        '/health' - the service's start-up state (see get_health).
+        ('/stream' - the observations as they are made, as Server-Sent
+        Events - is answered by the request handlers, see open_stream.)
+        A weak ETag identifying the observation(s) is returned with each
+        reading. If the client already has the observation (If-None-Match)
+        a 304 Not Modified response is returned instead of the body.
+        :param path: The request path.
+        :param if_none_match: The request If-None-Match header (if any).
+        :return: HTTP status code, response headers and response body."""
+        content_type = 'application/json'
+        path, _, query = path.partition('?')
+        path = path.rstrip('/')
+        if path == '/health':
+            return self.get_health()
+        if path == '/metrics':
+            return 200, {'Content-Type': CONTENT_TYPE,
+                         'Cache-Control': 'no-cache'}, REGISTRY.render()
+        if self.sensor is None:
+            return self.get_starting_response(path)
+        if path == '/history':
+            return self.get_history(query)
+        if path == '/series':
+            return self.get_series(query)
+        if path == '':
+            body, sequence = self.sensor_json(self.sensor)
+            etag = self.etag_prefix + str(sequence) + '"'
+        elif path == '/metrics.lp':
+            body, sequences = self.get_line_protocol()
+            etag = self.etag_prefix + 'lp.' + '.'.join(
+                str(sequence) for sequence in sequences) + '"'
+            content_type = 'text/plain; charset=utf-8'
+        elif path == '/sensors':
+            parts, sequences = [], []
+            for sensor_id, sensor in self.sensors.items():
+                sensor_body, sequence = self.sensor_json(sensor)
+                parts.append(json.dumps(sensor_id).encode('UTF-8') + b': ' +
+                             sensor_body)
+                sequences.append(str(sequence))
+            body = b'{' + b', '.join(parts) + b'}'
+            etag = self.etag_prefix + '.'.join(sequences) + '"'
+        elif path.startswith('/sensors/') and \
+                path[len('/sensors/'):] in self.sensors:
+            body, sequence = self.sensor_json(
+                self.sensors[path[len('/sensors/'):]])
+            etag = self.etag_prefix + str(sequence) + '"'
         else:
-            return [
-                {
-                    'measurement': 'HMT333',
-                    'fields': {
-                        'timestamp': '',
-                        'obs_age': '',
-                        'temperature': '',
-                        'max_temp_calc': '',
-                        'min_temp_calc': '',
-                        'data_points': ''
-                    }
-                }
-            ]
+            return 404, {'Content-Type': 'application/json'}, \
+                b'{"error": "Not found"}'
+
+        headers = {'Content-Type': content_type, 'ETag': etag,
+                   'Cache-Control': 'no-cache'}
+        if if_none_match is not None and etag in [
+                tag.strip() for tag in if_none_match.split(',')]:
+            return 304, headers, b''
+        return 200, headers, body
+
+    def get_history(self, query):
+        """Build the response to a history request, used by consumers to
+        catch up on the readings missed while they were unavailable e.g.
+        /history?since=2023-03-26T09:00:00Z&limit=500&sensor=screen2
+        'since' is the time (ISO 8601 UTC or seconds since the epoch) after
+        which readings are wanted (default: all readings held), 'limit' the
+        maximum number of readings to return (default 1000, maximum 10000)
+        and 'sensor' the sensor identifier (default: the primary sensor).
+        If there may be more readings, 'next' gives the 'since' value for
+        the next request.
+        :param query: The request query string.
+        :return: HTTP status code, response headers and response body."""
+        headers = {'Content-Type': 'application/json'}
+        params = urllib.parse.parse_qs(query)
+        try:
+            since = self.parse_time(params.get('since', ['0'])[0])
+            limit = min(int(params.get('limit', ['1000'])[0]), 10000)
+            if limit < 1:
+                raise ValueError('limit must be at least 1')
+        except ValueError as error:
+            return 400, headers, json.dumps(
+                {'error': str(error)}).encode('UTF-8')
+        sensor_id = params.get('sensor', [self.sensor.sensor_id])[0]
+        if sensor_id not in self.sensors:
+            return 404, headers, b'{"error": "Not found"}'
+
+        readings = self.sensors[sensor_id].history.since(since, limit)
+        next_since = readings[-1][0] if len(readings) == limit else None
+        body = json.dumps({'fields': HISTORY_FIELDS, 'readings': readings,
+                           'next': next_since}, separators=(',', ':'))
+        return 200, headers, body.encode('UTF-8')
+
+    def get_series(self, query):
+        """Build the response to a time series request, e.g.
+        /series?start=2023-03-01T00:00:00Z&end=2023-04-01T00:00:00Z&step=3600
+        'start' and 'end' are the time range (ISO 8601 UTC or seconds since
+        the epoch, default the last 24 hours), 'step' the resolution wanted
+        in seconds (optional), 'points' the maximum number of periods
+        (default 1000, maximum 10000) and 'sensor' the sensor identifier
+        (default: the primary sensor). The readings come from the coarsest
+        tier of the store that satisfies the request (see TieredStore), as
+        rows of period start time, mean, maximum and minimum temperature
+        and number of readings - a table Grafana's JSON data sources (e.g.
+        Infinity) can plot directly.
+        :param query: The request query string.
+        :return: HTTP status code, response headers and response body."""
+        headers = {'Content-Type': 'application/json'}
+        params = urllib.parse.parse_qs(query)
+        try:
+            now = time.time()
+            end = self.parse_time(params.get('end', [str(now)])[0])
+            start = self.parse_time(
+                params.get('start', [str(end - 86400)])[0])
+            step = float(params.get('step', ['0'])[0])
+            points = min(int(params.get('points', ['1000'])[0]), 10000)
+            if end <= start or step < 0 or points < 1:
+                raise ValueError('invalid range, step or points')
+        except ValueError as error:
+            return 400, headers, json.dumps(
+                {'error': str(error)}).encode('UTF-8')
+        sensor_id = params.get('sensor', [self.sensor.sensor_id])[0]
+        if sensor_id not in self.series:
+            return 404, headers, b'{"error": "Not found"}'
+
+        tier, step, rows = self.series[sensor_id].query(
+            start, end, step, points, now)
+        body = json.dumps({'sensor': sensor_id, 'tier': tier, 'step': step,
+                           'fields': SERIES_FIELDS, 'rows': rows},
+                          separators=(',', ':'))
+        return 200, headers, body.encode('UTF-8')
+
+    @staticmethod
+    def parse_time(text):
+        """Parse a time given in a request (ISO 8601 UTC e.g.
+        2023-03-26T09:00:00Z or seconds since the epoch).
+        :return: The time in seconds since the epoch."""
+        try:
+            return float(text)
+        except ValueError:
+            return datetime.strptime(text, '%Y-%m-%dT%H:%M:%SZ').replace(
+                tzinfo=timezone.utc).timestamp()
+
+    async def run_async(self):
+        """Run sensor polling and the HTTP server in one event loop."""
+        server = await asyncio.start_server(
+            self.handle_http_async, port=self.http_port)
+        self.record_startup('http')
+        logging.info('HMT333 sensor HTTP server running (async)')
+        async with server:
+            await asyncio.gather(server.serve_forever(),
+                                 self.run_sensors_async())
+
+    async def run_sensors_async(self):
+        """Create the sensors (in a worker thread, so the HTTP server keeps
+        answering) then poll them."""
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self.create_sensors):
+            await asyncio.gather(*[self.run_sensor_async(sensor)
+                                   for sensor in self.sensors.values()])
+
+    async def run_sensor_async(self, sensor):
+        """Poll a sensor, retrying every SENSOR_RETRY seconds if its
+        serial port can't be opened."""
+        while True:
+            self.sensor_states[sensor.sensor_id] = 'connecting'
+            try:
+                await sensor.run()
+            except OSError as error:
+                self.sensor_failed(sensor, error)
+                await asyncio.sleep(self.sensor_retry)
+
+    async def handle_http_async(self, reader, writer):
+        """Answer HTTP requests on a (keep-alive) connection."""
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), 30)
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), 10)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                request = request_line.decode('latin-1').split()
+                if len(request) < 3:
+                    break
+                if request[0] == 'GET' and \
+                        self.metric_path(request[1]) == '/stream':
+                    await self.stream_async(writer,
+                                            headers.get('last-event-id'))
+                    break
+                keep_alive = request[2] == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                start = time.perf_counter()
+                if request[0] in ('GET', 'HEAD'):
+                    status, response_headers, body = self.get_response(
+                        request[1], headers.get('if-none-match'))
+                else:
+                    status, response_headers, body = 501, {}, b''
+                    keep_alive = False
+                if request[0] == 'HEAD':
+                    response_headers['Content-Length'] = str(len(body))
+                    body = b''
+                else:
+                    response_headers['Content-Length'] = str(len(body))
+                if not keep_alive:
+                    response_headers['Connection'] = 'close'
+                writer.write(self.http_head(status, response_headers) + body)
+                await writer.drain()
+                HTTP_LATENCY.observe(time.perf_counter() - start,
+                                     self.metric_path(request[1]))
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def http_head(status, headers):
+        """:return: The status line and headers of an HTTP response."""
+        lines = ''.join(name + ': ' + value + '\r\n'
+                        for name, value in headers.items())
+        return ('HTTP/1.1 ' + str(status) + ' ' + HTTP_REASONS[status] +
+                '\r\n' + lines + '\r\n').encode('latin-1')
+
+    async def stream_async(self, writer, last_event_id):
+        """Send the observations and QC events to a /stream client as they
+        are made, until it disconnects."""
+        subscription = self.open_stream(last_event_id)
+        if subscription is None:
+            status, headers, body = self.stream_refused()
+            headers['Content-Length'] = str(len(body))
+            headers['Connection'] = 'close'
+            writer.write(self.http_head(status, headers) + body)
+            await writer.drain()
+            return
+        messages, number = subscription
+        try:
+            writer.write(self.http_head(200, STREAM_HEADERS))
+            while True:
+                writer.write(b''.join(messages) or b': keep-alive\n\n')
+                await writer.drain()
+                messages, number = await self.events.wait_async(
+                    number, self.stream_keepalive)
+        finally:
+            self.close_stream()
 
 
 class HMT333http(BaseHTTPRequestHandler):
-    def _set_headers(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+    # HTTP/1.1 so that clients can keep their connection open between
+    # requests. Idle connections are closed after the timeout (seconds).
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+    # The headers and body are written separately, so without TCP_NODELAY
+    # the body of each response on a kept-alive connection waits for the
+    # client's delayed ACK (~40 ms).
+    disable_nagle_algorithm = True
+
+    def send(self, include_body, response=None):
+        start = time.perf_counter()
+        if response is None:
+            response = HMTservice.get_response(
+                self.path, self.headers.get('If-None-Match'))
+        status, headers, body = response
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+        HTTP_LATENCY.observe(time.perf_counter() - start,
+                             HMTservice.metric_path(self.path))
+
+    def stream(self):
+        """Send the observations and QC events to a /stream client as they
+        are made, until it disconnects."""
+        subscription = HMTservice.open_stream(
+            self.headers.get('Last-Event-ID'))
+        if subscription is None:
+            self.send(True, HMTservice.stream_refused())
+            return
+        messages, number = subscription
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            for name, value in STREAM_HEADERS.items():
+                self.send_header(name, value)
+            self.end_headers()
+            while True:
+                self.wfile.write(b''.join(messages) or b': keep-alive\n\n')
+                messages, number = HMTservice.events.wait(
+                    number, HMTservice.stream_keepalive)
+        except OSError:
+            # The client has gone away
+            pass
+        finally:
+            HMTservice.close_stream()
 
     def do_GET(self):
-        self._set_headers()
-        measurements = HMTservice.get_data()
-        self.wfile.write(json.dumps(measurements[0]['fields']).encode('UTF-8'))
+        if HMTservice.metric_path(self.path) == '/stream':
+            self.stream()
+        else:
+            self.send(include_body=True)
+
+    def do_HEAD(self):
+        self.send(include_body=False)
+
+    def log_message(self, format, *args):
+        # Requests are made every few seconds (e.g. by Telegraf) so are not
+        # logged.
+        pass
+
+
+class HMT333server(ThreadingHTTPServer):
+    # Allow for many clients connecting at once (the default backlog of 5
+    # leaves further connection attempts waiting a second to retry).
+    request_queue_size = 64
+    daemon_threads = True
 
 
 # Start the server that answers requests for readings and inputs received
-# data for extraction and processing.
+# data for extraction and processing. Each connection is handled in its own
+# thread so a slow client does not hold up any others. The server is
+# started first and the sensors are set up in the background.
 if os.getenv('HMT333_ENABLE', 'true') == 'true':
     HMTservice = HMTservice()
 
-    while True:
-        server_address = ('', 7575)
-        httpd = HTTPServer(server_address, HMT333http)
+    if HMTservice.async_mode:
+        asyncio.run(HMTservice.run_async())
+    else:
+        server_address = ('', HMTservice.http_port)
+        httpd = HMT333server(server_address, HMT333http)
+        HMTservice.record_startup('http')
         logging.info('HMT333 sensor HTTP server running')
-        httpd.serve_forever()
+        threading.Thread(target=HMTservice.initialise_sensors,
+                         name='hmt-startup', daemon=True).start()
+        while True:
+            httpd.serve_forever()
@@ -0,0 +1,302 @@
+"""Simulated Vaisala HMT333 on a pseudo-terminal, for testing the hmt333
+service without the sensor. The simulator speaks enough of the sensor's
+ASCII protocol for the service: 'send' (optionally addressed), 'echo
+on'/'echo off', RUN mode ('r', 's' and 'intv') and the output format
+('form'). Faults seen on the radio link can be simulated: response latency
+and jitter, dropped bytes and the sensor turning its echo back on. Readings
+follow a temperature profile, optionally on an accelerated clock so days
+of readings can be simulated in minutes, or are replayed from a capture of
+real sensor output.
+
+Usage: python hmt_simulator.py [--profile diurnal] [--time-scale 1440]
+       [--latency 0.2] [--jitter 0.1] [--drop-rate 0.001]
+       [--echo-glitch-rate 0.001] [--replay capture.txt]
+The pseudo-terminal's device name is printed; set HMT333_PORT to it."""
+import argparse
+import math
+import os
+import pty
+import random
+import re
+import threading
+import time
+import tty
+from collections import deque
+
+# Default output format: T=  12.3 'C
+DEFAULT_FORM = '"T=" t " \'C" #r #n'
+
+# Quantities the simulator can output in a FORM, with their number format
+FORM_QUANTITIES = {'t': '{:6.1f}', 'rh': '{:6.1f}', 'td': '{:6.1f}'}
+
+# RUN mode output interval units (seconds per unit)
+INTERVAL_UNITS = {'s': 1, 'min': 60, 'h': 3600, 'd': 86400}
+
+
+def constant(temperature=10.0):
+    """Temperature profile: a constant temperature."""
+    return lambda t: temperature
+
+
+def diurnal(mean=10.0, amplitude=5.0, period=86400.0):
+    """Temperature profile: a daily cycle peaking at 15:00."""
+    return lambda t: mean + amplitude * math.sin(
+        2 * math.pi * (t - 9 * 3600) / period)
+
+
+def random_walk(start=10.0, step=0.05, seed=None):
+    """Temperature profile: a random walk (one step per reading)."""
+    rng = random.Random(seed)
+    state = [start]
+
+    def profile(t):
+        state[0] += rng.gauss(0, step)
+        return state[0]
+    return profile
+
+
+PROFILES = {'constant': constant, 'diurnal': diurnal,
+            'random_walk': random_walk}
+
+
+def dew_point(temperature, humidity):
+    """Dew point (deg C) from temperature and RH (Magnus formula)."""
+    gamma = math.log(humidity / 100) + \
+        17.62 * temperature / (243.12 + temperature)
+    return 243.12 * gamma / (17.62 - gamma)
+
+
+class HmtSimulator:
+    """Simulated HMT333 on a pseudo-terminal (see module docstring). The
+    service opens the port named by the 'port' attribute."""
+
+    def __init__(self, profile=None, time_scale=1.0, latency=0.0,
+                 jitter=0.0, drop_rate=0.0, echo_glitch_rate=0.0,
+                 address=None, replay=None, seed=None):
+        """:param profile: Function giving the temperature (deg C) at a
+        (simulated) time in seconds since the epoch, default constant().
+        :param time_scale: Simulated seconds per real second.
+        :param latency: Delay before responding to a command (seconds).
+        :param jitter: Maximum random extra delay (seconds).
+        :param drop_rate: Probability of each output byte being lost.
+        :param echo_glitch_rate: Probability of the sensor turning its echo
+        back on when it receives a command.
+        :param address: The sensor's RS-485 address (if it is addressed).
+        :param replay: Location of a capture of real sensor output (one
+        frame per line) to send instead of the profile's readings.
+        :param seed: Random number seed, for repeatable faults."""
+        self.profile = profile or constant()
+        self.time_scale = time_scale
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.echo_glitch_rate = echo_glitch_rate
+        self.address = address
+        self.rng = random.Random(seed)
+        self.replay_frames = None
+        self.replay_index = 0
+        if replay is not None:
+            with open(replay, 'rb') as capture:
+                self.replay_frames = [
+                    line.rstrip(b'\r\n') + b'\r\n'
+                    for line in capture.read().splitlines() if line.strip()]
+
+        self.echo = True
+        self.form = self.parse_form(DEFAULT_FORM)
+        self.run_interval = 2.0
+        self.running = False
+        self.start_time = time.time()
+        # The most recent commands received and the numbers of commands
+        # received and frames sent
+        self.commands = deque(maxlen=1000)
+        self.command_count = 0
+        self.frames_sent = 0
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.write_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.run_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.command_loop, daemon=True,
+                             name='hmt-simulator'),
+            threading.Thread(target=self.run_loop, daemon=True,
+                             name='hmt-simulator-run')]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        """Stop the simulator and close the pseudo-terminal."""
+        self.stop_event.set()
+        self.run_event.set()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def simulated_time(self):
+        """:return: The simulated time (seconds since the epoch)."""
+        return self.start_time + \
+            (time.time() - self.start_time) * self.time_scale
+
+    @staticmethod
+    def parse_form(form):
+        """Parse a FORM command string into a list of literal strings and
+        quantity names e.g. '"T=" t " \\'C" #r #n'."""
+        items = []
+        for literal, code, name in re.findall(
+                r'"([^"]*)"|(#[rnt])|(\S+)', form):
+            if code:
+                items.append(('literal', {'#r': '\r', '#n': '\n',
+                                          '#t': '\t'}[code]))
+            elif name:
+                items.append(('quantity', name.lower()))
+            else:
+                items.append(('literal', literal))
+        return items
+
+    def frame(self):
+        """:return: The next output frame (bytes)."""
+        if self.replay_frames is not None:
+            frame = self.replay_frames[self.replay_index]
+            self.replay_index = (self.replay_index + 1) % len(
+                self.replay_frames)
+            return frame
+
+        now = self.simulated_time()
+        temperature = self.profile(now)
+        humidity = 70 + 20 * math.sin(2 * math.pi * now / 86400)
+        values = {'t': temperature, 'rh': humidity,
+                  'td': dew_point(temperature, humidity)}
+        text = ''
+        for kind, item in self.form:
+            if kind == 'literal':
+                text += item
+            elif item in FORM_QUANTITIES:
+                text += FORM_QUANTITIES[item].format(values[item])
+            else:
+                text += '***'
+        return text.encode('ascii')
+
+    def write(self, data):
+        """Write to the port, losing bytes at the drop rate."""
+        if self.drop_rate > 0:
+            data = bytes(byte for byte in data
+                         if self.rng.random() >= self.drop_rate)
+        with self.write_lock:
+            try:
+                os.write(self.master, data)
+            except OSError:
+                pass
+
+    def respond(self, data):
+        """Send a response after the simulated latency."""
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        self.write(data)
+
+    def command_loop(self):
+        """Read commands (lines ending CR) from the port and act on them."""
+        buffer = b''
+        while not self.stop_event.is_set():
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            buffer += data
+            while True:
+                end = min((position for position in (
+                    buffer.find(b'\r'), buffer.find(b'\n'))
+                    if position >= 0), default=-1)
+                if end < 0:
+                    break
+                line, buffer = buffer[:end], buffer[end + 1:]
+                if line.strip():
+                    self.command(line.decode('ascii', 'replace').strip())
+
+    def command(self, text):
+        """Act on a command from the service."""
+        self.commands.append(text)
+        self.command_count += 1
+        if self.echo_glitch_rate and \
+                self.rng.random() < self.echo_glitch_rate:
+            self.echo = True
+        echo = (text + '\r\n').encode('ascii') if self.echo else b''
+        words = text.lower().split()
+        if words[0] == 'send':
+            if (self.address is None and len(words) == 1) or \
+                    words[1:] == [self.address]:
+                self.respond(echo + self.frame())
+                self.frames_sent += 1
+        elif words[0] == 'echo':
+            if words[1:] == ['off']:
+                self.echo = False
+            elif words[1:] == ['on']:
+                self.echo = True
+            self.respond(echo + b'ECHO : ' +
+                         (b'ON' if self.echo else b'OFF') + b'\r\n')
+        elif words[0] == 'r':
+            self.running = True
+            self.run_event.set()
+            self.write(echo)
+        elif words[0] == 's':
+            self.running = False
+            self.write(echo)
+        elif words[0] == 'intv' and len(words) >= 2:
+            unit = words[2] if len(words) > 2 else 's'
+            self.run_interval = float(words[1]) * INTERVAL_UNITS.get(unit, 1)
+            self.respond(echo + b'Output intrv. : ' +
+                         words[1].encode() + b' ' + unit.encode() + b'\r\n')
+        elif words[0] == 'form':
+            self.form = self.parse_form(text[len('form'):])
+            self.respond(echo + b'OK\r\n')
+        else:
+            self.respond(echo + b'Unknown command\r\n')
+
+    def run_loop(self):
+        """Output a frame every run interval while in RUN mode."""
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            if not self.running:
+                self.run_event.clear()
+                self.run_event.wait()
+                next_frame = time.monotonic()
+                continue
+            self.write(self.frame())
+            self.frames_sent += 1
+            next_frame += self.run_interval
+            self.stop_event.wait(max(0.0, next_frame - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', choices=sorted(PROFILES),
+                        default='diurnal')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='simulated seconds per real second')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--echo-glitch-rate', type=float, default=0.0)
+    parser.add_argument('--address')
+    parser.add_argument('--replay', help='capture of sensor output to send')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    simulator = HmtSimulator(
+        profile=PROFILES[args.profile](), time_scale=args.time_scale,
+        latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+        echo_glitch_rate=args.echo_glitch_rate, address=args.address,
+        replay=args.replay, seed=args.seed)
+    print('Simulated HMT333 on ' + simulator.port, flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print('Commands: ' + str(simulator.command_count) +
+                  ', frames sent: ' + str(simulator.frames_sent), flush=True)
+    except KeyboardInterrupt:
+        simulator.close()
+
+
+if __name__ == '__main__':
+    main()
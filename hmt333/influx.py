@@ -0,0 +1,169 @@
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def escape(text, characters):
+    """Escape the characters that are special in part of a line protocol
+    line."""
+    for character in '\\' + characters:
+        text = text.replace(character, '\\' + character)
+    return text
+
+
+def format_line(measurement, tags, fields, timestamp_ns):
+    """Format a point as an InfluxDB line protocol line.
+    :param measurement: The measurement name e.g. HMT333-data
+    :param tags: A dictionary of tag names and values.
+    :param fields: A dictionary of field names and (numeric) values. Fields
+    with a value of None are left out.
+    :param timestamp_ns: The time of the point in nanoseconds since the
+    epoch.
+    :return: The line (without a newline)."""
+    key = escape(measurement, ', ') + ''.join(
+        ',' + escape(name, ',= ') + '=' + escape(str(value), ',= ')
+        for name, value in tags.items())
+    field_set = ','.join(
+        escape(name, ',= ') + '=' + repr(float(value))
+        for name, value in fields.items() if value is not None)
+    return key + ' ' + field_set + ' ' + str(timestamp_ns)
+
+
+class InfluxPusher:
+    """Writes observations straight to InfluxDB in batches, as an
+    alternative to Telegraf polling the hmt333 service. Lines are queued as
+    observations are made and written by a background thread every flush
+    interval. If InfluxDB cannot be reached the batch is appended to a spool
+    file on disk, which is sent (oldest first) once InfluxDB is available
+    again."""
+
+    def __init__(self, write_url, spool_path, flush_interval=10.0,
+                 batch_size=500, spool_limit=10_000_000):
+        """:param write_url: InfluxDB write URL including the database and
+        precision, e.g. http://influxdb:8086/write?db=balena&precision=ns
+        :param spool_path: Location of the spool file.
+        :param flush_interval: Time between writes (seconds).
+        :param batch_size: Maximum number of lines per write.
+        :param spool_limit: Maximum size of the spool file (bytes). Lines
+        are dropped rather than spooled once this is reached."""
+        self.write_url = write_url
+        self.spool_path = spool_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.spool_limit = spool_limit
+        self.lines = queue.Queue()
+        # Time to wait before the next write after a failure (seconds)
+        self.retry_delay = flush_interval
+        self.thread = threading.Thread(
+            target=self.run, name='influx-push', daemon=True)
+        self.thread.start()
+
+    def add(self, line):
+        """Queue a line protocol line for writing."""
+        self.lines.put(line)
+
+    def run(self):
+        """Write the queued lines and any spooled lines every flush
+        interval."""
+        while True:
+            time.sleep(self.retry_delay)
+            if self.flush():
+                self.retry_delay = self.flush_interval
+            else:
+                self.retry_delay = min(self.retry_delay * 2, 300)
+
+    def flush(self):
+        """Write any spooled lines and then the queued lines. Lines that
+        can't be written are spooled; lines that were written are never
+        spooled (or left in the spool) so no line is written twice.
+        :return: True if all the lines were written."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.lines.get_nowait())
+            except queue.Empty:
+                break
+        spool_sent = self.send_spool()
+        written = self.send_batches(batch) if spool_sent else 0
+        self.spool(batch[written:])
+        return spool_sent and written == len(batch)
+
+    def send_batches(self, lines):
+        """Write lines to InfluxDB in batches, stopping at the first batch
+        that fails.
+        :return: The number of lines written."""
+        for start in range(0, len(lines), self.batch_size):
+            if not self.write(lines[start:start + self.batch_size]):
+                return start
+        return len(lines)
+
+    def send_spool(self):
+        """Write any spooled lines to InfluxDB and remove the spool file. If
+        only some of them are written the rest are kept in the spool.
+        :return: True if there are no spooled lines left."""
+        if not os.path.isfile(self.spool_path):
+            return True
+        with open(self.spool_path) as spool:
+            lines = spool.read().splitlines()
+        written = self.send_batches(lines)
+        try:
+            if written < len(lines):
+                if written:
+                    self.replace_spool(lines[written:])
+                return False
+            os.remove(self.spool_path)
+        except OSError as error:
+            logging.info('Unable to update spool file: ' + str(error))
+            return False
+        logging.info('Sent ' + str(len(lines)) + ' spooled points to InfluxDB')
+        return True
+
+    def replace_spool(self, lines):
+        """Replace the spool file with the lines still to be written."""
+        temp_path = self.spool_path + '.tmp'
+        with open(temp_path, 'w') as spool:
+            spool.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.spool_path)
+
+    def spool(self, lines):
+        """Append lines that could not be written to the spool file. Lines
+        are dropped if they would take the file over the spool limit."""
+        if not lines:
+            return
+        text = '\n'.join(lines) + '\n'
+        try:
+            size = 0
+            if os.path.isfile(self.spool_path):
+                size = os.path.getsize(self.spool_path)
+            if size + len(text.encode('UTF-8')) > self.spool_limit:
+                logging.info('InfluxDB spool file full - dropping ' +
+                             str(len(lines)) + ' points')
+                return
+            with open(self.spool_path, 'a') as spool:
+                spool.write(text)
+        except OSError as error:
+            logging.info('Unable to spool points: ' + str(error))
+
+    def write(self, lines):
+        """Write a batch of lines to InfluxDB.
+        :return: True if the write succeeded."""
+        if not lines:
+            return True
+        request = urllib.request.Request(
+            self.write_url, data='\n'.join(lines).encode('UTF-8'),
+            method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return 200 <= response.status < 300
+        except urllib.error.HTTPError as error:
+            # A 400 means the points themselves are bad so retrying won't
+            # help; they are dropped.
+            logging.info('InfluxDB write failed: ' + str(error))
+            return error.code == 400
+        except (urllib.error.URLError, OSError) as error:
+            logging.info('InfluxDB write failed: ' + str(error))
+            return False
@@ -0,0 +1,57 @@
+class LineFramer:
+    """Splits a continuous stream of bytes from the sensor (RUN mode) into
+    lines. The stream may start or resume part way through a line and radio
+    dropouts can corrupt or cut short a line, so the framer resynchronises
+    on the next line end whenever it can't be sure it has a whole line:
+    after a resync(), when a line runs on past the maximum length or when a
+    line contains bytes that are not printable ASCII. Such lines are
+    discarded rather than returned."""
+
+    def __init__(self, max_length=64):
+        """:param max_length: Longest line expected from the sensor
+        (bytes)."""
+        self.max_length = max_length
+        self.buffer = bytearray()
+        # False while the data up to the next line end is to be discarded
+        self.synced = False
+        # Number of lines (or line fragments) discarded
+        self.discarded = 0
+
+    def resync(self):
+        """Discard any partial line and everything up to the next line
+        end, e.g. after a gap in the stream."""
+        if self.buffer:
+            self.discarded += 1
+        self.buffer.clear()
+        self.synced = False
+
+    def pause(self):
+        """Called when the stream pauses (no data within the read timeout).
+        A partial line is discarded as the rest of it can't be relied on to
+        follow."""
+        if self.buffer:
+            self.resync()
+
+    def feed(self, data):
+        """Add data received from the sensor.
+        :param data: The bytes received.
+        :return: A list of the complete lines received (bytes, without the
+        line end characters)."""
+        lines = []
+        for byte in data:
+            if byte == 13 or byte == 10:
+                if self.synced and self.buffer:
+                    lines.append(bytes(self.buffer))
+                elif not self.synced:
+                    self.synced = True
+                self.buffer.clear()
+            elif not self.synced:
+                continue
+            elif 32 <= byte < 127 and len(self.buffer) < self.max_length:
+                self.buffer.append(byte)
+            else:
+                # Corrupt or runaway line
+                self.discarded += 1
+                self.buffer.clear()
+                self.synced = False
+        return lines
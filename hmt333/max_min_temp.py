@@ -1,78 +1,109 @@
 import logging
 import os
-import pickle
 import time
 
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.schedulers.background import BackgroundScheduler
+from extremes import ExtremesEngine
+from temp_journal import TempJournal
 
 
 class MaxMinTemp:
-    """Max temp monitor"""
-    def __init__(self):
-        # Set up a record of each temperature received through the day and
-        # night periods (used when determining the latest MAX
-        # and MIN temperatures).
-        self.maxmin_temp_data = dict(max=None, min=None, data_points=None)
-        # Load the list from the file if available and less than 30 mins old
-        if os.path.isfile('/usr/src/app/temps.pkl') and \
-                self.file_age('/usr/src/app/temps.pkl') < 1800:
-            with open('/usr/src/app/temps.pkl', 'rb') as f:
-                self.temps = pickle.load(f)
-                max_temp = max(self.temps)
-                min_temp = min(self.temps)
-                self.maxmin_temp_data.update(dict(
-                    max=max_temp, min=min_temp, data_points=len(self.temps)))
-                logging.info('Previous temperatures list loaded....')
-        else:
-            # Remove any old temps file that didn't pass the file_age check
-            if os.path.isfile('/usr/src/app/temps.pkl'):
-                os.remove('/usr/src/app/temps.pkl')
-            logging.info('Temperatures list will be created in max_temp_calc')
-            self.temps = []
-            self.data_points = 0
+    """Max temp monitor. The latest MAX and MIN temperatures are maintained
+    incrementally by an ExtremesEngine (running 0900-0900 extremes plus a
+    rolling 24 hour max/min) so no scan of the stored readings is needed.
+    Every reading is also appended to a binary journal so that the day's
+    max/min state survives restarts and reboots."""
+    def __init__(self, journal_path=None):
+        self.maxmin_temp_data = dict(max=None, min=None, data_points=None,
+                                     rolling_max=None, rolling_min=None)
+        self.extremes = ExtremesEngine()
+
+        # Save the state of the max/min temperatures across reboots by
+        # journaling each reading to a binary file. This is a solution to
+        # try and keep recording max/min despite reboots due to internet
+        # connection loss (see the internet checking in metoffice_wow.py).
+        if journal_path is None:
+            journal_path = (os.getenv('TEMPS_JOURNAL') or
+                            '/usr/src/app/temps.journal')
+        self.journal = TempJournal(
+            journal_path,
+            fsync_interval=float(os.getenv('TEMPS_JOURNAL_FSYNC') or 60))
+
+        # Remove the temperatures list saved by earlier versions
+        if os.path.isfile('/usr/src/app/temps.pkl'):
+            os.remove('/usr/src/app/temps.pkl')
+
+        self.load_journal()
 
         # Get a scheduler (APScheduler) instance and set up the daily
-        # maximum/minimum temperature reset time.
+        # maximum/minimum temperature reset time. APScheduler is imported
+        # here as importing it takes longer than the rest of the service's
+        # start-up.
+        from apscheduler.triggers.cron import CronTrigger
+        from apscheduler.schedulers.background import BackgroundScheduler
         self.scheduler = BackgroundScheduler()
         self.scheduler.add_job(
             self.reset_max_min_temp,
             CronTrigger(hour=9, minute=1, timezone="UTC"))
         self.scheduler.start()
 
-    def max_temp_calc(self, temperature):
-        """Update the temperature list with the provided reading and
-        return the latest mx/min and number of data points
-        :return: max, min temperature and number of data points in the list."""
-        self.temps.append(temperature)
+    def load_journal(self):
+        """Replay the journaled readings from the last 24 hours into the
+        extremes engine. Only readings made since the last daily reset
+        count towards the current MAX/MIN and number of data points. On
+        initial start-up Max/Min reports will remain disabled (see
+        DATA_POINTS_REQ in metoffice_wow.py) until enough of the day's data
+        has been collected."""
+        start = time.perf_counter()
+        now = time.time()
+        window_start = self.extremes.window_start(now)
+        records = self.journal.load()
+        in_window = False
+        for timestamp, temperature in records:
+            if timestamp <= now - self.extremes.rolling_window:
+                continue
+            if not in_window and timestamp >= window_start:
+                self.extremes.reset_window()
+                in_window = True
+            # Stored as float32 so round back to the sensor resolution
+            self.extremes.update(round(temperature, 1), timestamp)
+        if not in_window:
+            self.extremes.reset_window()
+        self.update_maxmin_temp_data()
+        logging.info('Temperature journal loaded: ' +
+                     str(self.extremes.window_count) + ' data points in ' +
+                     str(round((time.perf_counter() - start) * 1000, 1)) +
+                     ' ms')
 
-        # Save the state of temperatures list across reboots by saving to a
-        # binary file. On initial start-up Max/Min reports should be disabled
-        # until a days worth (0900-0900hrs) of data has been collected as this
-        # file data may be old. This is a solution to try and keep
-        # recording max/min despite reboots due to internet connection loss
-        # See the internet checking in metoffice_wow.py and note the file age
-        # check made before opening the file in the init section of this class.
-        with open('temps.pkl', 'wb+') as f:
-            pickle.dump(self.temps, f)
-            logging.info('Temperatures list saved to binary file temps.pkl')
-        max_temp = max(self.temps)
-        min_temp = min(self.temps)
-        self.maxmin_temp_data.update(dict(
-                    max=max_temp, min=min_temp, data_points=len(self.temps)))
+    def max_temp_calc(self, temperature):
+        """Journal the provided reading and update the latest max/min and
+        number of data points
+        :return: max, min temperature and number of data points since the
+        last reset."""
+        timestamp = time.time()
+        try:
+            self.journal.append(timestamp, temperature)
+        except OSError as error:
+            logging.info('Unable to journal temperature: ' + str(error))
+        self.extremes.update(temperature, timestamp)
+        self.update_maxmin_temp_data()
         return self.maxmin_temp_data
 
-    @staticmethod
-    def file_age(filename):
-        """Determine how long since a file has been last modified"""
-        mod_time = os.path.getmtime(filename)
-        curr_time = time.time()
-        time_diff = curr_time - mod_time
-        return time_diff
+    def update_maxmin_temp_data(self):
+        """Copy the latest extremes from the extremes engine into the
+        max/min data dictionary."""
+        self.maxmin_temp_data.update(dict(
+            max=self.extremes.window_max, min=self.extremes.window_min,
+            data_points=self.extremes.window_count,
+            rolling_max=self.extremes.rolling_max(),
+            rolling_min=self.extremes.rolling_min()))
 
     def reset_max_min_temp(self):
-        """Remove any file containing temperatures and also clear
-        the running list of temperatures"""
-        if os.path.isfile('/usr/src/app/temps.pkl'):
-            os.remove('/usr/src/app/temps.pkl')
-        self.temps.clear()
+        """Start a new max/min period. The journal is compacted so that it
+        only holds the readings needed for the rolling 24 hour window."""
+        self.extremes.reset_window()
+        self.update_maxmin_temp_data()
+        try:
+            self.journal.compact(time.time() - self.extremes.rolling_window)
+        except OSError as error:
+            logging.info('Unable to compact temperature journal: ' +
+                         str(error))
@@ -0,0 +1,62 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SampleBuffer:
+    """Fixed size ring buffer of timestamped samples. Sample times and
+    values are stored in preallocated 'array' buffers so memory use stays
+    constant however long the service runs; once full, the oldest sample is
+    overwritten by each new one. Averages over a time window are computed
+    over the whole buffer at once with NumPy if it is available."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        # Position the next sample will be written to and the number of
+        # samples held.
+        self.index = 0
+        self.count = 0
+        if np is not None:
+            self.times_view = np.frombuffer(self.times, dtype=np.float64)
+            self.values_view = np.frombuffer(self.values, dtype=np.float64)
+
+    def add(self, timestamp, value):
+        """Add a sample, overwriting the oldest if the buffer is full.
+        :param timestamp: Sample time (seconds since the epoch).
+        :param value: Sample value."""
+        self.times[self.index] = timestamp
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def mean(self, start, end=float('inf')):
+        """Average the samples with start <= sample time < end.
+        :param start: Start of the averaging period (seconds since the
+        epoch).
+        :param end: End of the averaging period (seconds since the epoch).
+        :return: The mean value and the number of samples averaged (the
+        mean is None if there are no samples in the period)."""
+        if np is not None:
+            times = self.times_view[:self.count]
+            values = self.values_view[:self.count]
+            selected = values[(times >= start) & (times < end)]
+            number = selected.size
+            if number == 0:
+                return None, 0
+            return float(selected.mean()), number
+
+        total = 0.0
+        number = 0
+        for i in range(self.count):
+            if start <= self.times[i] < end:
+                total += self.values[i]
+                number += 1
+        if number == 0:
+            return None, 0
+        return total / number, number
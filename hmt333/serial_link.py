@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import logging
+import threading
+import warnings
+
+import serial
+
+
+class SerialLink:
+    """A serial port (usually an RF422 radio unit) shared by one or more
+    HMT333 sensors. Sensors on the same port (e.g. RS-485 addressed units
+    on one radio link) take it in turns to make a transaction, i.e. send a
+    command and read the response line."""
+
+    def __init__(self, port, baud, timeout):
+        self.port = port
+        self.baud = baud
+        self.timeout = timeout
+        self.serial_port = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Open the serial port (if not already open)."""
+        with self.lock:
+            if self.serial_port is None:
+                self.serial_port = serial.Serial(
+                    self.port, self.baud, timeout=self.timeout)
+                logging.info('Serial port: ' + str(self.serial_port))
+
+    def write_command(self, command):
+        """Send a command to the sensor(s).
+        :param command: The command text e.g. 'send'."""
+        self.serial_port.write((command + '\r\n').encode())
+
+    def transaction(self, command):
+        """Send a command and read the response line.
+        :param command: The command text e.g. 'send'.
+        :return: The response line, or any partial line received if there is
+        no complete response before the read timeout."""
+        with self.lock:
+            self.write_command(command)
+            return self.serial_port.readline()
+
+    def read_available(self):
+        """Read whatever data has arrived, waiting up to the read timeout
+        for some to arrive (used when the sensor is streaming data).
+        :return: The bytes read (empty if none arrived in time)."""
+        return self.serial_port.read(self.serial_port.in_waiting or 1)
+
+    def discard_input(self):
+        """Discard any data received but not yet read."""
+        with self.lock:
+            self.serial_port.reset_input_buffer()
+
+
+class AsyncSerialLink(SerialLink):
+    """asyncio version of SerialLink. The port is opened without blocking
+    the event loop and is then read through the event loop's file
+    descriptor monitoring. Each transaction has its own deadline and can be
+    cancelled. The port is closed when the last sensor using it stops."""
+
+    def __init__(self, port, baud, timeout):
+        super().__init__(port, baud, timeout)
+        # Number of sensors using the link (see open_async and release)
+        self.users = 0
+        # Incoming data not yet split into lines and the complete lines
+        # received from the sensor(s).
+        self.buffer = bytearray()
+        self.lines = None
+        self.loop = None
+        self.async_lock = None
+
+    async def open_async(self):
+        """Open the serial port in a worker thread (opening the device can
+        block) and start watching it for incoming data. Each sensor that
+        opens the link must release it when it stops."""
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        async with self.async_lock:
+            if self.serial_port is None:
+                self.loop = asyncio.get_running_loop()
+                self.lines = asyncio.Queue()
+                self.serial_port = await self.loop.run_in_executor(
+                    None, functools.partial(
+                        serial.Serial, self.port, self.baud,
+                        timeout=0, write_timeout=0))
+                logging.info('Serial port (async): ' + str(self.serial_port))
+                self.loop.add_reader(
+                    self.serial_port.fileno(), self.data_received)
+            self.users += 1
+
+    def data_received(self):
+        """Called by the event loop when the serial port has data to read.
+        The data is split into lines which are queued for transactions."""
+        try:
+            data = self.serial_port.read(self.serial_port.in_waiting or 1)
+        except serial.SerialException as error:
+            warnings.warn("Serial port error: " + str(error), Warning)
+            self.loop.remove_reader(self.serial_port.fileno())
+            return
+        self.buffer.extend(data)
+        while True:
+            end = self.buffer.find(b'\n')
+            if end < 0:
+                break
+            self.lines.put_nowait(bytes(self.buffer[:end + 1]))
+            del self.buffer[:end + 1]
+
+    async def transaction_async(self, command, timeout):
+        """Send a command and wait for the next line of response.
+        :param command: The command text e.g. 'send'.
+        :param timeout: Deadline for the response in seconds.
+        :return: The response line, or any partial line received if there
+        is no complete response by the deadline."""
+        async with self.async_lock:
+            # Discard any late response to an earlier transaction
+            while not self.lines.empty():
+                self.lines.get_nowait()
+            self.write_command(command)
+            try:
+                return await asyncio.wait_for(self.lines.get(), timeout)
+            except asyncio.TimeoutError:
+                partial = bytes(self.buffer)
+                self.buffer.clear()
+                return partial
+
+    def release(self):
+        """Stop using the link, closing the serial port if no other sensor
+        is using it."""
+        self.users -= 1
+        if self.users <= 0:
+            self.users = 0
+            self.close()
+
+    def close(self):
+        if self.serial_port is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.serial_port.fileno())
+            self.serial_port.close()
+            self.serial_port = None
+
+
+# Serial links by port name, so sensors on the same port share one link
+links = {}
+links_lock = threading.Lock()
+
+
+def get_link(port, baud, timeout, link_class=SerialLink):
+    """Get the link for a serial port, creating it if this is the first
+    sensor on the port.
+    :return: A SerialLink (or link_class) instance for the port."""
+    with links_lock:
+        if port not in links:
+            links[port] = link_class(port, baud, timeout)
+        return links[port]
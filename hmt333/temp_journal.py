@@ -0,0 +1,202 @@
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Each record is a timestamp (seconds since the epoch, float64) followed by
+# a temperature (degrees C, float32) - 12 bytes per reading.
+TEMP_RECORD = struct.Struct('<df')
+
+JOURNAL_MAGIC = b'HMTJ'
+
+
+class TempJournal:
+    """Append-only binary journal of fixed size records. Each reading is
+    added with a single small write rather than rewriting all the readings
+    received so far, which keeps SD card wear to a minimum. On start-up the
+    journal is memory mapped and decoded in one pass. A partly written
+    record at the end of the file (e.g. after a power cut part way through
+    a write) is discarded. The journal is compacted periodically by copying
+    only the records that are still required to a temporary file that then
+    replaces the journal."""
+
+    def __init__(self, path, record=TEMP_RECORD, fsync_interval=60.0):
+        self.path = path
+        self.record = record
+        self.header = JOURNAL_MAGIC + struct.pack('<I', record.size)
+        # Minimum time in seconds between forced flushes to the SD card.
+        # Records written in between are left to the OS page cache.
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.monotonic()
+        self.fd = None
+        # Appends and compaction may be made from different threads
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Open the journal for appending, creating it if required. A file
+        with an unrecognised header is replaced with an empty journal."""
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND,
+                          0o644)
+        header = os.pread(self.fd, len(self.header), 0)
+        if header != self.header:
+            if header:
+                logging.info('Unrecognised journal ' + self.path +
+                             ' - starting a new journal')
+            os.ftruncate(self.fd, 0)
+            os.write(self.fd, self.header)
+
+    def load(self):
+        """Read all the complete records from the journal. Any trailing
+        partial record is truncated from the file.
+        :return: A list of record tuples in the order they were written."""
+        if self.fd is None:
+            self.open()
+        size = os.fstat(self.fd).st_size
+        body = size - len(self.header)
+        whole = body - body % self.record.size
+        if whole != body:
+            logging.info('Discarding ' + str(body - whole) +
+                         ' bytes of partial record from ' + self.path)
+            os.ftruncate(self.fd, len(self.header) + whole)
+        if whole == 0:
+            return []
+        with mmap.mmap(self.fd, len(self.header) + whole,
+                       access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                records = list(self.record.iter_unpack(
+                    view[len(self.header):]))
+            finally:
+                view.release()
+        return records
+
+    def load_since(self, timestamp, limit=None):
+        """Read the records with a timestamp (the first record field) after
+        the given time. Records are assumed to be in time order so the first
+        record is found with a binary search of the memory mapped journal
+        rather than decoding the whole file.
+        :param timestamp: Time after which records are wanted (seconds since
+        the epoch).
+        :param limit: Maximum number of records to return (optional).
+        :return: A list of record tuples in time order."""
+        with self.lock:
+            if self.fd is None:
+                self.open()
+            return self.search(timestamp, limit)
+
+    def search(self, timestamp, limit):
+        """Binary search for the records after the given time (see
+        load_since, called with the journal lock held)."""
+        size = os.fstat(self.fd).st_size
+        number = (size - len(self.header)) // self.record.size
+        if number == 0:
+            return []
+        with mmap.mmap(self.fd, len(self.header) + number * self.record.size,
+                       access=mmap.ACCESS_READ) as mapped:
+            low = self.find(mapped, number, timestamp)
+            if limit is not None:
+                number = min(number, low + limit)
+            view = memoryview(mapped)
+            try:
+                records = list(self.record.iter_unpack(view[
+                    len(self.header) + low * self.record.size:
+                    len(self.header) + number * self.record.size]))
+            finally:
+                view.release()
+        return records
+
+    def find(self, mapped, number, timestamp):
+        """Binary search of the memory mapped journal.
+        :param mapped: The memory mapped journal.
+        :param number: The number of records in the journal.
+        :param timestamp: Time after which records are wanted (seconds since
+        the epoch).
+        :return: The index of the first record with a later timestamp (the
+        number of records if there are none)."""
+        time_field = struct.Struct(self.record.format[:2])
+        low, high = 0, number
+        while low < high:
+            middle = (low + high) // 2
+            offset = len(self.header) + middle * self.record.size
+            if time_field.unpack_from(mapped, offset)[0] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def last(self):
+        """:return: The last complete record in the journal, or None if the
+        journal is empty."""
+        with self.lock:
+            if self.fd is None:
+                self.open()
+            size = os.fstat(self.fd).st_size
+            number = (size - len(self.header)) // self.record.size
+            if number == 0:
+                return None
+            return self.record.unpack(os.pread(
+                self.fd, self.record.size,
+                len(self.header) + (number - 1) * self.record.size))
+
+    def append(self, *values):
+        """Append a single record to the journal.
+        :param values: The record field values e.g. timestamp, temperature."""
+        with self.lock:
+            if self.fd is None:
+                self.open()
+            os.write(self.fd, self.record.pack(*values))
+            now = time.monotonic()
+            if now - self.last_fsync >= self.fsync_interval:
+                os.fsync(self.fd)
+                self.last_fsync = now
+
+    def compact(self, keep_since):
+        """Rewrite the journal keeping only records with a timestamp (the
+        first record field) at or after keep_since. Records are assumed to be
+        in time order (as for load_since), so the first record kept is found
+        with a binary search and the rest of the journal is copied as it is,
+        without decoding the records. Any trailing partial record is left
+        out. The new journal is written to a temporary file, flushed and
+        renamed over the old one so that the journal is never left in a
+        partly written state.
+        :param keep_since: Oldest timestamp to keep (seconds since the
+        epoch).
+        :return: The number of records kept."""
+        with self.lock:
+            if self.fd is None:
+                self.open()
+            size = os.fstat(self.fd).st_size
+            number = (size - len(self.header)) // self.record.size
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(self.header)
+                first = number
+                if number:
+                    with mmap.mmap(
+                            self.fd,
+                            len(self.header) + number * self.record.size,
+                            access=mmap.ACCESS_READ) as mapped:
+                        first = self.find(mapped, number, math.nextafter(
+                            keep_since, -math.inf))
+                        view = memoryview(mapped)
+                        try:
+                            f.write(view[len(self.header) +
+                                         first * self.record.size:])
+                        finally:
+                            view.release()
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.close()
+            self.open()
+        logging.info('Journal ' + self.path + ' compacted to ' +
+                     str(number - first) + ' records')
+        return number - first
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
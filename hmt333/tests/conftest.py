@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The service modules are run from their own directory in the container
+# (WORKDIR /usr/src/app) and import each other by module name.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
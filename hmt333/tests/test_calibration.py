@@ -0,0 +1,41 @@
+import pytest
+
+from calibration import CalibrationTable
+
+COEFFICIENTS = [0.11, -0.2, 0.3, -0.4, 0.5, -0.6, 0.7, -0.8, 0.9]
+
+
+def ladder(temp):
+    """The nearest certificate point correction, as originally applied."""
+    for threshold, index in ((45, 8), (35, 7), (25, 6), (15, 5), (5, 4),
+                             (-5, 3), (-15, 2), (-25, 1)):
+        if temp >= threshold:
+            return temp + COEFFICIENTS[index]
+    return temp + COEFFICIENTS[0]
+
+
+class TestCalibrationTable:
+    def test_step_matches_nearest_point(self):
+        table = CalibrationTable(COEFFICIENTS)
+        temps = [round(i * 0.1, 1) for i in range(-700, 700)]
+        assert [table.apply(t) for t in temps] == [ladder(t) for t in temps]
+
+    def test_linear_interpolation(self):
+        table = CalibrationTable(COEFFICIENTS, 'linear')
+        assert table.apply(-30.0) == pytest.approx(-29.89)
+        assert table.apply(5.0) == pytest.approx(5.05)
+        assert table.apply(-25.0) == pytest.approx(-25.045)
+        assert table.apply(55.0) == pytest.approx(55.9)
+        assert table.apply(-40.0) == pytest.approx(-39.89)
+
+    def test_batch_matches_single(self):
+        for mode in ('step', 'linear'):
+            table = CalibrationTable(COEFFICIENTS, mode)
+            temps = [i * 0.037 for i in range(-2000, 2000)]
+            batch = table.apply_batch(temps)
+            assert list(batch) == pytest.approx([table.apply(t)
+                                                 for t in temps])
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            CalibrationTable(COEFFICIENTS, 'cubic')
@@ -0,0 +1,93 @@
+import configparser
+import os
+
+from config_handler import ConfigHandler, write_config
+
+CONFIG = """[CALIBRATION]
+serial_no = E123456
+calibration_date = 2000/01/01
+corr_m30 = 0.0
+corr_m20 = 0.0
+corr_m10 = 0.0
+corr_0 = 0.0
+corr_10 = 0.0
+corr_20 = {corr_20}
+corr_30 = 0.0
+corr_40 = 0.0
+corr_50 = 0.0
+"""
+
+
+class TestConfigHandler:
+    def test_default_config_created(self, tmp_path):
+        config = ConfigHandler(str(tmp_path / 'config.ini'))
+        assert config.apply_calibration(20.0) == 20.0
+        assert os.path.isfile(tmp_path / 'config.ini')
+
+    def test_empty_check_interval(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('CONFIG_CHECK_INTERVAL', '')
+        config = ConfigHandler(str(tmp_path / 'config.ini'))
+        assert config.check_interval == 5
+
+    def test_reload_only_on_change(self, tmp_path):
+        path = tmp_path / 'config.ini'
+        path.write_text(CONFIG.format(corr_20='0.2'))
+        config = ConfigHandler(str(path))
+        config.check_interval = 0
+        assert config.apply_calibration(20.0) == 20.2
+        stamp = config.config_stamp
+        config.apply_calibration(20.0)
+        assert config.config_stamp is stamp
+
+        path.write_text(CONFIG.format(corr_20='-0.15'))
+        os.utime(path, ns=(1, 1))
+        assert config.apply_calibration(20.0) == 19.85
+
+    def test_invalid_file_keeps_last_good(self, tmp_path):
+        path = tmp_path / 'config.ini'
+        path.write_text(CONFIG.format(corr_20='0.2'))
+        config = ConfigHandler(str(path))
+        config.check_interval = 0
+        assert config.apply_calibration(20.0) == 20.2
+
+        path.write_text(CONFIG.format(corr_20='bad')[:60])
+        assert config.apply_calibration(20.0) == 20.2
+        path.write_text(CONFIG.format(corr_20='bad'))
+        assert config.apply_calibration(20.0) == 20.2
+        assert path.read_text() == CONFIG.format(corr_20='bad')
+
+    def test_apply_calibration_batch(self, tmp_path):
+        path = tmp_path / 'config.ini'
+        path.write_text(CONFIG.format(corr_20='0.2'))
+        config = ConfigHandler(str(path))
+        assert list(config.apply_calibration_batch([20.0, 14.9, 25.0])) == [
+            20.2, 14.9, 25.0]
+
+    def test_default_config_not_overwritten(self, tmp_path):
+        path = tmp_path / 'config.ini'
+        path.write_text(CONFIG.format(corr_20='0.2'))
+        ConfigHandler.create_config(str(path))
+        assert path.read_text() == CONFIG.format(corr_20='0.2')
+        assert os.listdir(tmp_path) == ['config.ini']
+
+    def test_version_loaded(self, tmp_path):
+        path = tmp_path / 'config.ini'
+        config_object = configparser.ConfigParser()
+        config_object.read_string(CONFIG.format(corr_20='0.2'))
+        config_object['META'] = {'version': '7'}
+        assert write_config(config_object, str(path))
+        inode = os.stat(path).st_ino
+        config = ConfigHandler(str(path))
+        config.check_interval = 0
+        config.set_calibration_coefficients()
+        assert config.version == 7
+        assert config.apply_calibration(20.0) == 20.2
+
+        # Each save replaces the file (so gets a new inode)
+        config_object['META'] = {'version': '8'}
+        config_object['CALIBRATION']['corr_20'] = '0.3'
+        write_config(config_object, str(path))
+        assert os.stat(path).st_ino != inode
+        assert config.apply_calibration(20.0) == 20.3
+        assert config.version == 8
+        assert os.listdir(tmp_path) == ['config.ini']
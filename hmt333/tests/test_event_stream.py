@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+from event_stream import EventStream
+
+
+def event_ids(messages):
+    return [message.split(b'\n')[0][len(b'id: '):].decode()
+            for message in messages]
+
+
+class TestEventStream:
+    def test_publish(self):
+        events = EventStream()
+        events.publish('observation', {'temperature': 12.3}, key='HMT333')
+        messages, number = events.subscribe()
+        assert number == 1
+        assert messages == [('id: ' + events.prefix + '1\nevent: '
+                             'observation\ndata: {"temperature": 12.3}'
+                             '\n\n').encode()]
+
+    def test_new_subscriber_gets_latest_by_key(self):
+        events = EventStream()
+        for number in range(3):
+            events.publish('observation', number, key='screen1')
+        events.publish('observation', 9, key='screen2')
+        events.publish('qc', 'empty')
+        messages, number = events.subscribe()
+        assert number == 5
+        assert event_ids(messages) == [events.prefix + '3',
+                                       events.prefix + '4']
+
+    def test_resume(self):
+        events = EventStream(capacity=5)
+        for number in range(8):
+            events.publish('observation', number)
+        messages, number = events.subscribe(events.prefix + '6')
+        assert event_ids(messages) == [events.prefix + '7',
+                                       events.prefix + '8']
+        assert number == 8
+        # Events no longer kept are skipped
+        messages, _ = events.subscribe(events.prefix + '1')
+        assert len(messages) == 5
+        # An id from before a restart gets all the events kept
+        messages, _ = events.subscribe('1-7')
+        assert event_ids(messages)[0] == events.prefix + '4'
+
+    def test_wait(self):
+        events = EventStream()
+        assert events.wait(0, 0.01) == ([], 0)
+        timer = threading.Timer(0.05, events.publish, ('qc', 'error'))
+        timer.start()
+        messages, number = events.wait(0, 5)
+        assert number == 1 and len(messages) == 1
+
+    def test_wait_async(self):
+        events = EventStream()
+
+        async def subscriber():
+            return await events.wait_async(0, 5)
+
+        async def run():
+            tasks = [asyncio.create_task(subscriber()) for _ in range(100)]
+            await asyncio.sleep(0.01)
+            # Published from another thread (e.g. the acquisition thread)
+            threading.Thread(target=events.publish,
+                             args=('observation', 1)).start()
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(run())
+        assert all(number == 1 and len(messages) == 1
+                   for messages, number in results)
+        assert not events.waiters
@@ -0,0 +1,37 @@
+from extremes import ExtremesEngine
+
+
+class TestExtremesEngine:
+    def test_window_extremes(self):
+        engine = ExtremesEngine()
+        for temp in [12.1, 15.3, 9.8, 11.0]:
+            engine.update(temp, 1000.0)
+        assert engine.window_max == 15.3
+        assert engine.window_min == 9.8
+        assert engine.window_count == 4
+
+    def test_reset_window_keeps_rolling(self):
+        engine = ExtremesEngine()
+        engine.update(20.0, 1000.0)
+        engine.update(5.0, 1001.0)
+        engine.reset_window()
+        assert engine.window_max is None and engine.window_count == 0
+        assert engine.rolling_max(1002.0) == 20.0
+        assert engine.rolling_min(1002.0) == 5.0
+
+    def test_rolling_window_expiry(self):
+        engine = ExtremesEngine(rolling_window=60)
+        engine.update(30.0, 0.0)
+        engine.update(10.0, 30.0)
+        engine.update(20.0, 59.0)
+        assert engine.rolling_max(59.0) == 30.0
+        assert engine.rolling_max(61.0) == 20.0
+        assert engine.rolling_min(61.0) == 10.0
+        assert engine.rolling_min(95.0) == 20.0
+        assert engine.rolling_max(200.0) is None
+
+    def test_window_start(self):
+        # 2023-03-26 08:00 UTC belongs to the day that started at 09:01 on
+        # the 25th, 10:00 UTC to the day that started at 09:01 on the 26th.
+        assert ExtremesEngine.window_start(1679817600) == 1679734860
+        assert ExtremesEngine.window_start(1679824800) == 1679821260
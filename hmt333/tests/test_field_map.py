@@ -0,0 +1,20 @@
+import pytest
+
+from field_map import FieldMap
+
+
+def test_extract_with_qc():
+    field_map = FieldMap('RH=humidity, Td=dew_point')
+    assert field_map.extract({'T': 12.3, 'RH': 45.6, 'Td': 1.2}) == {
+        'humidity': 45.6, 'dew_point': 1.2}
+    # A bad or missing quantity is dropped on its own
+    with pytest.warns(Warning):
+        assert field_map.extract({'T': 12.3, 'RH': 145.6}) == {
+            'humidity': None, 'dew_point': None}
+
+
+def test_invalid_mappings_ignored():
+    with pytest.warns(Warning):
+        field_map = FieldMap('T=air_temp,RH=max_temp_calc,Td,x=mixing_ratio')
+    assert field_map.fields == {'x': 'mixing_ratio'}
+    assert FieldMap().fields == {}
@@ -0,0 +1,48 @@
+from frame_decoder import decode_frame, COMMAND_ECHO, DATA, EMPTY, ERROR, \
+    INVALID, REPLY
+
+
+def test_data_frames():
+    assert decode_frame(b"T=  12.3 'C\r\n") == (DATA, {'T': 12.3})
+    assert decode_frame(b"T=-5.0'C") == (DATA, {'T': -5.0})
+    assert decode_frame(memoryview(b"T= 1.25 'C")) == (DATA, {'T': 1.25})
+    assert decode_frame(b"T= 12.3 'C RH= 45.6 %RH Td=  1.2 'C\r\n") == (
+        DATA, {'T': 12.3, 'RH': 45.6, 'Td': 1.2})
+
+
+def test_other_frames():
+    assert decode_frame(b'send\r\n') == (COMMAND_ECHO, None)
+    assert decode_frame(b'ECHO : OFF\r\n') == (REPLY, None)
+    assert decode_frame(b'Output intrv. : 10 s\r\n') == (REPLY, None)
+    assert decode_frame(b'Unknown command\r\n') == (ERROR, None)
+    assert decode_frame(b'\r\n') == (EMPTY, None)
+    assert decode_frame(b'') == (EMPTY, None)
+
+
+def test_corrupted_frames():
+    # Truncated, noise and flipped bits. The old check for "T=", "C" and
+    # "." only really checked for ".", so accepted some of these.
+    for frame in (b"2.3 'C\r\n", b"T= 1\xff2.3 'C\r\n", b'T=', b"T= 12.3 'Cx",
+                  b"T= 12.3 'C 4", b"T< 12.3 'C"):
+        assert decode_frame(frame) == (INVALID, None)
+
+
+def test_truncated_frames():
+    # A read that times out returns the partial line
+    for frame in (b'T=  1', b'T=  12', b"T= 12.3 '", b'T= -', b'T= 12.3\r\n'):
+        assert decode_frame(frame) == (INVALID, None)
+
+
+def test_run_together_frames():
+    # A partial line followed by the next reading isn't one frame of data
+    for frame in (b"T= 12.3 'C\r\nT= 1", b"T= 1\r\nT= 12.3 'C\r\n",
+                  b"T= 12.3 'C\nT= 12.4 'C\n"):
+        assert decode_frame(frame) == (INVALID, None)
+
+
+def test_truncated_multi_field_frames():
+    # Cut off part way through a later field, e.g. RH= 4 (within the RH
+    # limits) for RH= 45.6 %RH
+    for frame in (b"T= 12.3 'C RH= 4", b"T= 12.3 'C RH= 45.6",
+                  b"T= 12.3 'C RH= 45.6 %RH Td=  1.", b"T= 12.3 'C RH="):
+        assert decode_frame(frame) == (INVALID, None)
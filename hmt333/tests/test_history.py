@@ -0,0 +1,23 @@
+from history import ObservationHistory
+
+
+class TestObservationHistory:
+    def test_since_from_memory(self, tmp_path):
+        history = ObservationHistory(str(tmp_path / 'history.journal'))
+        for i in range(10):
+            history.add(1000.0 + i, 10.0 + i, None, 5.0)
+        assert history.since(1006.0, 100) == [
+            [1007.0, 17.0, None, 5.0], [1008.0, 18.0, None, 5.0],
+            [1009.0, 19.0, None, 5.0]]
+        assert [r[0] for r in history.since(1002.5, 2)] == [1003.0, 1004.0]
+
+    def test_since_from_disk(self, tmp_path):
+        history = ObservationHistory(str(tmp_path / 'history.journal'),
+                                     memory_span=3)
+        for i in range(10):
+            history.add(1000.0 + i, 10.0 + i, 20.0, 5.0)
+        assert len(history.recent) == 4
+        assert [r[0] for r in history.since(0, 3)] == [1000.0, 1001.0,
+                                                       1002.0]
+        assert [r[0] for r in history.since(1004.0, 3)] == [1005.0, 1006.0,
+                                                            1007.0]
@@ -1,21 +1,210 @@
+import time
+
+import pytest
+
+import hmt_ascii
+from hmt_ascii import HmtAscii
+from hmt_simulator import HmtSimulator, constant
+
+
+def wait_for(condition, timeout=10.0):
+    """Wait for a condition to become true (or fail the test)."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def simulator():
+    simulator = HmtSimulator(profile=constant(12.3), seed=1)
+    yield simulator
+    simulator.close()
+
+
+@pytest.fixture
+def make_sensor(tmp_path, monkeypatch):
+    """Make an HmtAscii polling a simulated sensor every second."""
+    sensors = []
+    monkeypatch.delenv('SAMPLE_INTERVAL', raising=False)
+
+    def make(simulator, start=True, **settings):
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        sensor = HmtAscii(
+            serial_port=simulator.port, serial_baud=9600, poll_interval=1,
+            config_location=str(tmp_path / 'config.ini'),
+            journal_path=str(tmp_path / 'temps.journal'),
+            history_path=str(tmp_path / 'history.journal'), start=start)
+        sensors.append(sensor)
+        return sensor
+    yield make
+    for sensor in sensors:
+        sensor.stop()
+        if sensor.acquisition_thread is not None:
+            sensor.acquisition_thread.join(5)
+
+
 class TestHmtAscii:
-    def test_get_hmt_data(self):
-        assert False
+    def test_get_hmt_data(self, simulator, make_sensor):
+        sensor = make_sensor(simulator)
+        wait_for(lambda: sensor.sequence >= 2)
+        assert sensor.temperature == 12.3
+        assert 'echo off' in simulator.commands
+
+    def test_observers_see_first_observation(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, start=False)
+        assert sensor.acquisition_thread is None
+        observed = []
+        sensor.observers.append(
+            lambda sensor, data: observed.append(data['sequence']))
+        sensor.setup()
+        wait_for(lambda: sensor.sequence >= 1)
+        assert observed[0] == 1
+
+    def test_qc_observers(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, start=False)
+        observed = []
+        sensor.qc_observers.append(
+            lambda sensor, kind, line: observed.append((kind, line)))
+        sensor.handle_response(b"T= 99.9 'C\r\n")
+        sensor.handle_response(b'Echo : OFF\r\n')
+        sensor.handle_response(b'')
+        assert observed == [('qc_rejected', b"T= 99.9 'C\r\n"),
+                            ('empty', b'')]
+
+    def test_schedule_next_poll(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, start=False)
+        # Deadlines are multiples of the interval from the start, however
+        # long each cycle takes
+        next_poll = 100.0
+        for number, duration in enumerate((0.3, 0.05, 0.9, 0.0), 1):
+            cycle_start = next_poll + 0.01
+            next_poll = sensor.schedule_next_poll(
+                next_poll, cycle_start, cycle_start + duration)
+            assert next_poll == 100.0 + number
+            assert sensor.cycle_time == pytest.approx(duration)
+        assert sensor.missed_slots == 0
+
+    def test_schedule_skips_missed_slots(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, start=False)
+        assert sensor.schedule_next_poll(100.0, 100.0, 102.5) == 103.0
+        assert sensor.missed_slots == 2
+        assert sensor.schedule_next_poll(103.0, 103.0, 104.0) == 104.0
+        assert sensor.missed_slots == 2
+        assert sensor.schedule_next_poll(104.0, 104.0, 105.2) == 106.0
+        assert sensor.missed_slots == 3
+
+    def test_error_in_cycle_doesnt_stop_polling(self, simulator,
+                                                make_sensor):
+        sensor = make_sensor(simulator, start=False)
+
+        def failing_observer(sensor, data):
+            if data['sequence'] == 1:
+                raise RuntimeError('observer failed')
+        sensor.observers.append(failing_observer)
+        sensor.setup()
+        wait_for(lambda: sensor.sequence >= 2)
+        assert sensor.acquisition_thread.is_alive()
+
+    def test_echo_glitch_recovery(self, simulator, make_sensor):
+        sensor = make_sensor(simulator)
+        wait_for(lambda: sensor.sequence >= 1)
+        # The sensor turns its echo back on (e.g. after a power cut)
+        simulator.echo = True
+        wait_for(lambda: not simulator.echo)
+        sequence = sensor.sequence
+        wait_for(lambda: sensor.sequence > sequence)
+        assert sensor.temperature == 12.3
+
+    def test_truncated_multi_field_frame(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, start=False,
+                             FRAME_FIELDS='RH=humidity')
+        observed = []
+        sensor.qc_observers.append(
+            lambda sensor, kind, line: observed.append(kind))
+        assert not sensor.handle_response(b"T= 12.3 'C RH= 4")
+        assert observed == ['invalid']
+        assert sensor.sequence == 0
+        assert sensor.handle_response(b"T= 12.3 'C RH= 45.6 %RH\r\n")
+        assert sensor.latest_data()['quantities'] == {'humidity': 45.6}
+
+    def test_sample_mode_publishes_once_a_minute(self, simulator,
+                                                 make_sensor, monkeypatch):
+        sensor = make_sensor(simulator, start=False, SAMPLE_INTERVAL='2')
+        observed = []
+        sensor.observers.append(
+            lambda sensor, data: observed.append(data['temperature']))
+        now = [6000.0]
+        monkeypatch.setattr(hmt_ascii.time, 'time', lambda: now[0])
+        for temperature in (b'12.0', b'12.2', b'12.4', b'12.6'):
+            assert sensor.handle_response(b'T= ' + temperature + b" 'C\r\n")
+            now[0] += 15
+        # The first sample is published, the rest are only kept in memory
+        assert observed == [12.0]
+        assert sensor.sequence == 1
+        assert sensor.samples.mean(6000)[1] == 4
+        assert sensor.handle_response(b"T= 12.8 'C\r\n")
+        assert observed == [12.0, 12.4]
+        assert sensor.max_temp == 12.3
+
+    def test_stream_mode(self, simulator, make_sensor):
+        sensor = make_sensor(simulator, STREAM_MODE='true')
+        wait_for(lambda: sensor.sequence >= 2)
+        assert simulator.running
+        assert 'intv 1 s' in simulator.commands
+        assert sensor.temperature == 12.3
 
     def test_data_decoder(self):
-        assert False
+        assert HmtAscii.data_decoder(b"T=  21.34 'C\r\n") == 21.3
+        assert HmtAscii.data_decoder(b"T= -1.0 'C RH= 45.6 %RH") == -1.0
+        assert HmtAscii.data_decoder(b"2.3 'C") is None
+        assert HmtAscii.data_decoder(b'') is None
 
-    def test_process_hmt_data(self):
-        assert False
+    def test_process_hmt_data(self, simulator, make_sensor):
+        sensor = make_sensor(simulator)
+        sensor.stop()
+        data = sensor.process_hmt_data(15.0)
+        assert data['temperature'] == 15.0
+        assert data['max_temp'] >= 15.0
+        assert data['min_temp'] <= 15.0
+        assert data['data_points'] >= 1
 
-    def test_latest_data(self):
-        assert False
+    def test_latest_data(self, simulator, make_sensor):
+        sensor = make_sensor(simulator)
+        wait_for(lambda: sensor.sequence >= 1)
+        data = sensor.latest_data()
+        assert data['temperature'] == 12.3
+        assert data['max_temp'] == 12.3
+        assert data['min_temp'] == 12.3
+        assert data['sequence'] >= 1
+        assert data['obs_time'] is not None
 
     def test_find_numeric_data(self):
-        assert False
+        assert HmtAscii.find_numeric_data("T=  -12.3 'C") == ['-12.3']
+        assert HmtAscii.find_numeric_data('1 2.5 +3e2') == [
+            '1', '2.5', '+3e2']
+        assert HmtAscii.find_numeric_data('none') == []
 
     def test_temperature_check(self):
-        assert False
+        assert HmtAscii.temperature_check(12.3)
+        assert HmtAscii.temperature_check(-59.9)
+        assert not HmtAscii.temperature_check(60.0)
+        assert not HmtAscii.temperature_check(-75.0)
 
     def test_temp_consistency_check(self):
-        assert False
+        assert HmtAscii.temp_consistency_check(None, 12.3, 7)
+        assert HmtAscii.temp_consistency_check(12.3, 15.0, 7)
+        assert HmtAscii.temp_consistency_check(15.0, 12.3, 7)
+        with pytest.warns(Warning):
+            assert not HmtAscii.temp_consistency_check(12.3, 20.0, 7)
+
+    def test_frame_metrics(self, simulator, make_sensor):
+        sensor = make_sensor(simulator)
+        sensor.stop()
+        frames = hmt_ascii.FRAMES.values
+        before = frames.get((sensor.sensor_id, 'qc_rejected'), 0)
+        assert not sensor.handle_response(b"T=  75.0 'C\r\n")
+        assert frames[(sensor.sensor_id, 'qc_rejected')] == before + 1
+        sensor.handle_response(b'send\r\n')
+        assert frames[(sensor.sensor_id, 'command_echo')] >= 1
@@ -0,0 +1,58 @@
+import asyncio
+import contextlib
+
+from hmt_async import AsyncHmtAscii
+from hmt_simulator import HmtSimulator, constant
+
+
+async def wait_for(condition, timeout=10.0):
+    """Wait for a condition to become true (or fail the test)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'timed out'
+        await asyncio.sleep(0.05)
+
+
+def test_shared_port_stays_open(tmp_path, monkeypatch):
+    monkeypatch.delenv('SAMPLE_INTERVAL', raising=False)
+    simulator = HmtSimulator(profile=constant(12.3), address='1')
+
+    def make(sensor_id, address):
+        return AsyncHmtAscii(
+            serial_port=simulator.port, serial_baud=9600, poll_interval=1,
+            config_location=str(tmp_path / 'config.ini'),
+            sensor_id=sensor_id, address=address,
+            journal_path=str(tmp_path / (sensor_id + '.journal')),
+            history_path=str(tmp_path / (sensor_id + '-history.journal')),
+            start=False)
+
+    async def run():
+        screen1, screen2 = make('screen1', '1'), make('screen2', '2')
+        task1 = asyncio.create_task(screen1.run())
+        task2 = asyncio.create_task(screen2.run())
+        await wait_for(lambda: screen1.sequence >= 1)
+        link = screen1.link
+        assert link is screen2.link
+        assert link.users == 2
+
+        # Stopping one sensor leaves the port open for the other
+        task2.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task2
+        assert link.users == 1
+        assert link.serial_port is not None
+        sequence = screen1.sequence
+        await wait_for(lambda: screen1.sequence > sequence)
+
+        # The port is closed when the last sensor stops
+        task1.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task1
+        assert link.users == 0
+        assert link.serial_port is None
+
+    try:
+        asyncio.run(run())
+    finally:
+        simulator.close()
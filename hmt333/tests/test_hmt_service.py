@@ -0,0 +1,467 @@
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+# Stop hmt_service starting its server when imported
+os.environ.setdefault('HMT333_ENABLE', 'false')
+import hmt_service  # noqa: E402
+import serial_link  # noqa: E402
+from hmt_simulator import HmtSimulator, constant  # noqa: E402
+
+# The request handlers use the module's service instance, which replaces the
+# class when the service is run
+HMTservice = hmt_service.HMTservice
+
+
+def wait_for(condition, timeout=10.0):
+    """Wait for a condition to become true (or fail the test)."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def make_service(tmp_path, monkeypatch):
+    """Make an HMTservice (without its sensors set up) reading from the
+    given serial port."""
+    services = []
+
+    def make(port, **settings):
+        monkeypatch.setenv('HMT333_PORT', port)
+        monkeypatch.setenv('DATA_POLL_INTERVAL', '1')
+        monkeypatch.setenv('TEMPS_JOURNAL', str(tmp_path / 'temps.journal'))
+        monkeypatch.setenv('HISTORY_PATH', str(tmp_path / 'history.journal'))
+        monkeypatch.setenv('SERIES_PATH', str(tmp_path / 'series'))
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        service = HMTservice()
+        service.config_location = str(tmp_path / 'config.ini')
+        services.append(service)
+        return service
+    yield make
+    for service in services:
+        for sensor in service.sensors.values():
+            sensor.stop()
+
+
+CORRECTIONS = ('corr_M30', 'corr_M20', 'corr_M10', 'corr_0', 'corr_10',
+               'corr_20', 'corr_30', 'corr_40', 'corr_50')
+
+
+def health(service):
+    status, _, body = service.get_response('/health')
+    return status, json.loads(body)
+
+
+class TestHMTservice:
+    def test_starting(self, make_service):
+        service = make_service('/dev/null')
+        status, state = health(service)
+        assert status == 503
+        assert state['status'] == 'starting'
+        assert 'first_reading' not in state['startup']
+        # Readings are served empty until the sensors are set up
+        status, _, body = service.get_response('/')
+        assert status == 200
+        assert json.loads(body) == hmt_service.EMPTY_FIELDS
+        assert service.get_response('/sensors')[2] == b'{}'
+        assert service.get_response('/history')[0] == 503
+
+    def test_ready_after_first_reading(self, make_service):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port)
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            status, state = health(service)
+            assert status == 200
+            assert state['sensors']['HMT333']['state'] == 'ready'
+            assert set(state['startup']) == {'sensors', 'first_reading'}
+            assert json.loads(service.get_response('/')[2])[
+                'temperature'] == 12.3
+        finally:
+            simulator.close()
+
+    def test_empty_settings(self, make_service):
+        # Build ARGs that aren't set are passed through as empty variables
+        settings = dict.fromkeys((
+            'TEMPS_JOURNAL_FSYNC', 'CONFIG_CHECK_INTERVAL', 'CALIBRATION_MODE',
+            'ASYNC_MODE', 'SAMPLE_INTERVAL', 'STREAM_MODE', 'STREAM_TIMEOUT',
+            'STREAM_RETRY', 'HISTORY_RETENTION', 'INFLUX_MEASUREMENT',
+            'INFLUX_PUSH_URL', 'INFLUX_PUSH_INTERVAL', 'INFLUX_SPOOL',
+            'SERIES_RAW_RETENTION', 'SERIES_MINUTE_RETENTION',
+            'SERIES_HOUR_RETENTION', 'SENSOR_RETRY', 'SSE_BUFFER',
+            'SSE_KEEPALIVE', 'SSE_MAX_CLIENTS', 'HMT333_SENSORS',
+            'FRAME_FIELDS', 'HMT333_FORM'), '')
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port, **settings)
+            assert service.sensor_retry == 30
+            assert service.measurement == 'HMT333-data'
+            assert service.stream_max_clients == 100
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            sensor = service.sensor
+            assert sensor.sample_interval == 0
+            assert sensor.stream_retry == 600
+            assert sensor.config.check_interval == 5
+            assert sensor.config.calibration_mode == 'step'
+            assert service.get_line_protocol()[0].startswith(
+                b'HMT333-data,')
+        finally:
+            simulator.close()
+
+    def test_missing_serial_port_retried(self, make_service):
+        service = make_service('/dev/no-such-port', SENSOR_RETRY='3600')
+        threading.Thread(target=service.initialise_sensors,
+                         daemon=True).start()
+        wait_for(lambda: service.sensor_states.get('HMT333') == 'failed')
+        status, state = health(service)
+        assert status == 503
+        assert state['status'] == 'starting'
+        assert 'no-such-port' in state['sensors']['HMT333']['error']
+
+    def test_stream(self, make_service, monkeypatch):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port, SSE_MAX_CLIENTS='1')
+            monkeypatch.setattr(hmt_service, 'HMTservice', service)
+            server = hmt_service.HMT333server(('127.0.0.1', 0),
+                                              hmt_service.HMT333http)
+            threading.Thread(target=server.serve_forever,
+                             daemon=True).start()
+            service.initialise_sensors()
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', server.server_address[1], timeout=10)
+            connection.request('GET', '/stream')
+            response = connection.getresponse()
+            assert response.getheader('Content-Type') == \
+                'text/event-stream'
+            while response.fp.readline() != b'event: observation\n':
+                pass
+            event = json.loads(response.fp.readline()[len(b'data: '):])
+            assert event['sensor'] == 'HMT333'
+            assert event['temperature'] == 12.3
+            # Only one subscriber allowed
+            other = http.client.HTTPConnection(
+                '127.0.0.1', server.server_address[1], timeout=10)
+            other.request('GET', '/stream')
+            assert other.getresponse().status == 503
+            other.close()
+            connection.close()
+            server.shutdown()
+        finally:
+            simulator.close()
+
+    def test_sensor_settings(self, monkeypatch):
+        monkeypatch.delenv('HMT333_SENSORS', raising=False)
+        monkeypatch.setenv('HMT333_PORT', '/dev/ttyUSB0')
+        assert HMTservice.sensor_settings() == [
+            ('HMT333', '/dev/ttyUSB0', None)]
+        monkeypatch.setenv('HMT333_SENSORS',
+                           'screen1=/dev/ttyUSB0, screen2=/dev/ttyUSB1@2')
+        assert HMTservice.sensor_settings() == [
+            ('screen1', '/dev/ttyUSB0', None),
+            ('screen2', '/dev/ttyUSB1', '2')]
+
+    def test_sensors(self, make_service, tmp_path):
+        simulators = [HmtSimulator(profile=constant(12.3)),
+                      HmtSimulator(profile=constant(12.3))]
+        try:
+            # screen2 has a calibration correction of its own
+            (tmp_path / 'config.ini').write_text(
+                '[CALIBRATION]\n' + ''.join(
+                    name + ' = 0.0\n' for name in CORRECTIONS) +
+                '[CALIBRATION_screen2]\n' + ''.join(
+                    name + ' = 0.5\n' for name in CORRECTIONS))
+            service = make_service(
+                '', HMT333_SENSORS='screen1=' + simulators[0].port +
+                ',screen2=' + simulators[1].port)
+            service.initialise_sensors()
+            wait_for(lambda: all(sensor.sequence >= 1
+                                 for sensor in service.sensors.values()))
+
+            status, _, body = service.get_response('/sensors')
+            readings = json.loads(body)
+            assert status == 200
+            assert list(readings) == ['screen1', 'screen2']
+            assert readings['screen1']['temperature'] == 12.3
+            assert readings['screen2']['temperature'] == 12.8
+            status, _, body = service.get_response('/sensors/screen2')
+            assert status == 200
+            assert json.loads(body)['temperature'] == 12.8
+            # The first sensor is the primary sensor
+            assert json.loads(service.get_response('/')[2])[
+                'temperature'] == 12.3
+            assert service.get_response('/sensors/screen3')[0] == 404
+        finally:
+            for simulator in simulators:
+                simulator.close()
+
+    def test_sensors_sharing_port(self, make_service):
+        simulator = HmtSimulator(profile=constant(12.3), address='1')
+        try:
+            service = make_service(
+                '', HMT333_SENSORS='screen1=' + simulator.port + '@1,'
+                'screen2=' + simulator.port + '@2')
+            service.initialise_sensors()
+            screen1, screen2 = service.sensors.values()
+            assert screen1.link is screen2.link
+            assert screen1.link is serial_link.links[simulator.port]
+            wait_for(lambda: screen1.sequence >= 1)
+            assert 'send 1' in simulator.commands
+            assert 'send 2' in simulator.commands
+
+            # Transactions wait for the link's lock
+            with screen1.link.lock:
+                sequence = screen1.sequence
+                time.sleep(2.5)
+                assert screen1.sequence == sequence
+            wait_for(lambda: screen1.sequence > sequence)
+        finally:
+            simulator.close()
+
+    def test_reading_cache(self, make_service, monkeypatch):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port)
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            sensor = service.sensor
+            sensor.stop()
+            sensor.acquisition_thread.join(5)
+
+            status, headers, body = service.get_response('/')
+            etag = headers['ETag']
+            assert status == 200
+            assert service.get_response('/', etag) == (304, headers, b'')
+
+            # The cached body has its observation age filled in afresh
+            cached = service.serialised[sensor.sensor_id]
+            monotonic = time.monotonic
+            monkeypatch.setattr(hmt_service.time, 'monotonic',
+                                lambda: monotonic() + 5)
+            aged = json.loads(service.get_response('/')[2])
+            monkeypatch.undo()
+            assert service.serialised[sensor.sensor_id] is cached
+            assert aged['obs_age'] == json.loads(body)['obs_age'] + 5
+
+            # A new reading gets a new ETag
+            sequence = sensor.sequence
+            while sensor.sequence == sequence:
+                sensor.get_hmt_data()
+            status, headers, _ = service.get_response('/', etag)
+            assert status == 200
+            assert headers['ETag'] != etag
+        finally:
+            simulator.close()
+
+    def test_metrics_lp(self, make_service, tmp_path):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            # The pusher's thread is left asleep; its queue is checked
+            service = make_service(
+                simulator.port,
+                INFLUX_PUSH_URL='http://127.0.0.1:9/write?db=balena',
+                INFLUX_PUSH_INTERVAL='3600',
+                INFLUX_SPOOL=str(tmp_path / 'spool.lp'))
+            assert service.get_response('/metrics.lp')[2] == b''
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            sensor = service.sensor
+            sensor.stop()
+            sensor.acquisition_thread.join(5)
+
+            status, headers, body = service.get_response('/metrics.lp')
+            assert status == 200
+            assert headers['Content-Type'] == 'text/plain; charset=utf-8'
+            line = body.decode('UTF-8')
+            assert line.startswith('HMT333-data,sensor=' +
+                                   sensor.sensor_id + ' temperature=12.3,')
+            assert line.endswith(' ' + str(int(
+                sensor.obs_time * 1e9)) + '\n')
+            assert service.get_response('/metrics.lp', headers['ETag'])[0] \
+                == 304
+
+            # The same line is queued for writing to InfluxDB
+            pushed = []
+            while not service.pusher.lines.empty():
+                pushed.append(service.pusher.lines.get_nowait())
+            assert pushed[-1] + '\n' == line
+        finally:
+            simulator.close()
+
+    def test_head(self, make_service, monkeypatch):
+        service = make_service('/dev/null')
+        monkeypatch.setattr(hmt_service, 'HMTservice', service)
+        server = hmt_service.HMT333server(('127.0.0.1', 0),
+                                          hmt_service.HMT333http)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            connection = http.client.HTTPConnection(
+                '127.0.0.1', server.server_address[1], timeout=10)
+            connection.request('HEAD', '/')
+            response = connection.getresponse()
+            assert response.status == 200
+            assert int(response.getheader('Content-Length')) == len(
+                service.get_response('/')[2])
+            assert response.read() == b''
+            # The connection is still usable for the next request
+            connection.request('GET', '/')
+            assert json.loads(connection.getresponse().read()) == \
+                hmt_service.EMPTY_FIELDS
+            connection.close()
+        finally:
+            server.shutdown()
+
+    def test_async_mode(self, make_service):
+        simulator = HmtSimulator(profile=constant(12.3))
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        loop = asyncio.new_event_loop()
+        try:
+            service = make_service(simulator.port, ASYNC_MODE='true',
+                                   HMT333_HTTP_PORT=str(port))
+            assert service.async_mode
+            task = loop.create_task(service.run_async())
+
+            def run():
+                # Cancelling the service leaves its connection handlers
+                # running, so cancel those too before the loop is closed
+                with contextlib.suppress(asyncio.CancelledError):
+                    loop.run_until_complete(task)
+                pending = asyncio.all_tasks(loop)
+                for handler in pending:
+                    handler.cancel()
+                loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True))
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            wait_for(lambda: service.state == 'ready')
+            assert 'echo off' in simulator.commands
+
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=10)
+            connection.request('GET', '/')
+            reading = json.loads(connection.getresponse().read())
+            assert reading['temperature'] == 12.3
+            connection.close()
+
+            # The latest observation is sent first, then each new one
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=10)
+            connection.request('GET', '/stream')
+            response = connection.getresponse()
+            assert response.status == 200
+            events = []
+            while len(events) < 2:
+                line = response.fp.readline()
+                if line.startswith(b'data: '):
+                    events.append(json.loads(line[len(b'data: '):]))
+            assert [event['temperature'] for event in events] == [12.3,
+                                                                  12.3]
+            assert events[1]['data_points'] > events[0]['data_points']
+            connection.close()
+
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join(5)
+        finally:
+            simulator.close()
+            loop.close()
+
+    def test_history_pages(self, make_service):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port)
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            sensor = service.sensor
+            sensor.stop()
+            sensor.acquisition_thread.join(5)
+            start = round(time.time()) + 10
+            for i in range(25):
+                sensor.history.add(start + i, 10.0 + i, 20.0, None)
+
+            since = str(start - 0.5)
+            pages = []
+            while since is not None:
+                status, _, body = service.get_response(
+                    '/history?limit=10&since=' + since)
+                assert status == 200
+                page = json.loads(body)
+                pages.append(page['readings'])
+                since = None if page['next'] is None else str(page['next'])
+            assert [len(page) for page in pages] == [10, 10, 5]
+            readings = [reading for page in pages for reading in page]
+            assert readings[0] == [start, 10.0, 20.0, None]
+            assert [reading[0] for reading in readings] == [
+                start + i for i in range(25)]
+
+            # Everything held, from an ISO 8601 time
+            page = json.loads(service.get_response(
+                '/history?since=2000-01-01T00:00:00Z')[2])
+            assert page['fields'] == hmt_service.HISTORY_FIELDS
+            assert len(page['readings']) >= 26
+            assert page['next'] is None
+
+            assert service.get_response('/history?limit=0')[0] == 400
+            assert service.get_response('/history?since=yesterday')[0] == 400
+            assert service.get_response('/history?sensor=other')[0] == 404
+        finally:
+            simulator.close()
+
+    def test_series(self, make_service):
+        simulator = HmtSimulator(profile=constant(12.3))
+        try:
+            service = make_service(simulator.port)
+            service.initialise_sensors()
+            wait_for(lambda: service.state == 'ready')
+            service.sensor.stop()
+            service.sensor.acquisition_thread.join(5)
+            store = service.series[service.sensor.sensor_id]
+            start = (int(time.time()) // 3600 + 1) * 3600
+            for i in range(1081):
+                store.add(start + i * 10, 10.0 + i % 6)
+
+            def series(query):
+                status, _, body = service.get_response(
+                    '/series?start=' + str(start) + '&end=' +
+                    str(start + 10800) + query)
+                assert status == 200
+                return json.loads(body)
+
+            # The range divided by the maximum number of points is finer
+            # than a minute, so the raw readings are used
+            result = series('')
+            assert result['fields'] == hmt_service.SERIES_FIELDS
+            assert (result['tier'], result['step']) == ('raw', 11)
+            result = series('&step=60')
+            assert (result['tier'], result['step']) == ('minute', 60)
+            assert len(result['rows']) == 180
+            assert result['rows'][0] == [start, 12.5, 15.0, 10.0, 6]
+            result = series('&step=3600')
+            assert (result['tier'], result['step']) == ('hour', 3600)
+            assert [row[4] for row in result['rows']] == [360, 360, 360]
+            # Steps are rounded up to whole periods of the tier used
+            result = series('&step=90')
+            assert (result['tier'], result['step']) == ('minute', 120)
+            result = series('&points=3')
+            assert (result['tier'], result['step']) == ('hour', 3600)
+
+            for query in ('step=-1', 'points=0', 'start=yesterday',
+                          'start=' + str(start) + '&end=' + str(start)):
+                status, _, body = service.get_response('/series?' + query)
+                assert status == 400
+                assert 'error' in json.loads(body)
+            assert service.get_response('/series?sensor=other')[0] == 404
+        finally:
+            simulator.close()
@@ -0,0 +1,134 @@
+import http.server
+import os
+import threading
+
+import pytest
+
+from influx import InfluxPusher, format_line
+
+
+def test_format_line():
+    line = format_line('HMT333-data', {'sensor': 'HMT333'},
+                       {'temperature': 12.5, 'max_temp_calc': 15,
+                        'min_temp_calc': None}, 1700000000123000000)
+    assert line == ('HMT333-data,sensor=HMT333 temperature=12.5,'
+                    'max_temp_calc=15.0 1700000000123000000')
+
+
+def test_format_line_escaping():
+    line = format_line('my data', {'site name': 'a,b=c'},
+                       {'temp=1': 1.0}, 0)
+    assert line == r'my\ data,site\ name=a\,b\=c temp\=1=1.0 0'
+
+
+class StubInflux(http.server.BaseHTTPRequestHandler):
+    """InfluxDB write endpoint that records the lines written, or fails
+    with the server's status if it isn't 204."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.status == 204:
+            self.server.lines.extend(body.decode('UTF-8').splitlines())
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def influx():
+    server = http.server.HTTPServer(('127.0.0.1', 0), StubInflux)
+    server.status = 204
+    server.lines = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.write_url = 'http://127.0.0.1:' + str(server.server_port) + \
+        '/write?db=balena&precision=ns'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_pusher(influx, tmp_path, **settings):
+    # The background thread only flushes after an hour; the tests flush
+    return InfluxPusher(influx.write_url, str(tmp_path / 'spool.lp'),
+                        flush_interval=3600, **settings)
+
+
+def test_spooled_lines_resent_once(influx, tmp_path):
+    pusher = make_pusher(influx, tmp_path, batch_size=2)
+    influx.status = 500
+    for number in range(3):
+        pusher.add('m v=' + str(number) + ' ' + str(number))
+    assert not pusher.flush()
+    pusher.add('m v=3 3')
+    assert not pusher.flush()
+    assert os.path.isfile(pusher.spool_path)
+
+    influx.status = 204
+    pusher.add('m v=4 4')
+    assert pusher.flush()
+    assert influx.lines == ['m v=' + str(number) + ' ' + str(number)
+                            for number in range(5)]
+    assert not os.path.isfile(pusher.spool_path)
+
+    # Nothing is sent again
+    assert pusher.flush()
+    assert len(influx.lines) == 5
+
+
+def test_partly_sent_spool(influx, tmp_path, monkeypatch):
+    pusher = make_pusher(influx, tmp_path, batch_size=2)
+    influx.status = 500
+    for number in range(5):
+        pusher.add('m v=' + str(number) + ' ' + str(number))
+    assert not pusher.flush()
+
+    # The first batch of the spool is written and then InfluxDB fails
+    write = pusher.write
+
+    def write_once(lines):
+        monkeypatch.setattr(pusher, 'write', lambda lines: False)
+        influx.status = 204
+        return write(lines)
+
+    monkeypatch.setattr(pusher, 'write', write_once)
+    assert not pusher.flush()
+    with open(pusher.spool_path) as spool:
+        assert spool.read().splitlines() == ['m v=2 2', 'm v=3 3', 'm v=4 4']
+
+    monkeypatch.setattr(pusher, 'write', write)
+    assert pusher.flush()
+    assert influx.lines == ['m v=' + str(number) + ' ' + str(number)
+                            for number in range(5)]
+
+
+def test_spool_limit(influx, tmp_path):
+    line = 'm v=1 1'
+    pusher = make_pusher(influx, tmp_path, spool_limit=5 * (len(line) + 1))
+    influx.status = 500
+    for _ in range(3):
+        pusher.add(line)
+    assert not pusher.flush()
+    # These would take the spool over its limit so are dropped
+    for _ in range(3):
+        pusher.add(line)
+    assert not pusher.flush()
+    pusher.add(line)
+    pusher.add(line)
+    assert not pusher.flush()
+    assert os.path.getsize(pusher.spool_path) == 5 * (len(line) + 1)
+
+    influx.status = 204
+    assert pusher.flush()
+    assert influx.lines == [line] * 5
+
+
+def test_bad_points_dropped(influx, tmp_path):
+    pusher = make_pusher(influx, tmp_path)
+    influx.status = 400
+    pusher.add('bad')
+    assert pusher.flush()
+    assert not os.path.isfile(pusher.spool_path)
@@ -0,0 +1,25 @@
+from line_framer import LineFramer
+
+
+def test_lines_split_across_reads():
+    framer = LineFramer()
+    framer.resync()
+    # The stream starts part way through a line
+    assert framer.feed(b"3 'C\r\nT=  1") == []
+    assert framer.feed(b"2.3 'C\r") == [b"T=  12.3 'C"]
+    assert framer.feed(b"\nT=  12.4 'C\r\nT=  12.5 'C\r\n") == [
+        b"T=  12.4 'C", b"T=  12.5 'C"]
+
+
+def test_garbage_and_dropouts_resynchronise():
+    framer = LineFramer(max_length=16)
+    framer.feed(b'\r\n')
+    assert framer.feed(b"T=  1\xff\x002.3 'C\r\nT=  12.4 'C\r\n") == [
+        b"T=  12.4 'C"]
+    assert framer.feed(b'X' * 40 + b"\r\nT=  12.5 'C\r\n") == [
+        b"T=  12.5 'C"]
+    # A line cut short by a dropout is discarded along with its remainder
+    framer.feed(b'T=  1')
+    framer.pause()
+    assert framer.feed(b"2.6 'C\r\nT=  12.7 'C\r\n") == [b"T=  12.7 'C"]
+    assert framer.discarded == 3
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    frames = Counter('test_frames', 'Frames', labels=('sensor', 'class'),
+                     registry=registry)
+    frames.inc('HMT333', 'data')
+    frames.inc('HMT333', 'data')
+    frames.inc('HMT333', 'empty', amount=3)
+    size = Gauge('test_size', 'Size', registry=registry)
+    registry.add_collector(lambda: size.set(42))
+
+    text = registry.render().decode()
+    assert '# TYPE test_frames counter\n' in text
+    assert 'test_frames_total{sensor="HMT333",class="data"} 2\n' in text
+    assert 'test_frames_total{sensor="HMT333",class="empty"} 3\n' in text
+    assert 'test_size 42\n' in text
+    assert text.endswith('# EOF\n')
+
+
+def test_histogram():
+    registry = Registry()
+    latency = Histogram('test_latency_seconds', 'Latency', (0.1, 1.0),
+                        labels=('path',), unit='seconds', registry=registry)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value, '/')
+
+    text = registry.render().decode()
+    assert '# UNIT test_latency_seconds seconds\n' in text
+    # Buckets are cumulative and include their upper bound
+    assert 'test_latency_seconds_bucket{path="/",le="0.1"} 2\n' in text
+    assert 'test_latency_seconds_bucket{path="/",le="1.0"} 3\n' in text
+    assert 'test_latency_seconds_bucket{path="/",le="+Inf"} 4\n' in text
+    assert 'test_latency_seconds_count{path="/"} 4\n' in text
+    assert 'test_latency_seconds_sum{path="/"} 2.65\n' in text
+
+
+def test_wow_copy_identical():
+    # The WoW service has its own copy of the module (see its header)
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(here, '..', '..', 'metoffice-wow-prod', 'metrics.py')
+    if not os.path.isfile(path):
+        pytest.skip('metoffice-wow-prod not present')
+    with open(os.path.join(here, '..', 'metrics.py'), 'rb') as original, \
+            open(path, 'rb') as copy:
+        assert copy.read() == original.read()
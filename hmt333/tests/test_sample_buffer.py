@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import sample_buffer
+from sample_buffer import SampleBuffer
+
+
+class TestSampleBuffer:
+    def test_mean_over_window(self):
+        samples = SampleBuffer(100)
+        for i in range(30):
+            samples.add(1000.0 + i * 2, float(i))
+        # Samples at 1040..1058 have values 20..29
+        assert samples.mean(1040.0) == (24.5, 10)
+        assert samples.mean(1000.0, 1004.0) == (0.5, 2)
+        assert samples.mean(2000.0) == (None, 0)
+
+    def test_ring_overwrites_oldest(self):
+        samples = SampleBuffer(5)
+        for i in range(12):
+            samples.add(float(i), float(i))
+        assert samples.count == 5
+        assert samples.mean(0.0) == (9.0, 5)
+
+    def test_mean_without_numpy(self, monkeypatch):
+        monkeypatch.setattr(sample_buffer, 'np', None)
+        samples = SampleBuffer(5)
+        for i in range(7):
+            samples.add(float(i), float(i))
+        assert samples.mean(0.0) == (4.0, 5)
+        assert samples.mean(5.0) == (5.5, 2)
+
+    def test_numpy_matches_python(self, monkeypatch):
+        pytest.importorskip('numpy')
+        generator = random.Random(1)
+        readings = [(1000.0 + i * 0.5, round(generator.uniform(-5, 30), 1))
+                    for i in range(1500)]
+        windows = [(1000.0, float('inf')), (1200.0, 1260.0),
+                   (1700.0, 1701.0), (5000.0, float('inf'))]
+
+        def means():
+            samples = SampleBuffer(660)
+            for timestamp, value in readings:
+                samples.add(timestamp, value)
+            return [samples.mean(*window) for window in windows]
+
+        vectorised = means()
+        assert sample_buffer.np is not None
+        monkeypatch.setattr(sample_buffer, 'np', None)
+        for (numpy_mean, numpy_number), (mean, number) in zip(
+                vectorised, means()):
+            assert numpy_number == number
+            assert numpy_mean == pytest.approx(mean)
@@ -0,0 +1,55 @@
+import os
+
+from temp_journal import TempJournal
+
+
+class TestTempJournal:
+    def test_append_and_load(self, tmp_path):
+        journal = TempJournal(str(tmp_path / 'temps.journal'))
+        journal.append(1000.0, 12.5)
+        journal.append(1060.0, -3.25)
+        journal.close()
+        assert TempJournal(str(tmp_path / 'temps.journal')).load() == [
+            (1000.0, 12.5), (1060.0, -3.25)]
+
+    def test_torn_tail_discarded(self, tmp_path):
+        path = str(tmp_path / 'temps.journal')
+        journal = TempJournal(path)
+        journal.append(1000.0, 12.5)
+        journal.close()
+        with open(path, 'ab') as f:
+            f.write(b'\x00\x01\x02\x03\x04')
+        journal = TempJournal(path)
+        assert journal.load() == [(1000.0, 12.5)]
+        assert os.path.getsize(path) == 8 + 12
+        journal.append(1060.0, 13.0)
+        assert journal.load() == [(1000.0, 12.5), (1060.0, 13.0)]
+
+    def test_compact(self, tmp_path):
+        journal = TempJournal(str(tmp_path / 'temps.journal'))
+        for i in range(10):
+            journal.append(1000.0 + i, float(i))
+        assert journal.compact(1007.0) == 3
+        journal.append(1010.0, 10.0)
+        assert [r[1] for r in journal.load()] == [7.0, 8.0, 9.0, 10.0]
+
+    def test_compact_drops_partial_record(self, tmp_path):
+        path = tmp_path / 'temps.journal'
+        journal = TempJournal(str(path))
+        for i in range(5):
+            journal.append(1000.0 + i, float(i))
+        journal.close()
+        with open(path, 'ab') as file:
+            file.write(b'\x01\x02\x03')
+        journal = TempJournal(str(path))
+        assert journal.compact(1002.5) == 2
+        assert journal.load() == [(1003.0, 3.0), (1004.0, 4.0)]
+        # Nothing or everything kept
+        assert journal.compact(0.0) == 2
+        assert journal.compact(2000.0) == 0
+        assert journal.load() == []
+
+    def test_unrecognised_file_replaced(self, tmp_path):
+        path = tmp_path / 'temps.journal'
+        path.write_bytes(b'not a journal')
+        assert TempJournal(str(path)).load() == []
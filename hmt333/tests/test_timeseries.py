@@ -0,0 +1,95 @@
+import math
+
+import pytest
+
+from timeseries import TieredStore
+
+# 2023-03-26T00:00:00Z
+START = 1679788800.0
+
+
+def make_store(path, **retention):
+    return TieredStore(str(path / 'series'), **retention)
+
+
+def test_roll_up(tmp_path):
+    store = make_store(tmp_path)
+    # Readings every 10 s for 2 hours, rising 0.01 deg C per reading
+    for i in range(720):
+        store.add(START + i * 10, 10 + i * 0.01)
+
+    tier, step, rows = store.query(START, START + 600, step=60,
+                                   now=START + 7200)
+    assert (tier, step) == ('minute', 60)
+    assert len(rows) == 10
+    assert rows[0][0] == START
+    assert rows[0][1] == pytest.approx(10.025, abs=0.01)
+    assert rows[0][2:] == [10.05, 10.0, 6]
+
+    tier, step, rows = store.query(START, START + 7200, step=3600,
+                                   now=START + 7200)
+    assert (tier, step) == ('hour', 3600)
+    # The second hour is still in progress
+    assert [row[4] for row in rows] == [360, 360]
+    assert rows[0][2:4] == [13.59, 10.0]
+
+
+def test_coarser_tier_for_older_range(tmp_path):
+    store = make_store(tmp_path, raw_retention=3600)
+    for i in range(720):
+        store.add(START + i * 10, 10.0)
+    # Raw readings are only kept for an hour, so the minute tier is used
+    tier, step, rows = store.query(START, START + 600, now=START + 7200)
+    assert tier == 'minute'
+    tier, step, rows = store.query(START + 5400, START + 5460,
+                                   now=START + 7200)
+    assert tier == 'raw'
+    assert len(rows) == 6
+
+
+def test_downsample_to_step(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(720):
+        store.add(START + i * 10, 10 + i * 0.01)
+    tier, step, rows = store.query(START, START + 7200, step=600,
+                                   now=START + 7200)
+    assert (tier, step) == ('minute', 600)
+    assert len(rows) == 12
+    assert rows[0][4] == 60
+
+
+def test_recover_after_restart(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(90):
+        store.add(START + i * 10, 10.0 + (i == 30))
+    # Restart part way through the second minute of the hour
+    store = make_store(tmp_path)
+    for i in range(90, 360):
+        store.add(START + i * 10, 10.0)
+    store.add(START + 3600, 10.0)
+
+    tier, step, rows = store.query(START, START + 3600, step=3600,
+                                   now=START + 3600)
+    assert tier == 'hour'
+    assert rows == [[START, 10.0, 11.0, 10.0, 360]]
+    tier, step, rows = store.query(START, START + 3600, step=60,
+                                   now=START + 3600)
+    assert len(rows) == 60
+    assert rows[5][2] == 11.0
+    # Out of order readings are skipped
+    store.add(START, 20.0)
+    assert not math.isclose(store.query(
+        START, START + 60, step=60, now=START + 3600)[2][0][2], 20.0)
+
+
+def test_expiry(tmp_path):
+    store = make_store(tmp_path, raw_retention=3600,
+                       minute_retention=86400)
+    store.last_expiry = START
+    # A reading every 5 minutes for 2 days
+    for i in range(577):
+        store.add(START + i * 300, 10.0)
+    raw, minute, hour = (tier.journal.load() for tier in store.tiers)
+    assert raw[0][0] >= START + 86400 - 3600
+    assert minute[0][0] > START
+    assert hour[0][0] == START
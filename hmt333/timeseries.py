@@ -0,0 +1,222 @@
+import logging
+import math
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from temp_journal import TempJournal
+
+# Each aggregate record is the start of its period (seconds since the
+# epoch, float64) followed by the mean, maximum and minimum temperatures
+# (float32) and the number of readings (uint32) - 24 bytes per period.
+AGGREGATE_RECORD = struct.Struct('<dfffI')
+
+SERIES_FIELDS = ['timestamp', 'mean', 'max', 'min', 'count']
+
+# A tier of the store: its name, the length of its periods in seconds (0
+# for the raw readings), how long it is kept (seconds) and its journal.
+Tier = namedtuple('Tier', 'name resolution retention journal')
+
+
+class Aggregate:
+    """Running mean, maximum and minimum of the readings in one period."""
+    __slots__ = ('start', 'total', 'maximum', 'minimum', 'count')
+
+    def __init__(self, start):
+        self.start = start
+        self.total = 0.0
+        self.maximum = -math.inf
+        self.minimum = math.inf
+        self.count = 0
+
+    def add(self, mean, maximum, minimum, count=1):
+        """Add a reading (or the aggregate of several readings)."""
+        self.total += mean * count
+        self.maximum = max(self.maximum, maximum)
+        self.minimum = min(self.minimum, minimum)
+        self.count += count
+
+    def record(self):
+        return (self.start, self.total / self.count, self.maximum,
+                self.minimum, self.count)
+
+
+class TieredStore:
+    """Embedded time series store of the calibrated temperatures, kept in
+    tiers of decreasing resolution: the raw readings (48 hours by default),
+    1 minute aggregates (90 days) and hourly aggregates (10 years). Each
+    aggregate holds the mean, maximum and minimum of its period. Aggregates
+    are rolled up as the readings arrive: the periods in progress are held
+    in memory and appended to their tier's journal (see TempJournal) when
+    they end, so there is no periodic scan of the readings. If the service
+    stops part way through a period, the periods in progress are rebuilt
+    from the raw readings when it restarts. Each tier's journal is
+    compacted once a day to drop what is older than its retention.
+
+    Range queries are answered from the coarsest tier that still has the
+    resolution asked for and holds readings back to the start of the range,
+    so a query over months reads a few thousand hourly records rather than
+    millions of readings."""
+
+    def __init__(self, path, raw_retention=48 * 3600,
+                 minute_retention=90 * 86400, hour_retention=3650 * 86400):
+        """:param path: Location of the store's journals, to which
+        '-raw.journal', '-minute.journal' and '-hour.journal' are added.
+        :param raw_retention: How long to keep the raw readings (seconds).
+        :param minute_retention: How long to keep the 1 minute aggregates
+        (seconds).
+        :param hour_retention: How long to keep the hourly aggregates
+        (seconds, 0 to keep them indefinitely)."""
+        self.tiers = (
+            Tier('raw', 0, raw_retention,
+                 TempJournal(path + '-raw.journal')),
+            Tier('minute', 60, minute_retention,
+                 TempJournal(path + '-minute.journal', AGGREGATE_RECORD)),
+            Tier('hour', 3600, hour_retention or math.inf,
+                 TempJournal(path + '-hour.journal', AGGREGATE_RECORD)))
+        # The aggregates of the periods in progress by tier name
+        self.current = {}
+        self.last_time = -math.inf
+        self.last_expiry = time.time()
+        self.lock = threading.Lock()
+
+        try:
+            self.recover()
+        except OSError as error:
+            logging.info('Unable to load time series store: ' + str(error))
+
+    def recover(self):
+        """Rebuild the aggregates of the periods in progress (and of any
+        periods that ended while the service was stopped) from the raw
+        readings made since the last aggregate of each tier was written."""
+        raw = self.tiers[0].journal
+        last = raw.last()
+        if last is None:
+            return
+        self.last_time = last[0]
+        since = {}
+        for tier in self.tiers[1:]:
+            record = tier.journal.last()
+            since[tier.name] = -math.inf if record is None else \
+                record[0] + tier.resolution
+        readings = raw.load_since(
+            math.nextafter(min(since.values()), -math.inf))
+        for timestamp, temperature in readings:
+            for tier in self.tiers[1:]:
+                if timestamp >= since[tier.name]:
+                    self.roll_up(tier, timestamp, temperature)
+        logging.info('Time series store loaded: ' + str(len(readings)) +
+                     ' readings rolled up')
+
+    def add(self, timestamp, temperature):
+        """Record a reading.
+        :param timestamp: Time of the reading (seconds since the epoch).
+        :param temperature: Calibrated temperature (deg C)."""
+        with self.lock:
+            # Readings must be in time order (e.g. not after the clock has
+            # been stepped back) for the tiers' journals to be searchable.
+            if timestamp <= self.last_time:
+                logging.info('Time series reading out of order - skipped')
+                return
+            self.last_time = timestamp
+            try:
+                self.tiers[0].journal.append(timestamp, temperature)
+                for tier in self.tiers[1:]:
+                    self.roll_up(tier, timestamp, temperature)
+                if timestamp - self.last_expiry > 86400:
+                    self.last_expiry = timestamp
+                    self.expire(timestamp)
+            except OSError as error:
+                logging.info('Unable to save time series reading: ' +
+                             str(error))
+
+    def roll_up(self, tier, timestamp, temperature):
+        """Add a reading to the period in progress of an aggregate tier,
+        first writing the aggregate of the previous period if it has
+        ended."""
+        start = timestamp - timestamp % tier.resolution
+        current = self.current.get(tier.name)
+        if current is not None and current.start != start:
+            tier.journal.append(*current.record())
+            current = None
+        if current is None:
+            current = self.current[tier.name] = Aggregate(start)
+        current.add(temperature, temperature, temperature)
+
+    def expire(self, now):
+        """Remove what is older than its retention from each tier."""
+        for tier in self.tiers:
+            if tier.retention != math.inf:
+                tier.journal.compact(now - tier.retention)
+
+    def choose_tier(self, start, step, now=None):
+        """Choose the tier to answer a range query from: the coarsest tier
+        with periods no longer than the step that is kept back to the start
+        of the range (or the finest tier kept back that far).
+        :param start: Start of the range (seconds since the epoch).
+        :param step: The resolution wanted (seconds).
+        :return: The tier."""
+        if now is None:
+            now = time.time()
+        covering = [tier for tier in self.tiers
+                    if start >= now - tier.retention] or [self.tiers[-1]]
+        usable = [tier for tier in covering if tier.resolution <= step]
+        return usable[-1] if usable else covering[0]
+
+    def query(self, start, end, step=0, max_points=1000, now=None):
+        """Get the readings in a time range, at no finer resolution than the
+        step or the range divided by max_points. The rows of the chosen tier
+        are combined into periods of the step (rounded up to a multiple of
+        the tier's resolution) if it is coarser.
+        :param start: Start of the range (seconds since the epoch).
+        :param end: End of the range (seconds since the epoch).
+        :param step: The resolution wanted (seconds, optional).
+        :param max_points: Maximum number of periods to return.
+        :return: The name of the tier used, the step and a list of rows,
+        oldest first, each [timestamp, mean, max, min, count]."""
+        step = max(step, (end - start) / max_points)
+        tier = self.choose_tier(start, step, now)
+        if tier.resolution == 0:
+            limit = None
+        else:
+            limit = int((end - start) // tier.resolution) + 2
+        records = tier.journal.load_since(
+            math.nextafter(start, -math.inf), limit)
+        if tier.resolution == 0:
+            rows = [(record[0], record[1], record[1], record[1], 1)
+                    for record in records if record[0] < end]
+        else:
+            rows = [record for record in records if record[0] < end]
+            with self.lock:
+                current = self.current.get(tier.name)
+                if current is not None and start <= current.start < end and \
+                        (not rows or rows[-1][0] < current.start):
+                    rows.append(current.record())
+
+        # Periods are whole multiples of the tier's resolution
+        unit = max(tier.resolution, 1)
+        step = math.ceil(step / unit - 1e-9) * unit
+        if step > unit:
+            rows = self.downsample(rows, step)
+        return tier.name, step, [
+            [row[0]] + [round(value, 2) for value in row[1:4]] + [row[4]]
+            for row in rows]
+
+    @staticmethod
+    def downsample(rows, step):
+        """Combine rows into periods of the step (aligned to multiples of
+        the step since the epoch).
+        :return: The combined rows."""
+        combined = []
+        current = None
+        for timestamp, mean, maximum, minimum, count in rows:
+            start = timestamp - timestamp % step
+            if current is None or current.start != start:
+                if current is not None:
+                    combined.append(current.record())
+                current = Aggregate(start)
+            current.add(mean, maximum, minimum, count)
+        if current is not None:
+            combined.append(current.record())
+        return combined
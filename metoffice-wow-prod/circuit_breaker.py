@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Stops requests being made to a service that is failing. After a
+    number of consecutive failures the breaker 'opens' and requests are
+    refused straight away (rather than each waiting for a timeout) until
+    the reset timeout has passed. The breaker then goes 'half-open': a
+    cheap probe of the service is made and, if that succeeds, one real
+    request is let through (any others are refused until its outcome is
+    recorded). If that succeeds the breaker closes again, otherwise it
+    reopens with the reset timeout doubled."""
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60.0,
+                 max_reset_timeout=1800.0, probe=None):
+        """:param name: Name of the service (for logging).
+        :param failure_threshold: Consecutive failures that open the
+        breaker.
+        :param reset_timeout: Time the breaker stays open before it is
+        probed (seconds).
+        :param max_reset_timeout: Maximum time the breaker stays open
+        (seconds).
+        :param probe: Function returning True if the service looks
+        available, or None to let a real request through as the probe."""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.initial_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # When the trial request in the half-open state was let through
+        self.trial_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Check whether a request may be made.
+        :return: True if the request may be made."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                # Only one trial request at a time, unless the last one's
+                # outcome was never recorded
+                if now - self.trial_at < self.reset_timeout:
+                    return False
+                self.trial_at = now
+                return True
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # Claim the trial before probing, so other callers are refused
+            self.state = HALF_OPEN
+            self.trial_at = now
+        if self.probe is not None and not self.probe():
+            with self.lock:
+                self.reopen()
+            return False
+        logging.info(self.name + ' circuit half-open')
+        return True
+
+    def record_success(self):
+        """Record a successful request."""
+        with self.lock:
+            if self.state != CLOSED:
+                logging.info(self.name + ' circuit closed')
+            self.state = CLOSED
+            self.failures = 0
+            self.reset_timeout = self.initial_reset_timeout
+
+    def record_failure(self):
+        """Record a failed request."""
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.reopen()
+            elif self.state == CLOSED and \
+                    self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                logging.info(self.name + ' circuit open after ' +
+                             str(self.failures) + ' failures')
+
+    def reopen(self):
+        """Reopen the breaker after a failed probe, doubling the time until
+        the next one (call with the lock held)."""
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.reset_timeout = min(self.reset_timeout * 2,
+                                 self.max_reset_timeout)
+        logging.info(self.name + ' circuit reopened for ' +
+                     str(round(self.reset_timeout)) + 's')
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from metrics import Counter, Histogram
+
+# Metrics for all the jobs (served at /metrics)
+JOB_DURATION = Histogram(
+    'wow_job_duration_seconds', 'Time taken by each run of a job',
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+    labels=('job',), unit='seconds')
+JOB_RUNS = Counter('wow_job_runs', 'Runs of each job by outcome',
+                   labels=('job', 'outcome'))
+
+
+class JobStats:
+    """Latency and success/failure counts for one kind of job (e.g. the
+    hourly WoW report), logged after each run and added to the job
+    metrics."""
+
+    def __init__(self, name):
+        self.name = name
+        self.successes = 0
+        self.failures = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        # Wall clock time of the last successful run
+        self.last_success = None
+        self.lock = threading.Lock()
+
+    def record(self, latency, success):
+        """Record a run of the job.
+        :param latency: How long the run took (seconds).
+        :param success: True if the run succeeded."""
+        with self.lock:
+            if success:
+                self.successes += 1
+                self.last_success = time.time()
+            else:
+                self.failures += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+        JOB_DURATION.observe(latency, self.name)
+        JOB_RUNS.inc(self.name, 'success' if success else 'failure')
+        logging.info(self.summary())
+
+    def summary(self):
+        """:return: A one line summary of the stats."""
+        runs = self.successes + self.failures
+        mean = self.total_latency / runs if runs else 0.0
+        return (self.name + ': latency ' +
+                format(self.last_latency or 0.0, '.3f') +
+                's (mean ' + format(mean, '.3f') + 's, max ' +
+                format(self.max_latency, '.3f') + 's), successes ' +
+                str(self.successes) + ', failures ' + str(self.failures))
+
+    def run(self, function, *args):
+        """Run a job function and record its latency and outcome. The job
+        fails if it returns False or raises an exception.
+        :return: The function's return value."""
+        start = time.monotonic()
+        success = False
+        try:
+            result = function(*args)
+            success = result is not False
+            return result
+        finally:
+            self.record(time.monotonic() - start, success)
@@ -0,0 +1,143 @@
+# The configuration and metoffice-wow-prod services are built separately,
+# so each has a copy of this module. Both open the same database, so keep
+# the copies identical (the metoffice-wow-prod tests check that they
+# are).
+import csv
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+# Columns of the max/min history (as in the original CSV file)
+COLUMNS = ['DTG', 'TEMP', 'MAX', 'MIN']
+
+
+class MaxMinStore:
+    """History of the daily max/min reports sent to WoW, kept in an SQLite
+    database (in WAL mode) on the shared data volume: the WoW service adds
+    the reports and the configuration app serves them. Reports are keyed by
+    their report time, so a date range is found with an index search rather
+    than reading the whole history, and are read through a cursor a batch at
+    a time so an export of any length runs in constant memory. A version
+    number, incremented with each change, identifies the contents (e.g. for
+    HTTP caching)."""
+
+    def __init__(self, path):
+        """:param path: Location of the SQLite database file."""
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS maxmin ('
+            'report_time TEXT PRIMARY KEY, temperature REAL, '
+            'max_temp REAL, min_temp REAL) WITHOUT ROWID')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            'name TEXT PRIMARY KEY, value REAL NOT NULL)')
+
+    def add(self, report_time, temperature, max_temp, min_temp):
+        """Add a report (replacing any report with the same time).
+        :param report_time: The report time (ISO 8601) e.g.
+        2023-03-26T08:55:00+00:00
+        :param temperature: Temperature (deg C).
+        :param max_temp: Maximum temperature (deg C).
+        :param min_temp: Minimum temperature (deg C)."""
+        self.add_rows([(report_time, temperature, max_temp, min_temp)])
+
+    def add_rows(self, rows):
+        """Add several reports in one transaction."""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO maxmin VALUES (?, ?, ?, ?)',
+                    rows)
+                self.connection.execute(
+                    "INSERT INTO meta VALUES ('version', 1) "
+                    "ON CONFLICT (name) DO UPDATE SET value = value + 1")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('modified', ?)",
+                    (time.time(),))
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def import_csv(self, csv_path):
+        """Import the reports from the CSV file written by earlier versions.
+        The file is then renamed (adding .imported) so it is only imported
+        once."""
+        rows = []
+        with open(csv_path, newline='') as file:
+            for row in csv.reader(file):
+                if len(row) == 4 and row != COLUMNS:
+                    rows.append([row[0]] + [
+                        float(value) if value else None
+                        for value in row[1:]])
+        if rows:
+            self.add_rows(rows)
+        os.replace(csv_path, csv_path + '.imported')
+        logging.info('Imported ' + str(len(rows)) + ' max/min reports from '
+                     + csv_path)
+
+    def version(self):
+        """:return: The version number of the contents and the time they
+        were last changed (seconds since the epoch), both 0 if empty."""
+        with self.lock:
+            values = dict(self.connection.execute(
+                'SELECT name, value FROM meta').fetchall())
+        return int(values.get('version', 0)), values.get('modified', 0.0)
+
+    def rows(self, start=None, end=None, before=None, after=None,
+             limit=None, descending=False, batch=500):
+        """Read reports in report time order.
+        :param start: First date wanted (YYYY-MM-DD, optional).
+        :param end: Last date wanted (YYYY-MM-DD, optional).
+        :param before: Only reports before this report time (optional).
+        :param after: Only reports after this report time (optional).
+        :param limit: Maximum number of reports (optional).
+        :param descending: True for the newest report first.
+        :param batch: Number of reports read from the database at a time.
+        :return: An iterator of (report time, temperature, max_temp,
+        min_temp) tuples."""
+        conditions, parameters = [], []
+        if start:
+            conditions.append('report_time >= ?')
+            parameters.append(date.fromisoformat(start).isoformat())
+        if end:
+            conditions.append('report_time < ?')
+            parameters.append(
+                (date.fromisoformat(end) + timedelta(days=1)).isoformat())
+        if before:
+            conditions.append('report_time < ?')
+            parameters.append(before)
+        if after:
+            conditions.append('report_time > ?')
+            parameters.append(after)
+        query = 'SELECT * FROM maxmin'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY report_time' + (' DESC' if descending else '')
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        return self.read(query, parameters, batch)
+
+    def read(self, query, parameters, batch):
+        """Run a query on a connection of its own (so a long export doesn't
+        hold up anything else) and yield the rows a batch at a time."""
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute(query, parameters)
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            connection.close()
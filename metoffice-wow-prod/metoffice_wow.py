@@ -6,12 +6,30 @@ import logging
 import configparser
 import base64
 import json
-import csv
-from datetime import datetime
-from threading import Timer
+import sqlite3
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from job_stats import JobStats
+from max_min_store import MaxMinStore
+from metrics import REGISTRY, Counter, Gauge, start_server
+from wow_client import ObservationClient, build_wow_message
+from wow_outbox import WowOutbox
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.schedulers.background import BackgroundScheduler
 
+# WoW posting metrics (the latency of each post is in the 'WoW post' job's
+# wow_job_duration_seconds, see JobStats)
+WOW_POSTS = Counter(
+    'wow_posts', 'WoW posts by outcome: accepted, rejected (invalid, not '
+    'retried), retry (rate limited or server error), error (no response) '
+    'or refused (circuit open)', labels=('outcome',))
+WOW_CIRCUIT = Gauge('wow_circuit_state',
+                    'State of the WoW circuit breaker (1 for the current '
+                    'state)', labels=('state',))
+WOW_OUTBOX_PENDING = Gauge('wow_outbox_pending',
+                           'Messages waiting in the outbox to be sent')
+
 
 class WOWservice:
     """Transmit the latest temperature data to the Met Office WoW website
@@ -31,6 +49,10 @@ class WOWservice:
         self.wow_enable = 'false'
         self.wow_site_id = ''
         self.wow_auth_key = ''
+        # Identity (modification time, size and inode) and version of the
+        # config file the WoW settings were read from
+        self.config_stamp = None
+        self.config_version = None
         self.api_key = os.getenv('API_KEY', '')
         self.routine_report = os.getenv('ROUTINE_REPORT', 'true')
         self.max_min_enable = os.getenv('MAX_MIN_ENABLE', 'true')
@@ -50,6 +72,43 @@ class WOWservice:
         # Time period after which data is considered to be 'old' in seconds
         self.old_data_time = float(os.getenv('OLD_DATA_TIME', 360))
 
+        self.client = ObservationClient(
+            self.temperature_url, self.wow_url, self.api_key)
+
+        # Stop posting to WoW while it is failing, probing it cheaply
+        # before letting messages through again.
+        self.wow_breaker = CircuitBreaker(
+            'WoW', probe=self.client.probe_wow)
+        self.stats = {name: JobStats(name) for name in (
+            'hourly report', 'max/min report', 'WoW post', 'internet check')}
+
+        # Messages are queued in the outbox and sent from there, so any made
+        # while the internet connection is down are sent once it returns.
+        self.outbox = WowOutbox(
+            os.getenv('WOW_OUTBOX') or '/data/wow-outbox.db',
+            self.post_wow_message,
+            float(os.getenv('WOW_RETRY_INTERVAL') or 30),
+            deadline=float(os.getenv('WOW_POST_DEADLINE') or 30))
+        self.outbox.start()
+
+        # History of the max/min reports (served by the configuration app).
+        # Reports recorded in the CSV file by earlier versions are imported.
+        self.max_min_store = MaxMinStore(
+            os.getenv('MAXMIN_STORE') or '/data/max-min-temp.db')
+        if os.path.isfile('/data/max-min-temp.csv'):
+            try:
+                self.max_min_store.import_csv('/data/max-min-temp.csv')
+            except (OSError, ValueError, sqlite3.Error) as error:
+                logging.info('Unable to import max/min reports: ' +
+                             str(error))
+
+        # Serve the metrics (for Telegraf) on WOW_METRICS_PORT (0 to not
+        # serve them)
+        REGISTRY.add_collector(self.collect_metrics)
+        metrics_port = int(os.getenv('WOW_METRICS_PORT') or 7576)
+        if metrics_port > 0:
+            start_server(metrics_port)
+
         # Either get WoW configuration data from the UI configuration page
         # or get it from the units environmental variables.
         if self.use_ui_wow == 'true':
@@ -67,28 +126,51 @@ class WOWservice:
         logging.info('SITE ID: ' + self.wow_site_id)
         logging.info('AUTH KEY: ' + str(self.wow_auth_key))
 
-        # Setup the transmission scheduler
-        self.scheduler = BackgroundScheduler()
+        # Setup the transmission scheduler. The jobs only fetch the latest
+        # reading and queue a message (the outbox does the posting) so they
+        # are quick, but each has its own worker so that one can't hold up
+        # another, and a run that starts late still runs.
+        self.scheduler = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(4)},
+            job_defaults={'coalesce': True, 'max_instances': 1,
+                          'misfire_grace_time': 300})
 
         # Setup transmission of WoW messages at X mins past each hour
-        self.scheduler.add_job(self.transmit_wow_data, CronTrigger(
-            minute=self.wow_tx_minute, timezone="UTC"))
+        self.scheduler.add_job(
+            self.stats['hourly report'].run, CronTrigger(
+                minute=self.wow_tx_minute, timezone="UTC"),
+            args=[self.transmit_wow_data])
 
         # Setup transmission of previous 24hr Max/Min temp (included with
         # the hourly temperature report) to WoW at 0900 UTC
-        self.scheduler.add_job(self.transmit_wow_max_min_temp, CronTrigger(
-            hour=self.wow_max_min_hour, minute=self.wow_max_min_minute,
-            timezone="UTC"))
+        self.scheduler.add_job(
+            self.stats['max/min report'].run, CronTrigger(
+                hour=self.wow_max_min_hour, minute=self.wow_max_min_minute,
+                timezone="UTC"),
+            args=[self.transmit_wow_max_min_temp])
+
+        # Check the internet connection every INTERNET_CHECK seconds
+        if self.internet_check_intv > 0:
+            self.scheduler.add_job(
+                self.stats['internet check'].run, IntervalTrigger(
+                    seconds=self.internet_check_intv),
+                args=[self.check_internet])
 
         self.scheduler.start()
-        self.check_internet()
 
     def wow_settings(self):
         """Use Python's 'configparser' to get WoW site credentials from the
         config.ini file (if available). The authorisation code is not stored
-        in plain text but as a base64 string."""
-        logging.info('Getting WoW settings from Configuration....')
+        in plain text but as a base64 string. The config file is replaced
+        whole (never rewritten in place) each time the settings are saved,
+        so the file is only read again if its stat shows it has been
+        replaced."""
         try:
+            stat = os.stat(self.config_location)
+            config_stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if config_stamp == self.config_stamp:
+                return
+            logging.info('Getting WoW settings from Configuration....')
             config_object = configparser.ConfigParser()
             config_object.read(self.config_location)
 
@@ -96,9 +178,14 @@ class WOWservice:
             self.wow_site_id = wow.get("site_id", '')
             self.wow_auth_key = self.decode64(wow.get("auth_code", 'MDAwMDAw'))
             self.wow_enable = wow.get('wow_enable', 'false')
+            self.config_stamp = config_stamp
+            self.config_version = config_object.getint(
+                'META', 'version', fallback=0)
+            logging.info('WoW settings version: ' +
+                         str(self.config_version))
 
-        except (IOError, KeyError):
-            logging.info('IOError or KeyError trying to open config file')
+        except (IOError, KeyError, ValueError, configparser.Error):
+            logging.info('Unable to read WoW settings from config file')
 
     def transmit_wow_data(self):
         """Transmit a formatted data message to the Met Office WoW website.
@@ -115,42 +202,20 @@ class WOWservice:
         logging.info('SITE ID: ' + self.wow_site_id)
         # logging.info('AUTH KEY: ' + str(self.wow_auth_key))
 
-        obs_data = requests.get(self.temperature_url)
-        tempc = obs_data.json()['temperature']
-        obs_age = float(obs_data.json()['obs_age'])
-
-        data = dict()
-        wow_dtg = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        observation = self.get_observation()
+        if observation is None:
+            return False
+        obs_age = observation.obs_age
 
-        data["reportStartDateTime"] = wow_dtg
-        data["reportEndDateTime"] = wow_dtg
-        data["siteId"] = self.wow_site_id
-        data["siteAuthenticationKey"] = self.wow_auth_key
-        data["isPublic"] = "true"
-        data["isLatestVersion"] = "true"
-        data["dryBulbTemperature_Celsius"] = tempc
-        data["collectionName"] = 1
-        data["observationType"] = 1
+        data = build_wow_message(
+            self.wow_site_id, self.wow_auth_key, observation)
 
         logging.info('WOW-MSG prepped:')
-        data = json.dumps(data)
-        logging.info(data)
-
-        wow_url = self.wow_url
-        headers = {
-            'Ocp-Apim-Subscription-Key': self.api_key,
-            'Content-Type': 'application/json'
-        }
+        logging.info(json.dumps(data))
 
         if self.wow_enable == 'true' and obs_age < self.old_data_time \
                 and self.routine_report == 'true':
-            try:
-                req = requests.post(
-                    wow_url, headers=headers, data=data, timeout=20)
-                logging.info('WOW-message transmitted')
-                logging.info(req)
-            except requests.exceptions.RequestException:
-                warnings.warn('Problem/timeout posting msg to WoW URL')
+            self.outbox.add(data)
         else:
             logging.info('Data fails obs age check or WoW Tx not enabled:'
                          ' Obs age: ' + str(obs_age))
@@ -166,52 +231,28 @@ class WOWservice:
         if self.use_ui_wow == 'true':
             self.wow_settings()
 
-        obs_data = requests.get(self.temperature_url)
-        tempc = obs_data.json()['temperature']
-        max_tempc = obs_data.json()['max_temp_calc']
-        min_tempc = obs_data.json()['min_temp_calc']
-        obs_age = float(obs_data.json()['obs_age'])
-        data_points = int(obs_data.json()['data_points'])
-
-        data = dict()
-        wow_dtg = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+00:00")
-
-        data["reportStartDateTime"] = wow_dtg
-        data["reportEndDateTime"] = wow_dtg
-        data["siteId"] = self.wow_site_id
-        data["siteAuthenticationKey"] = self.wow_auth_key
-        data["isPublic"] = "true"
-        data["isLatestVersion"] = "true"
-        data["dryBulbTemperature_Celsius"] = tempc
-        if data_points >= self.data_points_req:
-            data["airTemperatureMax_Celsius"] = max_tempc
-            if self.min_temp_enable == 'true':
-                data["airTemperatureMin_Celsius"] = min_tempc
-        data["collectionName"] = 1
-        data["observationType"] = 1
+        observation = self.get_observation()
+        if observation is None:
+            return False
+        obs_age = observation.obs_age
+        data_points = observation.data_points or 0
 
-        logging.info('WOW-MAX-TEMP-MSG prepped:')
-        data = json.dumps(data)
-        logging.info(data)
+        enough_data = data_points >= self.data_points_req
+        data = build_wow_message(
+            self.wow_site_id, self.wow_auth_key, observation,
+            max_temp=enough_data,
+            min_temp=enough_data and self.min_temp_enable == 'true')
 
-        wow_url = self.wow_url
-        headers = {
-            'Ocp-Apim-Subscription-Key': self.api_key,
-            'Content-Type': 'application/json'
-        }
+        logging.info('WOW-MAX-TEMP-MSG prepped:')
+        logging.info(json.dumps(data))
 
         if self.wow_enable == 'true' and obs_age < self.old_data_time \
                 and data_points > self.data_points_req \
                 and self.max_min_enable == 'true':
-            try:
-                req = requests.post(
-                    wow_url, headers=headers, data=data, timeout=20)
-                logging.info('WOW-MAX-TEMP-message transmitted')
-                logging.info(req)
-                logging.info(req.text)
-            except requests.exceptions.RequestException:
-                warnings.warn('Problem/timeout posting max/min msg to WoW URL')
-            self.record_max_min_to_file([wow_dtg, tempc, max_tempc, min_tempc])
+            self.outbox.add(data)
+            self.record_max_min_to_file([
+                data["reportStartDateTime"], observation.temperature,
+                observation.max_temp, observation.min_temp])
         else:
             logging.info(
                 'Conditions not met for MAX/MIN WoW message - data points: ' +
@@ -219,55 +260,105 @@ class WOWservice:
                 + ' Max/Min enabled: ' + str(self.max_min_enable)
                 + str(self.wow_enable))
 
+    def get_observation(self):
+        """Get the latest reading from the HMT333 container.
+        :return: An Observation or None if the reading isn't available."""
+        try:
+            return self.client.get_observation()
+        except (requests.exceptions.RequestException, ValueError) as error:
+            warnings.warn('Unable to get HMT333 data: ' + str(error))
+            return None
+
+    def collect_metrics(self):
+        """Bring the circuit breaker and outbox gauges up to date (called
+        when the metrics are requested)."""
+        for state in (CLOSED, HALF_OPEN, OPEN):
+            WOW_CIRCUIT.set(int(self.wow_breaker.state == state), state)
+        WOW_OUTBOX_PENDING.set(self.outbox.pending())
+
+    def post_wow_message(self, data):
+        """Post a queued message to the WoW API (called by the outbox).
+        :param data: The message as a JSON string.
+        :return: True if the message was accepted, or was rejected as
+        invalid (so there is no point sending it again), False if it should
+        be retried."""
+        if not self.wow_breaker.allow():
+            WOW_POSTS.inc('refused')
+            return False
+        return self.stats['WoW post'].run(self.send_wow_message, data)
+
+    def send_wow_message(self, data):
+        """Make one attempt to post a message to the WoW API, recording the
+        outcome with the circuit breaker.
+        :param data: The message as a JSON string.
+        :return: As post_wow_message."""
+        try:
+            req = self.client.post_wow(data)
+        except requests.exceptions.RequestException:
+            warnings.warn('Problem/timeout posting msg to WoW URL')
+            self.wow_breaker.record_failure()
+            WOW_POSTS.inc('error')
+            return False
+        logging.info('WOW-message transmitted')
+        logging.info(req)
+        if req.status_code == 429 or req.status_code >= 500:
+            self.wow_breaker.record_failure()
+            WOW_POSTS.inc('retry')
+            return False
+        self.wow_breaker.record_success()
+        if req.status_code >= 400:
+            logging.info('WoW message rejected: ' + req.text)
+            WOW_POSTS.inc('rejected')
+        else:
+            WOW_POSTS.inc('accepted')
+        return True
+
     def check_internet(self):
         """
         Check for an internet connection - if no connection available then
         execute a device reboot. This is useful when Wi-Fi is unreliable.
         The balena supervisor provides reboot functionality within its API.
         INTERNET_CHECK environmental variable sets the time interval for this
-        check in seconds. If set to zero then no checks will be made
+        check in seconds. If set to zero then no checks will be made.
+        The check is run by the scheduler in its own worker so it never
+        delays the WoW reports. If a message has been posted to WoW since the
+        last check the connection is known to be working and no check is
+        needed.
+        :return: True if there is an internet connection.
         """
-        # Schedule this command to be run at a specified interval
-        if self.internet_check_intv > 0:
-            Timer(self.internet_check_intv, self.check_internet).start()
-            logging.info('Checking internet.....')
-            url = 'https://www.google.com'
-            timeout = 5
-            try:
-                _ = requests.get(url, timeout=timeout)
-            except requests.ConnectionError:
-                headers = {
-                    'Content-Type': 'application/json',
-                }
-                params = {
-                    'apikey': os.getenv('BALENA_SUPERVISOR_API_KEY', ''),
-                }
-                _ = requests.post(
-                    os.getenv('BALENA_SUPERVISOR_ADDRESS',
-                              '') + '/v1/reboot',
-                    params=params,
-                    headers=headers)
+        last_post = self.stats['WoW post'].last_success
+        if last_post is not None and \
+                time.time() - last_post < self.internet_check_intv:
+            return True
+
+        logging.info('Checking internet.....')
+        url = 'https://www.google.com'
+        timeout = 5
+        try:
+            _ = requests.get(url, timeout=timeout)
+        except requests.ConnectionError:
+            headers = {
+                'Content-Type': 'application/json',
+            }
+            params = {
+                'apikey': os.getenv('BALENA_SUPERVISOR_API_KEY', ''),
+            }
+            _ = requests.post(
+                os.getenv('BALENA_SUPERVISOR_ADDRESS',
+                          '') + '/v1/reboot',
+                params=params,
+                headers=headers, timeout=timeout)
+            return False
+        return True
 
     def record_max_min_to_file(self, values):
-        # Path to the file
-        file_path = '/data/max-min-temp.csv'
-
-        # Check if the file exists, if so write the values to it.
-        if os.path.isfile(file_path):
-            self.save_to_csv(values, file_path)
-        else:
-            # If the file doesn't exist, create it and write the header row
-            # and then the values.
-            columns = ['DTG', 'TEMP', 'MAX', 'MIN']
-            self.save_to_csv(columns, file_path)
-            self.save_to_csv(values, file_path)
-
-    @staticmethod
-    def save_to_csv(values_list, filename):
-        with open(filename, 'a+', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(values_list)
-        logging.info(f"Values written to {filename}!")
+        """Record a max/min report in the max/min history.
+        :param values: Report time, temperature, max and min temperature."""
+        try:
+            self.max_min_store.add(*values)
+            logging.info('Max/min report recorded: ' + str(values))
+        except sqlite3.Error as error:
+            logging.info('Unable to record max/min report: ' + str(error))
 
     @staticmethod
     def decode64(base64_message):
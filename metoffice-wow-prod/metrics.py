@@ -0,0 +1,209 @@
+# The hmt333 and metoffice-wow-prod services are built separately, so each
+# has a copy of this module. Keep the copies identical (the hmt333 tests
+# check that they are).
+import abc
+import bisect
+import logging
+import math
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def format_value(value):
+    """Format a sample value as OpenMetrics text."""
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    """Format a label set e.g. {sensor="HMT333",class="data"}."""
+    if not names:
+        return ''
+    return '{' + ','.join(
+        name + '="' + str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in zip(names, values)) + '}'
+
+
+class Metric(abc.ABC):
+    """A metric family with zero or more labels. Values are held per label
+    set (a tuple of label values, in the order of the label names)."""
+    type = 'unknown'
+
+    def __init__(self, name, documentation, labels=(), unit='',
+                 registry=None):
+        """:param name: The metric name e.g. hmt333_serial_rtt_seconds.
+        :param documentation: One line description (HELP).
+        :param labels: The label names.
+        :param unit: The unit (which must end the name) e.g. seconds.
+        :param registry: The registry to add the metric to (default
+        REGISTRY)."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.unit = unit
+        self.values = {}
+        self.lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    @abc.abstractmethod
+    def samples(self):
+        """:return: A list of (sample name, label names, label values,
+        value) tuples."""
+
+    def render(self):
+        """:return: The metric family as OpenMetrics text."""
+        lines = ['# TYPE ' + self.name + ' ' + self.type + '\n']
+        if self.unit:
+            lines.append('# UNIT ' + self.name + ' ' + self.unit + '\n')
+        lines.append('# HELP ' + self.name + ' ' + self.documentation + '\n')
+        for name, label_names, label_values, value in self.samples():
+            lines.append(name + format_labels(label_names, label_values) +
+                         ' ' + format_value(value) + '\n')
+        return ''.join(lines)
+
+
+class Counter(Metric):
+    """A count that only goes up e.g. the number of frames received."""
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        """Add to the count for a label set."""
+        with self.lock:
+            self.values[label_values] = \
+                self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + '_total', self.labels, label_values, value)
+                    for label_values, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """A value that can go up and down e.g. a buffer size."""
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        """Set the value for a label set."""
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, self.labels, label_values, value)
+                    for label_values, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """The distribution of a measurement (e.g. a latency) in cumulative
+    buckets, with the count and sum of the measurements. Observing a value
+    is a binary search of the bucket bounds and a few additions."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=(), unit='',
+                 registry=None):
+        """:param buckets: The bucket upper bounds, in increasing order (a
+        +Inf bucket is added)."""
+        super().__init__(name, documentation, labels, unit, registry)
+        self.bounds = [float(bound) for bound in buckets]
+
+    def observe(self, value, *label_values):
+        """Record a measurement for a label set."""
+        with self.lock:
+            values = self.values.get(label_values)
+            if values is None:
+                # Per bucket (not cumulative) counts, then count and sum
+                values = self.values[label_values] = \
+                    [0] * (len(self.bounds) + 1) + [0, 0.0]
+            values[bisect.bisect_left(self.bounds, value)] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def samples(self):
+        samples = []
+        label_names = self.labels + ('le',)
+        with self.lock:
+            for label_values, values in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.bounds + [math.inf], values):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', label_names,
+                                    label_values + (format_value(bound),),
+                                    cumulative))
+                samples.append((self.name + '_count', self.labels,
+                                label_values, values[-2]))
+                samples.append((self.name + '_sum', self.labels,
+                                label_values, values[-1]))
+        return samples
+
+
+class Registry:
+    """The metrics exposed by a service. Collectors (functions called just
+    before the metrics are rendered) can bring gauges up to date, so
+    values that are cheap to read when needed aren't updated on every
+    change."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """:return: All the metrics as OpenMetrics text (bytes)."""
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as error:
+                logging.info('Metrics collector failed: ' + str(error))
+        return (''.join(metric.render() for metric in self.metrics) +
+                '# EOF\n').encode('UTF-8')
+
+
+# The metrics of this service
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answers GET /metrics requests (for services without an HTTP
+    server of their own)."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.partition('?')[0].rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, registry=REGISTRY):
+    """Serve the metrics at /metrics on a port from a background thread.
+    :return: The server."""
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer(('', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics',
+                     daemon=True).start()
+    logging.info('Metrics served on port ' + str(server.server_address[1]))
+    return server
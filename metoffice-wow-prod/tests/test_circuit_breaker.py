@@ -0,0 +1,51 @@
+import time
+
+from circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+def test_opens_after_repeated_failures():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_probe_before_closing():
+    probe_results = [False, True]
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01,
+                             probe=lambda: probe_results.pop(0))
+    breaker.record_failure()
+    time.sleep(0.02)
+    # The failed probe reopens the breaker for twice as long
+    assert not breaker.allow()
+    assert breaker.reset_timeout == 0.02
+    time.sleep(0.03)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.reset_timeout == 0.01
+
+
+def test_one_trial_when_half_open():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Other requests are refused while the trial is in flight
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.11)
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A trial whose outcome is never recorded doesn't block the breaker
+    time.sleep(0.11)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
@@ -0,0 +1,33 @@
+import urllib.request
+
+import pytest
+
+import job_stats
+from job_stats import JobStats
+from metrics import start_server
+
+
+def test_run_records_outcome():
+    stats = JobStats('test job')
+    assert stats.run(lambda: True)
+    assert stats.run(lambda: False) is False
+    with pytest.raises(ValueError):
+        stats.run(int, 'x')
+    assert stats.successes == 1
+    assert stats.failures == 2
+    assert job_stats.JOB_RUNS.values[('test job', 'failure')] == 2
+
+
+def test_metrics_served():
+    JobStats('served job').record(0.2, True)
+    server = start_server(0)
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:' + str(
+                server.server_address[1]) + '/metrics') as response:
+            text = response.read().decode()
+    finally:
+        server.shutdown()
+    assert 'wow_job_duration_seconds_count{job="served job"} 1\n' in text
+    assert 'wow_job_runs_total{job="served job",outcome="success"} 1\n' \
+        in text
+    assert text.endswith('# EOF\n')
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from max_min_store import MaxMinStore
+
+
+def report_time(day):
+    return '2023-03-{:02d}T08:55:00+00:00'.format(day)
+
+
+def test_range_and_paging(tmp_path):
+    store = MaxMinStore(str(tmp_path / 'maxmin.db'))
+    for day in range(1, 32):
+        store.add(report_time(day), 10.0, 15.0 + day / 10, 5.0)
+    # Replacing a report changes the version but not the number of reports
+    store.add(report_time(31), 10.0, 20.0, 5.0)
+    assert store.version()[0] == 32
+
+    rows = list(store.rows(start='2023-03-10', end='2023-03-12'))
+    assert [row[0] for row in rows] == [
+        report_time(10), report_time(11), report_time(12)]
+    assert rows[0][1:] == (10.0, 16.0, 5.0)
+
+    page = list(store.rows(before=report_time(31), limit=3,
+                           descending=True, batch=2))
+    assert [row[0] for row in page] == [
+        report_time(30), report_time(29), report_time(28)]
+    assert list(store.rows(start='2023-03-31'))[0][2] == 20.0
+
+
+def test_import_csv(tmp_path):
+    csv_path = tmp_path / 'max-min-temp.csv'
+    csv_path.write_text('DTG,TEMP,MAX,MIN\r\n' +
+                        report_time(1) + ',10.1,15.2,4.9\r\n' +
+                        report_time(2) + ',11.0,,5.5\r\n')
+    store = MaxMinStore(str(tmp_path / 'maxmin.db'))
+    store.import_csv(str(csv_path))
+    assert list(store.rows()) == [(report_time(1), 10.1, 15.2, 4.9),
+                                  (report_time(2), 11.0, None, 5.5)]
+    assert not csv_path.exists()
+    assert (tmp_path / 'max-min-temp.csv.imported').exists()
+
+
+def test_configuration_copy_identical():
+    # The configuration app has its own copy of the module (see its header)
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(here, '..', '..', 'configuration', 'max_min_store.py')
+    if not os.path.isfile(path):
+        pytest.skip('configuration not present')
+    with open(os.path.join(here, '..', 'max_min_store.py'), 'rb') as \
+            original, open(path, 'rb') as copy:
+        assert copy.read() == original.read()
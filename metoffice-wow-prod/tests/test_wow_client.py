@@ -0,0 +1,49 @@
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from wow_client import Observation, ObservationClient, build_wow_message
+
+READING = {'temperature': 12.3, 'max_temp_calc': 15.1,
+           'min_temp_calc': 4.2, 'data_points': 1440, 'obs_age': 3}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps(READING).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_get_observation():
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ObservationClient('http://127.0.0.1:' + str(server.server_port))
+    try:
+        assert client.get_observation() == Observation(
+            12.3, 15.1, 4.2, 3.0, 1440)
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_build_wow_message():
+    observation = Observation(12.3, 15.1, 4.2, 3.0, 1440)
+    report_time = datetime(2023, 5, 1, 8, 55)
+    data = build_wow_message('site', 'key', observation, report_time)
+    assert data['reportStartDateTime'] == '2023-05-01T08:55:00+00:00'
+    assert data['dryBulbTemperature_Celsius'] == 12.3
+    assert 'airTemperatureMax_Celsius' not in data
+
+    data = build_wow_message('site', 'key', observation, report_time,
+                             max_temp=True, min_temp=True)
+    assert data['airTemperatureMax_Celsius'] == 15.1
+    assert data['airTemperatureMin_Celsius'] == 4.2
@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+from wow_outbox import WowOutbox
+
+
+def message(report_time, temperature):
+    return {'reportStartDateTime': report_time,
+            'dryBulbTemperature_Celsius': temperature}
+
+
+def test_drain_keeps_order_and_deduplicates(tmp_path):
+    sent = []
+    outbox = WowOutbox(str(tmp_path / 'outbox.db'),
+                       lambda payload: sent.append(payload) or True)
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.0))
+    outbox.add(message('2023-05-01T11:10:00+00:00', 11.0))
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.5))
+
+    assert outbox.pending() == 2
+    assert outbox.drain()
+    assert [json.loads(payload)['dryBulbTemperature_Celsius']
+            for payload in sent] == [10.5, 11.0]
+    assert outbox.pending() == 0
+
+
+def test_failed_send_is_kept_and_retried(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = WowOutbox(path, lambda payload: False)
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.0))
+    outbox.add(message('2023-05-01T11:10:00+00:00', 11.0))
+    assert not outbox.drain()
+    assert outbox.pending() == 2
+
+    # The queue survives a restart
+    sent = []
+    outbox = WowOutbox(path, lambda payload: sent.append(payload) or True)
+    assert outbox.drain()
+    assert len(sent) == 2
+
+
+def test_backoff(tmp_path):
+    outbox = WowOutbox(str(tmp_path / 'outbox.db'), lambda payload: True,
+                       retry_delay=10, max_retry_delay=60)
+    outbox.failures = 1
+    assert 5 <= outbox.next_delay() <= 10
+    outbox.failures = 10
+    assert 30 <= outbox.next_delay() <= 60
+
+
+def test_send_deadline(tmp_path):
+    outbox = WowOutbox(str(tmp_path / 'outbox.db'),
+                       lambda payload: time.sleep(0.5) or True,
+                       deadline=0.05)
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.0))
+    start = time.monotonic()
+    assert not outbox.drain()
+    assert time.monotonic() - start < 0.3
+    assert outbox.pending() == 1
+
+
+def test_abandoned_attempt_not_repeated(tmp_path):
+    sent = []
+    release = threading.Event()
+
+    def slow_send(payload):
+        sent.append(payload)
+        release.wait(5)
+        return True
+
+    outbox = WowOutbox(str(tmp_path / 'outbox.db'), slow_send,
+                       deadline=0.05)
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.0))
+    assert not outbox.drain()
+    # The first attempt is still running, so no more are made
+    assert not outbox.drain()
+    assert not outbox.drain()
+    assert len(sent) == 1
+
+    # The abandoned attempt succeeds, so the message isn't sent again
+    release.set()
+    outbox.in_flight[2].result(5)
+    assert outbox.drain()
+    assert len(sent) == 1
+    assert outbox.pending() == 0
+
+
+def test_abandoned_attempt_failed_is_retried(tmp_path):
+    results = [False, True]
+    release = threading.Event()
+
+    def send(payload):
+        release.wait(5)
+        return results.pop(0)
+
+    outbox = WowOutbox(str(tmp_path / 'outbox.db'), send, deadline=0.05)
+    outbox.add(message('2023-05-01T10:10:00+00:00', 10.0))
+    assert not outbox.drain()
+    release.set()
+    outbox.in_flight[2].result(5)
+    assert outbox.drain()
+    assert results == []
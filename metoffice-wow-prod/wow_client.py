@@ -0,0 +1,117 @@
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# The latest reading from the hmt333 service. max_temp, min_temp and
+# data_points are None if the service doesn't report them.
+Observation = namedtuple(
+    'Observation',
+    ['temperature', 'max_temp', 'min_temp', 'obs_age', 'data_points'])
+
+
+class ObservationClient:
+    """HTTP client for the hmt333 service and the WoW API. One pooled
+    session is kept for the life of the service so connections (including
+    the TLS connection to WoW) are reused between jobs, and every request
+    has connect and read timeouts. The module only depends on 'requests'
+    so other services (e.g. the configuration app) can use it too."""
+
+    def __init__(self, temperature_url, wow_url='', api_key='',
+                 connect_timeout=5.0, read_timeout=20.0):
+        """:param temperature_url: URL of the hmt333 service.
+        :param wow_url: URL of the WoW observations API.
+        :param api_key: WoW API subscription key.
+        :param connect_timeout: Deadline for making a connection (seconds).
+        :param read_timeout: Deadline for each read of a response
+        (seconds)."""
+        self.temperature_url = temperature_url
+        self.wow_url = wow_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.wow_headers = {
+            'Ocp-Apim-Subscription-Key': api_key,
+            'Content-Type': 'application/json'
+        }
+
+    def get_observation(self):
+        """Fetch the latest reading from the hmt333 service.
+        :return: An Observation.
+        :raises requests.exceptions.RequestException: If the service can't
+        be reached or doesn't respond in time.
+        :raises ValueError: If the response isn't a valid reading."""
+        response = self.session.get(self.temperature_url,
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        try:
+            data_points = data.get('data_points')
+            return Observation(
+                temperature=data['temperature'],
+                max_temp=data.get('max_temp_calc'),
+                min_temp=data.get('min_temp_calc'),
+                obs_age=float(data['obs_age']),
+                data_points=None if data_points is None
+                else int(data_points))
+        except (KeyError, TypeError) as error:
+            raise ValueError('Invalid hmt333 reading: ' + str(error))
+
+    def post_wow(self, data):
+        """Post a message to the WoW API.
+        :param data: The message as a JSON string.
+        :return: The response.
+        :raises requests.exceptions.RequestException: If WoW can't be
+        reached or doesn't respond in time."""
+        return self.session.post(self.wow_url, headers=self.wow_headers,
+                                 data=data, timeout=self.timeout)
+
+    def probe_wow(self, timeout=3.0):
+        """Cheaply check that the WoW API can be reached (any HTTP response
+        will do).
+        :param timeout: Deadline for the check (seconds).
+        :return: True if WoW responded."""
+        try:
+            self.session.head(self.wow_url, timeout=timeout)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+
+def build_wow_message(site_id, auth_key, observation, report_time=None,
+                      max_temp=False, min_temp=False):
+    """Build a WoW observation message as detailed here:
+    https://wow.metoffice.gov.uk/support/dataformats
+    :param site_id: WoW site ID.
+    :param auth_key: WoW site authentication key.
+    :param observation: The Observation to report.
+    :param report_time: Report time (a UTC datetime), defaults to now.
+    :param max_temp: Include the maximum temperature.
+    :param min_temp: Include the minimum temperature.
+    :return: The message as a dictionary."""
+    if report_time is None:
+        report_time = datetime.utcnow()
+    wow_dtg = report_time.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+    data = dict()
+    data["reportStartDateTime"] = wow_dtg
+    data["reportEndDateTime"] = wow_dtg
+    data["siteId"] = site_id
+    data["siteAuthenticationKey"] = auth_key
+    data["isPublic"] = "true"
+    data["isLatestVersion"] = "true"
+    data["dryBulbTemperature_Celsius"] = observation.temperature
+    if max_temp:
+        data["airTemperatureMax_Celsius"] = observation.max_temp
+    if min_temp:
+        data["airTemperatureMin_Celsius"] = observation.min_temp
+    data["collectionName"] = 1
+    data["observationType"] = 1
+    return data
@@ -0,0 +1,186 @@
+import concurrent.futures
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+
+class WowOutbox:
+    """Persistent store-and-forward queue for WoW observation messages.
+    Every message is written to an SQLite database (in WAL mode, so a power
+    cut can't corrupt it) before being sent, and is only removed once WoW
+    has accepted it. A background thread sends the queued messages oldest
+    first; if WoW can't be reached it stops (so the order is kept) and
+    tries again after an exponential backoff with random jitter. When the
+    connection returns the whole backlog is sent in one go. Messages are
+    keyed by their reportStartDateTime so the same report is never queued
+    twice."""
+
+    def __init__(self, path, send, retry_delay=30.0, max_retry_delay=1800.0,
+                 deadline=30.0):
+        """:param path: Location of the SQLite database file.
+        :param send: Function that posts a message (JSON string) to WoW and
+        returns True if it was accepted (or rejected in a way that retrying
+        won't fix) or False if it should be retried.
+        :param retry_delay: Initial time between retries (seconds).
+        :param max_retry_delay: Maximum time between retries (seconds).
+        :param deadline: Time allowed for each attempt to send a message
+        (seconds). An attempt still running at the deadline is treated as
+        failed and left to finish in the background; no other attempt is
+        made until it has finished."""
+        self.send = send
+        self.deadline = deadline
+        # Attempts are made in worker threads so that they can be abandoned
+        # at the deadline; two workers allow for one abandoned attempt.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix='wow-send')
+        # The (message id, payload, future) of an abandoned attempt that was
+        # still running at its deadline. It may yet succeed, so the message
+        # isn't sent again (which would duplicate the observation) until
+        # the attempt has finished and failed.
+        self.in_flight = None
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Number of consecutive failed attempts to send the oldest message
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'report_time TEXT NOT NULL UNIQUE, '
+            'payload TEXT NOT NULL, '
+            'queued REAL NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0)')
+
+        self.thread = None
+
+    def start(self):
+        """Start the background thread that sends the queued messages."""
+        self.thread = threading.Thread(
+            target=self.run, name='wow-outbox', daemon=True)
+        self.thread.start()
+
+    def add(self, message):
+        """Queue a message for sending. If a message with the same
+        reportStartDateTime is already queued, its payload is replaced but
+        it keeps its place in the queue.
+        :param message: The WoW message (a dictionary).
+        :return: True if the message was queued."""
+        payload = json.dumps(message)
+        try:
+            with self.lock:
+                self.connection.execute(
+                    'INSERT INTO outbox (report_time, payload, queued) '
+                    'VALUES (?, ?, ?) ON CONFLICT (report_time) '
+                    'DO UPDATE SET payload = excluded.payload',
+                    (message['reportStartDateTime'], payload, time.time()))
+        except sqlite3.Error as error:
+            logging.info('Unable to queue WoW message: ' + str(error))
+            return False
+        self.wake_event.set()
+        return True
+
+    def pending(self):
+        """:return: The number of messages waiting to be sent."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def oldest(self):
+        """:return: The (id, payload) of the oldest queued message or None
+        if the queue is empty."""
+        with self.lock:
+            return self.connection.execute(
+                'SELECT id, payload FROM outbox ORDER BY id LIMIT 1'
+            ).fetchone()
+
+    def drain(self):
+        """Send the queued messages, oldest first, until the queue is empty
+        or a message fails to send.
+        :return: True if the queue was emptied."""
+        sent = 0
+        while True:
+            row = self.oldest()
+            if row is None:
+                if sent > 1:
+                    logging.info('Sent ' + str(sent) +
+                                 ' queued messages to WoW')
+                return True
+            message_id, payload = row
+            if not self.attempt(message_id, payload):
+                with self.lock:
+                    self.connection.execute(
+                        'UPDATE outbox SET attempts = attempts + 1 '
+                        'WHERE id = ?', (message_id,))
+                return False
+            with self.lock:
+                self.connection.execute(
+                    'DELETE FROM outbox WHERE id = ?', (message_id,))
+            sent += 1
+
+    def attempt(self, message_id, payload):
+        """Make one attempt to send a message within the deadline. If an
+        abandoned attempt is still running no new attempt is made; if it
+        has since succeeded the message counts as sent.
+        :param message_id: The outbox id of the message.
+        :param payload: The message (JSON string).
+        :return: True if the message was sent."""
+        if self.in_flight is not None:
+            in_flight_id, in_flight_payload, future = self.in_flight
+            if not future.done():
+                logging.info('Earlier WoW message attempt still running')
+                return False
+            self.in_flight = None
+            if in_flight_id == message_id and \
+                    in_flight_payload == payload and \
+                    future.exception() is None and future.result():
+                return True
+
+        future = self.executor.submit(self.send, payload)
+        try:
+            return future.result(timeout=self.deadline)
+        except concurrent.futures.TimeoutError:
+            logging.info('WoW message not sent within ' +
+                         str(self.deadline) + 's')
+            # An attempt still queued is dropped; one that is running is
+            # tracked until it finishes.
+            if not future.cancel():
+                self.in_flight = (message_id, payload, future)
+            return False
+
+    def next_delay(self):
+        """:return: The time to wait before the next retry (seconds) - an
+        exponential backoff with jitter so that many stations coming back
+        online together don't all retry at once."""
+        delay = min(self.retry_delay * 2 ** (self.failures - 1),
+                    self.max_retry_delay)
+        return random.uniform(delay / 2, delay)
+
+    def run(self):
+        """Send queued messages when they are added, retrying with backoff
+        while WoW is unavailable."""
+        while True:
+            self.wake_event.clear()
+            try:
+                drained = self.drain()
+            except sqlite3.Error as error:
+                logging.info('WoW outbox error: ' + str(error))
+                drained = False
+            if drained:
+                self.failures = 0
+                self.wake_event.wait()
+            else:
+                self.failures += 1
+                delay = self.next_delay()
+                logging.info('WoW message not sent - retrying in ' +
+                             str(round(delay)) + 's')
+                # A new message doesn't cut the backoff short
+                time.sleep(delay)